@@ -0,0 +1,49 @@
+"""
+Recompute the similar-item lists of one store or every store.
+
+Lists are updated incrementally by the replica that changes an item; this
+job rebuilds them from scratch, for stores whose lists predate the feature
+or after an update was lost. Meant to run periodically (e.g. from a cron job).
+
+Usage:
+    python build_similar.py [--store STORE_ID]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from bson import ObjectId
+
+from db import catalog_db, COLLECTION_NAME, DB_NAME
+from services.similar_items import similar_items
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.store and not ObjectId.is_valid(args.store):
+        print(f"Invalid store ID format: {args.store}", file=sys.stderr)
+        return 2
+
+    await catalog_db.connect_to_mongodb()
+    try:
+        if args.store:
+            store_ids = [args.store]
+        else:
+            store_ids = [str(store_id) for store_id in await catalog_db.client[DB_NAME][COLLECTION_NAME].distinct("store_id")]
+        items = 0
+        for store_id in store_ids:
+            items += await similar_items.rebuild_store(store_id)
+    finally:
+        await catalog_db.close_mongodb_connection()
+
+    print(json.dumps({"stores": len(store_ids), "items": items}))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Rebuild similar-item lists")
+    parser.add_argument("--store", help="Only rebuild this store's lists")
+    sys.exit(asyncio.run(main(parser.parse_args())))
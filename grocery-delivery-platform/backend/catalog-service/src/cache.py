@@ -0,0 +1,490 @@
+import calendar
+import os
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bson import json_util
+from redis.asyncio import Redis
+
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRedisCache:
+    """Thin wrapper around the shared Redis connection.
+
+    Every operation degrades to a no-op when Redis is not configured or not
+    reachable, so the service keeps working on its in-process caches alone.
+    """
+
+    def __init__(self):
+        self.redis: Optional[Redis] = None
+
+    async def init(self) -> None:
+        """Initialize Redis connection"""
+        if settings.REDIS_URL:
+            self.redis = Redis.from_url(
+                settings.REDIS_URL,
+                password=settings.REDIS_PASSWORD,
+                decode_responses=True
+            )
+            try:
+                await self.redis.ping()
+                logger.info("Redis connection established")
+            except Exception as e:
+                logger.error(f"Redis connection failed: {str(e)}")
+                self.redis = None
+
+    async def close(self) -> None:
+        """Close Redis connection"""
+        if self.redis:
+            await self.redis.close()
+            logger.info("Redis connection closed")
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Get a BSON-aware JSON value from Redis"""
+        if not self.redis:
+            return None
+        try:
+            value = await self.redis.get(key)
+            return json_util.loads(value) if value else None
+        except Exception as e:
+            logger.error(f"Error getting from cache: {str(e)}")
+            return None
+
+    async def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get several values in one round trip"""
+        if not self.redis or not keys:
+            return [None] * len(keys)
+        try:
+            values = await self.redis.mget(keys)
+            return [json_util.loads(value) if value else None for value in values]
+        except Exception as e:
+            logger.error(f"Error getting from cache: {str(e)}")
+            return [None] * len(keys)
+
+    async def set(self, key: str, value: Any, expire: int) -> bool:
+        """Set a BSON-aware JSON value in Redis"""
+        if not self.redis:
+            return False
+        try:
+            await self.redis.set(key, json_util.dumps(value), ex=expire)
+            return True
+        except Exception as e:
+            logger.error(f"Error setting cache: {str(e)}")
+            return False
+
+    async def eval_many(self, script: str, calls: List[Tuple[List[str], List[Any]]]) -> bool:
+        """Run a Lua script once per (keys, args) in one pipelined round trip"""
+        if not self.redis or not calls:
+            return False
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for keys, args in calls:
+                    pipe.eval(script, len(keys), *keys, *args)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error running cache script: {str(e)}")
+            return False
+
+    async def delete(self, *keys: str) -> bool:
+        """Delete values from Redis"""
+        if not self.redis or not keys:
+            return False
+        try:
+            await self.redis.delete(*keys)
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting from cache: {str(e)}")
+            return False
+
+
+class DiskLRU:
+    """Byte-bounded LRU of files under a directory.
+
+    Entries are relative file names. Recency is tracked in process; files
+    already on disk when `load` runs are indexed oldest first by modification
+    time. Another process sharing the directory may evict a file this one
+    still lists, so `get` trusts the filesystem and forgets missing entries.
+    Blocking: call from a worker thread except for `get`, which is one stat.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self) -> None:
+        """Index files already in the directory, e.g. from before a restart."""
+        found = []
+        for path in self.directory.rglob("*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file() and not path.name.startswith("."):
+                found.append((stat.st_mtime, path.relative_to(self.directory).as_posix(), stat.st_size))
+        # Indexed files are older than anything used since, so they go in
+        # front, oldest first
+        for _, name, size in sorted(found, reverse=True):
+            if name not in self._entries:
+                self._entries[name] = size
+                self._entries.move_to_end(name, last=False)
+                self.bytes += size
+        self._evict()
+
+    def get(self, name: str) -> Optional[Path]:
+        path = self.directory / name
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            self.bytes -= self._entries.pop(name, 0)
+            return None
+        if name not in self._entries:
+            # Written by another process
+            self._entries[name] = size
+            self.bytes += size
+        self._entries.move_to_end(name)
+        return path
+
+    def size(self, name: str) -> int:
+        """Bytes of an indexed file, as of its last `get` or `put`."""
+        return self._entries.get(name, 0)
+
+    def put(self, name: str, data: bytes) -> Path:
+        """Store `data` under `name`; written then renamed, so readers never see part of it."""
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+
+        self.bytes += len(data) - self._entries.pop(name, 0)
+        self._entries[name] = len(data)
+        self._evict()
+        return path
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            (self.directory / name).unlink(missing_ok=True)
+            self.bytes -= size
+            self.evictions += 1
+
+
+class LRUCache:
+    """Size- and TTL-bounded in-process LRU cache."""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Store a copy unless a write fenced the key with a newer version
+SET_IF_CURRENT = """
+local fence = redis.call('GET', KEYS[2])
+if fence and tonumber(ARGV[2]) < tonumber(fence) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+# Drop the copy and fence the key at the written version (never lowering it)
+DELETE_AND_FENCE = """
+local fence = redis.call('GET', KEYS[2])
+if not fence or tonumber(ARGV[1]) > tonumber(fence) then
+    redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+# Fence version of a deleted item: no copy is current
+DELETED_VERSION = 2 ** 52
+
+
+def item_version(item: Optional[Dict[str, Any]]) -> Optional[int]:
+    """An item's `updated_at` in milliseconds, as BSON stores it; None if unknown."""
+    updated_at = (item or {}).get("updated_at")
+    if not isinstance(updated_at, datetime):
+        return None
+    return calendar.timegm(updated_at.utctimetuple()) * 1000 + updated_at.microsecond // 1000
+
+
+class ItemCache:
+    """Two-tier read-through cache for catalog item documents.
+
+    Lookups try the in-process LRU first, then the shared Redis tier, then the
+    loader. Invalidation is driven by catalog change events: the writing
+    replica drops both tiers, other replicas drop their local copy when the
+    event reaches them over Redis pub/sub.
+
+    A replica that loaded an item just before another one wrote it could
+    otherwise put its old copy back into Redis after the writer deleted it.
+    The writer therefore also leaves a fence holding the written version
+    (`updated_at`) for ITEM_CACHE_FENCE_TTL, and copies are only stored in
+    Redis by a script that refuses versions older than the fence.
+    """
+
+    KEY_PREFIX = "catalog:item:"
+    FENCE_SUFFIX = ":fence"
+
+    def __init__(self, redis_cache: AsyncRedisCache, max_entries: int, ttl: int, redis_ttl: int, fence_ttl: int):
+        self.redis_cache = redis_cache
+        self.redis_ttl = redis_ttl
+        self.fence_ttl = fence_ttl
+        self.local = LRUCache(max_entries, ttl)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped on every invalidation; a load that raced with one is not cached
+        self._epoch = 0
+
+    def _redis_key(self, item_id: str) -> str:
+        return f"{self.KEY_PREFIX}{item_id}"
+
+    def _redis_keys(self, item_id: str) -> List[str]:
+        key = self._redis_key(item_id)
+        return [key, f"{key}{self.FENCE_SUFFIX}"]
+
+    def _store_call(self, item_id: str, item: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        return self._redis_keys(item_id), [json_util.dumps(item), item_version(item) or 0, self.redis_ttl]
+
+    async def _fence(self, item_ids: List[str], version: Optional[int]) -> None:
+        if version is None:
+            # Unknown written version: refuse every copy loaded before now
+            version = int(time.time() * 1000)
+        await self.redis_cache.eval_many(
+            DELETE_AND_FENCE, [(self._redis_keys(item_id), [version, self.fence_ttl]) for item_id in item_ids]
+        )
+
+    async def get_or_load(
+        self,
+        item_id: str,
+        loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+    ) -> Optional[Dict[str, Any]]:
+        """Return a cached item, loading and caching it on a miss."""
+        item = self.local.get(item_id)
+        if item is not None:
+            self.hits += 1
+            return dict(item)
+
+        epoch = self._epoch
+        item = await self.redis_cache.get(self._redis_key(item_id))
+        if item is not None:
+            self.redis_hits += 1
+            if epoch == self._epoch:
+                self.local.set(item_id, item)
+            return dict(item)
+
+        self.misses += 1
+        item = await loader()
+        if item is None:
+            return None
+        if epoch == self._epoch:
+            await self.set(item_id, item)
+        return dict(item)
+
+    @property
+    def epoch(self) -> int:
+        """Invalidation counter to pass back to `set_many` after a load."""
+        return self._epoch
+
+    async def get_many(self, item_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return every cached item among `item_ids` (local tier, then one MGET)."""
+        found: Dict[str, Dict[str, Any]] = {}
+        remote_ids = []
+        for item_id in item_ids:
+            item = self.local.get(item_id)
+            if item is not None:
+                self.hits += 1
+                found[item_id] = dict(item)
+            else:
+                remote_ids.append(item_id)
+
+        if remote_ids:
+            epoch = self._epoch
+            values = await self.redis_cache.mget([self._redis_key(i) for i in remote_ids])
+            for item_id, item in zip(remote_ids, values):
+                if item is None:
+                    continue
+                self.redis_hits += 1
+                if epoch == self._epoch:
+                    self.local.set(item_id, item)
+                found[item_id] = dict(item)
+        self.misses += len(item_ids) - len(found)
+        return found
+
+    async def set(self, item_id: str, item: Dict[str, Any]) -> None:
+        """Store an item in both tiers (in Redis only if no newer version was written since)."""
+        self.local.set(item_id, item)
+        await self.redis_cache.eval_many(SET_IF_CURRENT, [self._store_call(item_id, item)])
+
+    async def set_many(self, items: Dict[str, Dict[str, Any]], epoch: Optional[int] = None) -> None:
+        """Store several items in both tiers, unless an invalidation happened since `epoch`."""
+        if epoch is not None and epoch != self._epoch:
+            return
+        for item_id, item in items.items():
+            self.local.set(item_id, item)
+        await self.redis_cache.eval_many(
+            SET_IF_CURRENT, [self._store_call(item_id, item) for item_id, item in items.items()]
+        )
+
+    async def invalidate(self, item_id: str, local_only: bool = False, version: Optional[int] = None) -> None:
+        """Drop an item from the local tier and, unless told otherwise, from Redis.
+
+        `version` is the written `updated_at` (see `item_version`); older
+        copies are kept out of Redis for a while. When it is unknown, every
+        copy loaded before the invalidation is.
+        """
+        self._epoch += 1
+        self.invalidations += 1
+        self.local.delete(item_id)
+        if not local_only:
+            await self._fence([item_id], version)
+
+    async def invalidate_many(self, item_ids: List[str], version: Optional[int] = None) -> None:
+        """Drop several items, all written at `version`, from both tiers."""
+        if not item_ids:
+            return
+        self._epoch += 1
+        self.invalidations += len(item_ids)
+        for item_id in item_ids:
+            self.local.delete(item_id)
+        await self._fence(item_ids, version)
+
+    async def on_change(self, change) -> None:
+        """Catalog change listener."""
+        if change.item_id:
+            version = DELETED_VERSION if change.op == "delete" else item_version(change.item)
+            await self.invalidate(change.item_id, local_only=change.remote, version=version)
+        elif change.op in ("bulk", "resync"):
+            # Many items changed or notifications were missed: drop the local tier
+            self._epoch += 1
+            self.local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self.local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.local.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CountCache:
+    """In-process TTL cache of document counts keyed by the normalized filter.
+
+    Entries remember the store they were counted for so a write to one store
+    only drops that store's counts (plus the cross-store ones).
+    """
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, int, Optional[str]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(query: Dict[str, Any], mode: str = "exact") -> str:
+        """Build a stable cache key for a Mongo filter."""
+        return f"{mode}:{json_util.dumps(query, sort_keys=True)}"
+
+    def get(self, key: str) -> Optional[int]:
+        """Return a cached count, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, count, _ = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return count
+
+    def set(self, key: str, count: int, store_id: Optional[str] = None) -> None:
+        """Cache a count for the configured TTL."""
+        self._entries[key] = (time.monotonic() + self.ttl, count, store_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_store(self, store_id: Optional[str]) -> None:
+        """Drop counts that may include items of the given store."""
+        stale = [
+            key for key, (_, _, entry_store) in self._entries.items()
+            if entry_store is None or store_id is None or entry_store == store_id
+        ]
+        for key in stale:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        """Drop every cached count."""
+        self._entries.clear()
+
+    async def on_change(self, change) -> None:
+        """Catalog change listener; stock movements never change a count."""
+        if change.op != "stock":
+            self.invalidate_store(change.store_id)
+
+
+# Create global cache instances
+redis_cache = AsyncRedisCache()
+item_cache = ItemCache(
+    redis_cache,
+    settings.ITEM_CACHE_MAX_ENTRIES,
+    settings.ITEM_CACHE_TTL,
+    settings.ITEM_CACHE_REDIS_TTL,
+    settings.ITEM_CACHE_FENCE_TTL
+)
+count_cache = CountCache(settings.COUNT_CACHE_TTL, settings.COUNT_CACHE_MAX_ENTRIES)
@@ -0,0 +1,47 @@
+"""
+Recount the products of every category and repair drifted counters.
+
+Category product counts are kept up to date incrementally as items are
+written; a counter update that failed, or a write racing a category move,
+leaves them off until this job recounts them from the items. Meant to run
+periodically (e.g. from a cron job).
+
+Usage:
+    python category_counts.py [--store STORE_ID]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from bson import ObjectId
+
+from cache import redis_cache
+from db import catalog_db
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.store and not ObjectId.is_valid(args.store):
+        print(f"Invalid store ID format: {args.store}", file=sys.stderr)
+        return 2
+
+    await catalog_db.connect_to_mongodb()
+    # Repairs are announced so running replicas reload their category trees
+    await redis_cache.init()
+    try:
+        result = await catalog_db.reconcile_category_counts(args.store)
+    finally:
+        await redis_cache.close()
+        await catalog_db.close_mongodb_connection()
+
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Reconcile category product counts")
+    parser.add_argument("--store", help="Only reconcile this store's categories")
+    sys.exit(asyncio.run(main(parser.parse_args())))
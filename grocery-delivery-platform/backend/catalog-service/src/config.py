@@ -1,14 +1,95 @@
 from pydantic_settings import BaseSettings
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     # MongoDB settings
     MONGODB_URL: str = "mongodb://localhost:27017"
     DATABASE_NAME: str = "catalog"
     
+    # Redis settings (shared cache tier and change notifications)
+    REDIS_URL: Optional[str] = None
+    REDIS_PASSWORD: Optional[str] = None
+    CATALOG_EVENTS_CHANNEL: str = "catalog:changes"
+    CATEGORY_EVENTS_CHANNEL: str = "catalog:categories"
+    
+    # Item cache settings
+    ITEM_CACHE_MAX_ENTRIES: int = 10000
+    ITEM_CACHE_TTL: int = 60  # seconds, in-process tier
+    ITEM_CACHE_REDIS_TTL: int = 600  # seconds, shared tier
+    ITEM_CACHE_FENCE_TTL: int = 30  # seconds a write keeps older copies of an item out of the shared tier
+    
+    # Count cache settings
+    COUNT_CACHE_TTL: int = 60  # seconds
+    COUNT_CACHE_MAX_ENTRIES: int = 10000
+    ESTIMATED_COUNT_LIMIT: int = 10000  # estimated totals stop counting here
+    
+    # Search settings
+    SEARCH_ENGINE: str = "mongo"  # default /search engine: "mongo" ($text) or "bm25" (in-process index)
+    SEARCH_INDEX_MAX_STORES: int = 50  # store indexes kept in memory
+    SEARCH_PREFIX_EXPANSIONS: int = 50  # completions tried for the last query word
+    SEARCH_MIN_PREFIX_LENGTH: int = 2
+    SEARCH_SYNONYMS: List[List[str]] = []  # synonym groups added to the built-in grocery ones
+    SPELL_MAX_EDIT_DISTANCE: int = 2  # edits corrected in words longer than four letters (shorter ones get one)
+    SPELL_MIN_WORD_LENGTH: int = 3  # shorter query words are never corrected
+    SPELL_MAX_STORES: int = 50  # store spelling dictionaries kept in memory
+    SUGGEST_MAX_RESULTS: int = 20
+    SUGGEST_CACHE_MAX_ENTRIES: int = 5000  # ranked prefixes kept per store
+    SUGGEST_CACHE_TTL: int = 600
+    
+    # Index advisor settings
+    INDEX_ADVISOR_MAX_SHAPES: int = 200  # distinct list query shapes recorded per replica
+    
+    # Facet settings
+    FACET_PRICE_BOUNDARIES: List[float] = [0, 2, 5, 10, 20, 50]  # histogram bucket edges; the last bucket is open-ended
+    
+    # Bulk import settings
+    IMPORT_BATCH_SIZE: int = 500
+    IMPORT_CHUNK_SIZE: int = 64 * 1024  # bytes read from the upload at a time
+    IMPORT_MAX_REPORTED_ERRORS: int = 1000
+    
+    # Catalog export settings
+    EXPORT_BATCH_SIZE: int = 1000  # items per database round trip
+    EXPORT_CHUNK_SIZE: int = 64 * 1024  # bytes encoded before a chunk is sent
+    EXPORT_GZIP_LEVEL: int = 6
+    
+    # Delta sync settings
+    CHANGES_RETENTION: int = 30 * 24 * 3600  # seconds deletions are remembered; older sync tokens get 410
+    CHANGES_SETTLE_SECONDS: int = 5  # the final sync token lags this far behind, for writes still committing
+    
+    # Similar items settings
+    SIMILAR_ITEMS_K: int = 20  # neighbours stored per item
+    SIMILAR_FEATURE_DIM: int = 256  # hashed feature vector width
+    SIMILAR_MIN_SCORE: float = 0.05  # cosine similarity below which items are not listed
+    SIMILAR_BATCH_SIZE: int = 256  # items scored per matrix product
+    SIMILAR_MAX_STORES: int = 20  # store vector sets kept in memory
+    SIMILAR_UPDATE_DELAY: float = 1.0  # seconds changes to a store are collected before lists are updated
+    
+    # Category tree settings
+    CATEGORY_TREE_MAX_STORES: int = 1000  # store trees kept in memory
+    
+    # Featured shelf settings
+    FEATURED_SHELF_SIZE: int = 50  # items kept per shelf
+    FEATURED_MAX_SHELVES: int = 1000  # store shelves kept in memory
+    FEATURED_SHELF_TTL: int = 300  # seconds; also catches stock and remote changes
+    
+    # Menu snapshot settings
+    MENU_CATEGORY_ITEMS: int = 20  # first-page items per category, as the store listing's default page
+    MENU_QUERY_CONCURRENCY: int = 8  # category page queries a replica runs at once while building snapshots
+    MENU_FEATURED_ITEMS: int = 20
+    MENU_SNAPSHOT_MAX_STORES: int = 200  # store snapshots kept in memory
+    MENU_SNAPSHOT_TTL: int = 300  # seconds; also catches stock changes
+    MENU_SNAPSHOT_DELAY: float = 2.0  # seconds changes to a store are collected before its snapshot is rebuilt
+    MENU_GZIP_LEVEL: int = 9  # compressed once per build, so the slowest level is cheap
+    MENU_CACHE_MAX_AGE: int = 60  # seconds clients and CDNs may reuse a snapshot without revalidating
+    
+    # Stock settings
+    STOCK_RESERVATION_HISTORY: int = 20  # reservation references kept on each item
+    
     # Image settings
     UPLOAD_DIR: str = "/tmp/catalog-images"
     MAX_IMAGE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    IMAGE_UPLOAD_OVERHEAD: int = 64 * 1024  # multipart framing allowed on top of MAX_IMAGE_SIZE
+    IMAGE_CHUNK_SIZE: int = 64 * 1024  # bytes read from an upload at a time
     ALLOWED_IMAGE_TYPES: List[str] = ["image/jpeg", "image/png", "image/webp"]
     IMAGE_SIZES: Dict[str, tuple] = {
         "thumbnail": (150, 150),
@@ -16,6 +97,18 @@ class Settings(BaseSettings):
         "medium": (600, 600),
         "large": (1200, 1200)
     }
+    IMAGE_QUALITY: int = 85  # JPEG quality of resized images
+    IMAGE_WORKERS: int = 2  # resizing processes
+    IMAGE_QUEUE_DEPTH: int = 8  # uploads waiting for a worker before 429s
+    IMAGE_RETRY_AFTER: int = 2  # seconds, sent with 429s
+    IMAGE_GC_GRACE: int = 24 * 3600  # seconds an unreferenced image is kept before collection
+    IMAGE_GC_BATCH_SIZE: int = 1000  # file digests looked up per query
+    IMAGE_MAX_DIMENSION: int = 2400  # largest width or height served by /images/{id}
+    IMAGE_VARIANT_CACHE_BYTES: int = 1024 * 1024 * 1024  # disk kept for on-demand derivatives
+    IMAGE_CACHE_MAX_AGE: int = 365 * 24 * 3600  # seconds; derivatives are immutable
+    IMAGE_PREFERRED_FORMATS: List[str] = ["avif", "webp"]  # picked from Accept in this order, else JPEG
+    IMAGE_BASELINE_MAX_ENTRIES: int = 100000  # variants whose JPEG size is remembered for savings stats
+    IMAGE_BASELINE_SAMPLE_RATE: float = 0.05  # share of non-JPEG renders also encoded as JPEG for savings stats
     
     class Config:
         env_file = ".env"
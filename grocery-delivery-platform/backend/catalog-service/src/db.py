@@ -1,12 +1,27 @@
 import os
+import re
+import uuid
 import logging
-from datetime import datetime
-from typing import List, Optional, Dict, Any
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Iterable, List, Optional, Dict, Any, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
-from models import CatalogItem, CatalogItemUpdate, PaginatedResponse
+from models import (
+    CatalogItem, CatalogItemUpdate, Category, CategoryUpdate, FacetCount, FacetedResponse, ItemChangesResponse,
+    PaginatedResponse, PriceBucket
+)
+from cache import count_cache, item_cache, item_version
+from events import CatalogChange, catalog_events, category_events
+from projection import aggregation_projection, with_fields
+from pagination import (
+    decode_cursor, decode_sync_token, encode_cursor, encode_sync_token, keyset_filter, merge_filters, sort_spec
+)
+from query_shapes import query_shapes
 import pymongo
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CursorNotFound
 from fastapi import HTTPException, status
+from config import settings
 
 
 logger = logging.getLogger(__name__)
@@ -15,6 +30,38 @@ logger = logging.getLogger(__name__)
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "spiceroute")
 COLLECTION_NAME = "catalog_items"
+IMAGES_COLLECTION_NAME = "images"
+CATEGORIES_COLLECTION_NAME = "categories"
+TOMBSTONES_COLLECTION_NAME = "item_tombstones"
+SIMILAR_ITEMS_COLLECTION_NAME = "similar_items"
+
+# Fields counted by `facet_items`
+FACET_FIELDS = ("category", "subcategory", "is_organic", "is_vegan", "is_gluten_free")
+
+
+def counted_category_path(item: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The category path an item adds to the product counts of, if any: available items only."""
+    if item is None or not item.get("available", True):
+        return None
+    return item.get("category_path")
+
+
+def category_count_deltas(changes: Iterable[Tuple[Optional[str], int]]) -> Dict[str, int]:
+    """Per-category product count changes for (category path, change) pairs.
+
+    A change applies to every category on the path, so counts roll up to
+    ancestors; ancestors shared by a removal and an addition cancel out.
+    """
+    deltas: Dict[str, int] = {}
+    for path, change in changes:
+        for category_id in filter(None, (path or "").split("/")):
+            deltas[category_id] = deltas.get(category_id, 0) + change
+    return {category_id: delta for category_id, delta in deltas.items() if delta}
+
+
+def item_count_deltas(item: Optional[Dict[str, Any]], previous: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """Product count changes for an item going from `previous` to `item` (None when absent)."""
+    return category_count_deltas([(counted_category_path(previous), -1), (counted_category_path(item), 1)])
 
 
 class CatalogDB:
@@ -36,17 +83,116 @@ class CatalogDB:
     async def create_indexes(self):
         """Create indexes for the collection."""
         db = self.client[DB_NAME]
-        # Index for store_id to quickly find all items for a specific store
-        await db[COLLECTION_NAME].create_index([("store_id", pymongo.ASCENDING)])
         # Text index for name and description for search functionality
         await db[COLLECTION_NAME].create_index([("name", pymongo.TEXT), ("description", pymongo.TEXT)])
-        # Index for categories and tags for filtering
-        await db[COLLECTION_NAME].create_index([("category", pymongo.ASCENDING)])
+        # Index for tags for filtering
         await db[COLLECTION_NAME].create_index([("tags", pymongo.ASCENDING)])
-        # Index for sorting by price
-        await db[COLLECTION_NAME].create_index([("price", pymongo.ASCENDING)])
-        # Index for finding featured items
-        await db[COLLECTION_NAME].create_index([("featured", pymongo.DESCENDING)])
+        # Compound indexes for the list query shapes: equality fields first, then
+        # the sort key with the _id tie breaker used by keyset pagination, so
+        # filtered and sorted pages are read in index order without a SORT stage.
+        # Dietary flags and price ranges are filtered while walking these.
+        # (store_id alone, category alone and price alone are served by prefixes.)
+        await db[COLLECTION_NAME].create_index([("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+        await db[COLLECTION_NAME].create_index([("price", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+        await db[COLLECTION_NAME].create_index(
+            [("category", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+        )
+        await db[COLLECTION_NAME].create_index(
+            [("category", pymongo.ASCENDING), ("price", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        )
+        await db[COLLECTION_NAME].create_index([("name", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+        )
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("price", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        )
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("category", pymongo.ASCENDING),
+             ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+        )
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("category", pymongo.ASCENDING),
+             ("price", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        )
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("subcategory", pymongo.ASCENDING),
+             ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+        )
+        # Whole-store exports, read in _id order
+        await db[COLLECTION_NAME].create_index([("store_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+        # Delta sync: a store's changes in (time, _id) order; deletions are
+        # remembered for CHANGES_RETENTION
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        )
+        await db[TOMBSTONES_COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("deleted_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        )
+        await db[TOMBSTONES_COLLECTION_NAME].create_index(
+            [("deleted_at", pymongo.ASCENDING)], expireAfterSeconds=settings.CHANGES_RETENTION
+        )
+        # Similar-item lists; a store rebuild drops the lists it did not rewrite
+        await db[SIMILAR_ITEMS_COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("updated_at", pymongo.ASCENDING)]
+        )
+        # Featured items, optionally for one store
+        await db[COLLECTION_NAME].create_index([("featured", pymongo.DESCENDING), ("store_id", pymongo.ASCENDING)])
+        # Upsert keys used by bulk imports; the name one also serves sort_by=name
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("sku", pymongo.ASCENDING)],
+            unique=True,
+            partialFilterExpression={"sku": {"$type": "string"}}
+        )
+        await db[COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("name", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        )
+        # Items of a category subtree (anchored prefix match on the materialized path)
+        await db[COLLECTION_NAME].create_index([("store_id", pymongo.ASCENDING), ("category_path", pymongo.ASCENDING)])
+        await db[CATEGORIES_COLLECTION_NAME].create_index(
+            [("store_id", pymongo.ASCENDING), ("path", pymongo.ASCENDING)], unique=True
+        )
+        await db[CATEGORIES_COLLECTION_NAME].create_index([("parent_id", pymongo.ASCENDING)])
+        # Released images, for garbage collection
+        await db[IMAGES_COLLECTION_NAME].create_index([("refs", pymongo.ASCENDING), ("released_at", pymongo.ASCENDING)])
+    
+    async def count_items(self, query: Dict[str, Any], count_mode: str = "cached") -> Tuple[int, bool]:
+        """Count items matching a filter.
+
+        Modes:
+        - exact: always run `count_documents` (and refresh the cache).
+        - cached: reuse a count for the same normalized filter for a short TTL.
+        - estimated: use collection metadata for unfiltered totals and stop
+          counting at `ESTIMATED_COUNT_LIMIT` otherwise.
+
+        Returns the count and whether it is an estimate.
+        """
+        db = self.client[DB_NAME]
+        store_id = query.get("store_id")
+        store_key = str(store_id) if store_id is not None else None
+        
+        if count_mode == "estimated":
+            key = count_cache.make_key(query, "estimated")
+            total = count_cache.get(key)
+            if total is None:
+                if not query:
+                    total = await db[COLLECTION_NAME].estimated_document_count()
+                else:
+                    total = await db[COLLECTION_NAME].count_documents(
+                        query, limit=settings.ESTIMATED_COUNT_LIMIT
+                    )
+                count_cache.set(key, total, store_key)
+            return total, not query or total >= settings.ESTIMATED_COUNT_LIMIT
+        
+        key = count_cache.make_key(query)
+        if count_mode == "cached":
+            total = count_cache.get(key)
+            if total is not None:
+                return total, False
+        
+        total = await db[COLLECTION_NAME].count_documents(query)
+        count_cache.set(key, total, store_key)
+        return total, False
     
     async def get_item_by_id(self, item_id: str) -> Optional[Dict[str, Any]]:
         """Get a catalog item by its ID."""
@@ -57,7 +203,10 @@ class CatalogDB:
             )
         
         db = self.client[DB_NAME]
-        item = await db[COLLECTION_NAME].find_one({"_id": ObjectId(item_id)})
+        item = await item_cache.get_or_load(
+            item_id,
+            lambda: db[COLLECTION_NAME].find_one({"_id": ObjectId(item_id)})
+        )
         
         if not item:
             raise HTTPException(
@@ -67,18 +216,201 @@ class CatalogDB:
             
         return item
     
+    async def get_items_by_ids(self, item_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get many catalog items at once, keyed by ID.
+
+        Cached items are served from the item cache; the rest are fetched with
+        a single `$in` query. Invalid and unknown IDs are simply absent from
+        the result.
+        """
+        wanted = list(dict.fromkeys(i for i in item_ids if ObjectId.is_valid(i)))
+        found = await item_cache.get_many(wanted)
+        
+        missing = [i for i in wanted if i not in found]
+        if missing:
+            db = self.client[DB_NAME]
+            epoch = item_cache.epoch
+            cursor = db[COLLECTION_NAME].find({"_id": {"$in": [ObjectId(i) for i in missing]}})
+            loaded = {str(item["_id"]): item for item in await cursor.to_list(length=len(missing))}
+            await item_cache.set_many(loaded, epoch)
+            found.update((item_id, dict(item)) for item_id, item in loaded.items())
+        
+        return found
+    
     async def create_item(self, item_data: CatalogItem) -> Dict[str, Any]:
         """Create a new catalog item."""
         db = self.client[DB_NAME]
         item_dict = item_data.dict(by_alias=True)
+        item_dict["category_path"] = await self.item_category_path(item_dict["store_id"], item_dict.get("category_id"))
         
         # Insert the new item
         result = await db[COLLECTION_NAME].insert_one(item_dict)
         
         # Get the newly created item
         new_item = await db[COLLECTION_NAME].find_one({"_id": result.inserted_id})
+        await self.apply_category_counts(item_count_deltas(new_item, None))
+        
+        await catalog_events.publish(CatalogChange(
+            op="create",
+            store_id=str(new_item["store_id"]),
+            item_id=str(new_item["_id"]),
+            item=new_item
+        ))
         return new_item
     
+    async def category_paths(self, store_oid: ObjectId, category_ids: List[ObjectId]) -> Dict[ObjectId, str]:
+        """Materialized paths of a store's categories by ID; unknown IDs are absent."""
+        db = self.client[DB_NAME]
+        cursor = db[CATEGORIES_COLLECTION_NAME].find(
+            {"_id": {"$in": list(set(category_ids))}, "store_id": store_oid}, {"path": 1}
+        )
+        return {category["_id"]: category["path"] async for category in cursor}
+    
+    async def item_category_path(self, store_oid: ObjectId, category_id: Optional[ObjectId]) -> Optional[str]:
+        """The `category_path` stored on an item, checking the category belongs to its store."""
+        if category_id is None:
+            return None
+        paths = await self.category_paths(store_oid, [category_id])
+        if category_id not in paths:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown category {category_id} for store {store_oid}"
+            )
+        return paths[category_id]
+    
+    async def apply_category_counts(self, deltas: Dict[str, int]) -> None:
+        """Add per-category product count changes to the stored counters.
+
+        A failure is logged rather than failing the item write; the counters
+        are then off until `reconcile_category_counts` runs.
+        """
+        if not deltas:
+            return
+        db = self.client[DB_NAME]
+        try:
+            await db[CATEGORIES_COLLECTION_NAME].bulk_write([
+                UpdateOne({"_id": ObjectId(category_id)}, {"$inc": {"product_count": delta}})
+                for category_id, delta in deltas.items()
+            ], ordered=False)
+        except Exception as e:
+            logger.error(f"Error updating category product counts: {str(e)}")
+    
+    async def reconcile_category_counts(self, store_id: Optional[str] = None) -> Dict[str, int]:
+        """Recount the products of every category (of one store, or all) and repair drifted counters.
+
+        Counters are only overwritten if they still hold the value read, so
+        an increment racing with the recount is not lost; the next run picks
+        up anything left. Stores with repaired counters get a category
+        "bulk" change so in-memory trees reload them.
+        """
+        db = self.client[DB_NAME]
+        query = {"store_id": ObjectId(store_id)} if store_id else {}
+        categories = {
+            str(category["_id"]): category
+            async for category in db[CATEGORIES_COLLECTION_NAME].find(query, {"store_id": 1, "product_count": 1})
+        }
+        if not categories:
+            return {"categories": 0, "repaired": 0}
+        
+        pipeline = [
+            {"$match": {**query, "category_path": {"$ne": None}, "available": {"$ne": False}}},
+            {"$group": {"_id": "$category_path", "count": {"$sum": 1}}},
+        ]
+        groups = await db[COLLECTION_NAME].aggregate(pipeline).to_list(length=None)
+        counts = category_count_deltas((group["_id"], group["count"]) for group in groups)
+        
+        repairs, stores = [], set()
+        for category_id, category in categories.items():
+            actual, stored = counts.get(category_id, 0), category.get("product_count")
+            if actual != stored:
+                repairs.append(UpdateOne(
+                    {"_id": category["_id"], "product_count": stored},
+                    {"$set": {"product_count": actual}}
+                ))
+                stores.add(str(category["store_id"]))
+        repaired = 0
+        if repairs:
+            result = await db[CATEGORIES_COLLECTION_NAME].bulk_write(repairs, ordered=False)
+            repaired = result.modified_count
+            for repaired_store in stores:
+                await category_events.publish(CatalogChange(op="bulk", store_id=repaired_store))
+        
+        logger.info(f"Reconciled product counts of {len(categories)} categories, repaired {repaired}")
+        return {"categories": len(categories), "repaired": repaired}
+    
+    async def bulk_upsert_items(self, store_id: str,
+                                items: List[CatalogItem]) -> Tuple[int, int, List[Tuple[int, str]]]:
+        """Upsert a batch of validated items for one store in a single bulk_write.
+
+        Items are matched on `sku` when they have one and on `name` otherwise.
+        Returns the inserted and updated counts plus (batch index, message)
+        for every item the server rejected. Rows carry no pre-image to count
+        from, so category product counts are left to the caller to recount
+        with `reconcile_category_counts` once its batches are written.
+        """
+        db = self.client[DB_NAME]
+        store_oid = ObjectId(store_id)
+        now = datetime.utcnow()
+        
+        paths = await self.category_paths(store_oid, [item.category_id for item in items if item.category_id])
+        
+        operations, keys, rows = [], [], []
+        errors: List[Tuple[int, str]] = []
+        for row, item in enumerate(items):
+            if item.category_id and item.category_id not in paths:
+                errors.append((row, f"Unknown category {item.category_id}"))
+                continue
+            # Only the fields the row supplied overwrite an existing item;
+            # model defaults apply to new items alone
+            doc = item.dict(by_alias=True, exclude_unset=True)
+            for field in ("_id", "created_at", "category_path"):
+                doc.pop(field, None)
+            doc["store_id"] = store_oid
+            doc["updated_at"] = now
+            if "category_id" in doc:
+                doc["category_path"] = paths.get(item.category_id)
+            if not doc.get("sku"):
+                # Rows without a SKU must not wipe the SKU of the item they match
+                doc.pop("sku", None)
+            on_insert = {
+                field: value for field, value in item.dict(by_alias=True).items() if field not in doc
+            }
+            if doc.get("sku"):
+                key = {"store_id": store_oid, "sku": doc["sku"]}
+            else:
+                key = {"store_id": store_oid, "name": doc["name"]}
+            keys.append(key)
+            rows.append(row)
+            operations.append(UpdateOne(key, {"$set": doc, "$setOnInsert": on_insert}, upsert=True))
+        
+        details: Dict[str, Any] = {}
+        try:
+            if operations:
+                result = await db[COLLECTION_NAME].bulk_write(operations, ordered=False)
+                details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            errors += [(rows[err["index"]], err.get("errmsg", "Write failed")) for err in details.get("writeErrors", [])]
+        
+        inserted = details.get("nUpserted", 0)
+        updated = details.get("nMatched", 0)
+        
+        upserted_ids = {entry["_id"] for entry in details.get("upserted", [])}
+        existing_ids: List[str] = []
+        if updated:
+            # Drop cached copies of the items that already existed
+            cursor = db[COLLECTION_NAME].find({"$or": keys}, {"_id": 1})
+            existing_ids = [
+                str(existing["_id"]) for existing in await cursor.to_list(length=None)
+                if existing["_id"] not in upserted_ids
+            ]
+            await item_cache.invalidate_many(existing_ids, item_version({"updated_at": now}))
+        
+        await catalog_events.publish(CatalogChange(
+            op="bulk", store_id=store_id, item_ids=[str(item_id) for item_id in upserted_ids] + existing_ids
+        ))
+        return inserted, updated, errors
+    
     async def update_item(self, item_id: str, update_data: CatalogItemUpdate) -> Dict[str, Any]:
         """Update an existing catalog item."""
         if not ObjectId.is_valid(item_id):
@@ -96,22 +428,43 @@ class CatalogDB:
             # No valid fields to update
             return await self.get_item_by_id(item_id)
         
+        if "category_id" in update_dict:
+            current = await db[COLLECTION_NAME].find_one({"_id": ObjectId(item_id)}, {"store_id": 1})
+            if current is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Item with ID {item_id} not found"
+                )
+            update_dict["category_path"] = await self.item_category_path(current["store_id"], update_dict["category_id"])
+        
         # Add updated_at timestamp
         update_dict["updated_at"] = datetime.utcnow()
         
-        # Use the $set operator to update only the fields provided
-        result = await db[COLLECTION_NAME].update_one(
+        # Use the $set operator to update only the fields provided. The
+        # pre-image is returned so listeners can see what changed; $set only
+        # replaces top-level fields, so the post-image is a plain merge.
+        previous = await db[COLLECTION_NAME].find_one_and_update(
             {"_id": ObjectId(item_id)},
-            {"$set": update_dict}
+            {"$set": update_dict},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Item with ID {item_id} not found"
             )
         
-        return await self.get_item_by_id(item_id)
+        updated_item = {**previous, **update_dict}
+        await self.apply_category_counts(item_count_deltas(updated_item, previous))
+        await catalog_events.publish(CatalogChange(
+            op="update",
+            store_id=str(updated_item["store_id"]),
+            item_id=item_id,
+            item=updated_item,
+            previous=previous
+        ))
+        return updated_item
     
     async def delete_item(self, item_id: str) -> bool:
         """Delete a catalog item by its ID."""
@@ -122,45 +475,92 @@ class CatalogDB:
             )
         
         db = self.client[DB_NAME]
-        result = await db[COLLECTION_NAME].delete_one({"_id": ObjectId(item_id)})
+        deleted = await db[COLLECTION_NAME].find_one_and_delete({"_id": ObjectId(item_id)})
         
-        if result.deleted_count == 0:
+        if deleted is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Item with ID {item_id} not found"
             )
+        # Tells delta-sync clients the item is gone
+        await db[TOMBSTONES_COLLECTION_NAME].update_one(
+            {"_id": deleted["_id"]},
+            {"$set": {"store_id": deleted["store_id"], "deleted_at": datetime.utcnow()}},
+            upsert=True
+        )
+        await self.apply_category_counts(item_count_deltas(None, deleted))
         
+        await catalog_events.publish(CatalogChange(
+            op="delete",
+            store_id=str(deleted["store_id"]),
+            item_id=item_id,
+            previous=deleted
+        ))
         return True
     
     async def list_items(self, skip: int = 0, limit: int = 20, 
                         filters: Dict[str, Any] = None,
                         sort_by: str = "created_at",
-                        sort_desc: bool = True) -> PaginatedResponse:
-        """List catalog items with pagination, filtering and sorting."""
+                        sort_desc: bool = True,
+                        after: Optional[str] = None,
+                        include_total: bool = False,
+                        count_mode: str = "cached",
+                        projection: Optional[Dict[str, Any]] = None) -> PaginatedResponse:
+        """List catalog items with pagination, filtering and sorting.
+
+        Pages are addressed either by offset (`skip`) or by an opaque keyset
+        cursor (`after`) taken from `next_cursor` of the previous page. Cursor
+        pages cost the same at any depth. The total is only counted when the
+        caller sets `include_total`; `count_mode` picks how it is counted (see
+        `count_items`).
+        `projection` is passed to `find`; inclusion projections also return
+        the sort key, which the next cursor is built from.
+        """
         db = self.client[DB_NAME]
         query = filters or {}
         
         # Get total count for pagination
-        total = await db[COLLECTION_NAME].count_documents(query)
+        total, total_estimated = None, False
+        if include_total:
+            total, total_estimated = await self.count_items(query, count_mode)
         
-        # Sort direction
-        sort_direction = pymongo.DESCENDING if sort_desc else pymongo.ASCENDING
+        page_query = query
+        if after:
+            sort_value, last_id = decode_cursor(after, sort_by, sort_desc)
+            page_query = merge_filters(query, keyset_filter(sort_by, sort_desc, sort_value, last_id))
+            skip = 0
         
-        # Get paginated results
-        cursor = db[COLLECTION_NAME].find(query).sort(sort_by, sort_direction).skip(skip).limit(limit)
-        items = await cursor.to_list(length=limit)
+        sort = sort_spec(sort_by, sort_desc)
+        query_shapes.record(page_query, sort)
+        
+        # Fetch one extra item to know whether another page exists
+        cursor = db[COLLECTION_NAME].find(page_query, with_fields(projection, sort_by)).sort(sort)
+        if skip:
+            cursor = cursor.skip(skip)
+        items = await cursor.limit(limit + 1).to_list(length=limit + 1)
+        
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(items[-1], sort_by, sort_desc)
         
         return PaginatedResponse(
             total=total,
-            page=skip // limit + 1,
+            page=None if after else skip // limit + 1,
             limit=limit,
-            items=items
+            items=items,
+            next_cursor=next_cursor,
+            total_estimated=total_estimated
         )
     
     async def get_store_items(self, store_id: str, skip: int = 0, limit: int = 20,
                              filters: Dict[str, Any] = None,
                              sort_by: str = "created_at",
-                             sort_desc: bool = True) -> PaginatedResponse:
+                             sort_desc: bool = True,
+                             after: Optional[str] = None,
+                             include_total: bool = False,
+                             count_mode: str = "cached",
+                             projection: Optional[Dict[str, Any]] = None) -> PaginatedResponse:
         """Get all items for a specific store with pagination, filtering and sorting."""
         if not ObjectId.is_valid(store_id):
             raise HTTPException(
@@ -172,15 +572,197 @@ class CatalogDB:
         query = filters or {}
         query["store_id"] = ObjectId(store_id)
         
-        return await self.list_items(skip, limit, query, sort_by, sort_desc)
+        return await self.list_items(
+            skip, limit, query, sort_by, sort_desc, after, include_total, count_mode, projection
+        )
+    
+    async def get_item_changes(self, store_id: str, since: Optional[str] = None, limit: int = 500,
+                               projection: Optional[Dict[str, Any]] = None) -> ItemChangesResponse:
+        """Items of a store created or updated, and IDs of items deleted, after a sync token.
+
+        Changes are read in (time, _id) order from the (store_id, updated_at,
+        _id) index and from the tombstones of deleted items, so a sync costs
+        work proportional to the changes. Without a token every item is
+        returned. The token after the last page is CHANGES_SETTLE_SECONDS in
+        the past: a write stamped just before a sync may commit after it, so
+        the next sync repeats that window rather than missing it. That token
+        expires (410) after CHANGES_RETENTION, when deletions since it may
+        have been forgotten; tokens of the pages in between do not.
+        """
+        if not ObjectId.is_valid(store_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid store ID format: {store_id}"
+            )
+        
+        db = self.client[DB_NAME]
+        now = datetime.utcnow()
+        since_time, since_id = decode_sync_token(since) if since else (None, None)
+        # Only a finished sync's token is checked: page tokens carry the time
+        # of the last item sent, which is old for old items in a first download
+        if since_id is None and since_time is not None \
+                and since_time < now - timedelta(seconds=settings.CHANGES_RETENTION):
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="Sync token is older than the change history, download the whole catalog again"
+            )
+        
+        def changed_after(field: str) -> Dict[str, Any]:
+            if since_time is None:
+                return {}
+            if since_id is None:
+                return {field: {"$gte": since_time}}
+            return {"$or": [{field: {"$gt": since_time}}, {field: since_time, "_id": {"$gt": since_id}}]}
+        
+        store_oid = ObjectId(store_id)
+        items = await db[COLLECTION_NAME].find(
+            {"store_id": store_oid, **changed_after("updated_at")}, with_fields(projection, "updated_at")
+        ).sort([("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]).to_list(length=limit + 1)
+        tombstones = [] if since_time is None else await db[TOMBSTONES_COLLECTION_NAME].find(
+            {"store_id": store_oid, **changed_after("deleted_at")}, {"deleted_at": 1}
+        ).sort([("deleted_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]).to_list(length=limit + 1)
+        
+        # Each list holds at most limit + 1 changes in order, so the first
+        # `limit` of the merge are the next `limit` changes overall
+        changes = sorted(
+            [(item["updated_at"], item["_id"], item) for item in items] +
+            [(tombstone["deleted_at"], tombstone["_id"], None) for tombstone in tombstones],
+            key=lambda change: change[:2]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        
+        if has_more:
+            next_token = encode_sync_token(changes[-1][0], changes[-1][1])
+        else:
+            next_token = encode_sync_token(now - timedelta(seconds=settings.CHANGES_SETTLE_SECONDS))
+        return ItemChangesResponse(
+            items=[item for _, _, item in changes if item is not None],
+            deleted=[str(item_id) for _, item_id, item in changes if item is None],
+            next_token=next_token,
+            has_more=has_more
+        )
+    
+    async def facet_items(self, filters: Dict[str, Any] = None, limit: int = 20,
+                          sort_by: str = "created_at", sort_desc: bool = True,
+                          store_id: Optional[str] = None,
+                          projection: Optional[Dict[str, Any]] = None) -> FacetedResponse:
+        """First page of filtered items plus facet counts and a price histogram.
+
+        Everything comes from one `$facet` aggregation, so the store's items
+        are read once. Each facet is counted with every filter except its own,
+        which is what a filter sidebar shows: picking one category still
+        lists the counts of the others.
+        """
+        db = self.client[DB_NAME]
+        filters = dict(filters or {})
+        
+        base_query = {}
+        if store_id:
+            if not ObjectId.is_valid(store_id):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, 
+                    detail=f"Invalid store ID format: {store_id}"
+                )
+            base_query["store_id"] = ObjectId(store_id)
+        
+        def matching(excluded: Optional[str] = None) -> List[Dict[str, Any]]:
+            query = {field: value for field, value in filters.items() if field != excluded}
+            return [{"$match": query}] if query else []
+        
+        boundaries = settings.FACET_PRICE_BOUNDARIES
+        facets = {
+            "items": matching() + [
+                {"$sort": dict(sort_spec(sort_by, sort_desc))},
+                {"$limit": limit + 1}
+            ] + ([{"$project": aggregation_projection(with_fields(projection, sort_by))}] if projection else []),
+            "total": matching() + [{"$count": "count"}],
+            "price": matching("price") + [{"$bucket": {
+                "groupBy": "$price",
+                "boundaries": boundaries,
+                "default": boundaries[-1],
+                "output": {"count": {"$sum": 1}}
+            }}],
+        }
+        for field in FACET_FIELDS:
+            stages = matching(field)
+            if field == "category":
+                stages.append({"$unwind": "$category"})
+            stages += [
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": pymongo.DESCENDING, "_id": pymongo.ASCENDING}}
+            ]
+            facets[field] = stages
+        
+        pipeline = ([{"$match": base_query}] if base_query else []) + [{"$facet": facets}]
+        result = (await db[COLLECTION_NAME].aggregate(pipeline).to_list(length=1))[0]
+        
+        items = result["items"]
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(items[-1], sort_by, sort_desc)
+        
+        # The default bucket (prices at or above the last boundary) is labelled with that boundary
+        upper_bounds = dict(zip(boundaries, boundaries[1:]))
+        histogram = {bucket["_id"]: bucket["count"] for bucket in result["price"]}
+        
+        return FacetedResponse(
+            total=result["total"][0]["count"] if result["total"] else 0,
+            limit=limit,
+            items=items,
+            next_cursor=next_cursor,
+            facets={
+                field: [
+                    FacetCount(value=bucket["_id"], count=bucket["count"])
+                    for bucket in result[field] if bucket["_id"] is not None
+                ]
+                for field in FACET_FIELDS
+            },
+            price_histogram=[
+                PriceBucket(min=lower, max=upper_bounds.get(lower), count=histogram.get(lower, 0))
+                for lower in boundaries
+            ]
+        )
+    
+    async def iter_store_items(self, store_id: str, after: Optional[ObjectId] = None,
+                               batch_size: int = 1000,
+                               projection: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every item of a store in `_id` order, starting after the item `after`.
+
+        Items are read along the (store_id, _id) index in server batches of
+        `batch_size`, so only one batch is held at a time. If the server drops
+        the cursor because the consumer was slow, reading resumes after the
+        last item yielded.
+        """
+        db = self.client[DB_NAME]
+        query = {"store_id": ObjectId(store_id)}
+        last_id = after
+        while True:
+            cursor = db[COLLECTION_NAME].find(
+                merge_filters(query, keyset_filter("_id", False, last_id, last_id) if last_id else None),
+                projection
+            ).sort("_id", pymongo.ASCENDING).batch_size(batch_size)
+            try:
+                async for item in cursor:
+                    last_id = item["_id"]
+                    yield item
+                return
+            except CursorNotFound:
+                logger.warning(f"Export cursor for store {store_id} expired, resuming after {last_id}")
+            finally:
+                await cursor.close()
     
     async def search_items(self, query_text: str, store_id: Optional[str] = None,
-                          skip: int = 0, limit: int = 20) -> PaginatedResponse:
-        """Search catalog items by text with optional store filter."""
+                          skip: int = 0, limit: int = 20,
+                          count_mode: str = "cached",
+                          filters: Optional[Dict[str, Any]] = None,
+                          projection: Optional[Dict[str, Any]] = None) -> PaginatedResponse:
+        """Search catalog items by text with optional store and item filters."""
         db = self.client[DB_NAME]
         
         # Build query
-        search_query = {"$text": {"$search": query_text}}
+        search_query = {**(filters or {}), "$text": {"$search": query_text}}
         
         # Add store filter if provided
         if store_id:
@@ -192,12 +774,12 @@ class CatalogDB:
             search_query["store_id"] = ObjectId(store_id)
         
         # Get total count for pagination
-        total = await db[COLLECTION_NAME].count_documents(search_query)
+        total, total_estimated = await self.count_items(search_query, count_mode)
         
         # Get paginated results with relevance sorting
         cursor = db[COLLECTION_NAME].find(
             search_query,
-            {"score": {"$meta": "textScore"}}
+            {**(projection or {}), "score": {"$meta": "textScore"}}
         ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(limit)
         
         items = await cursor.to_list(length=limit)
@@ -206,16 +788,23 @@ class CatalogDB:
             total=total,
             page=skip // limit + 1,
             limit=limit,
-            items=items
+            items=items,
+            total_estimated=total_estimated
         )
     
     async def get_featured_items(self, store_id: Optional[str] = None, 
-                                limit: int = 10) -> List[Dict[str, Any]]:
-        """Get featured items, optionally filtered by store."""
+                                limit: int = 10,
+                                projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Get available featured items in shelf order, optionally filtered by store.
+
+        Items with a `featured_rank` come first, lowest rank first, followed by
+        unranked ones by popularity and then newest first. Read by the featured
+        shelves (services/featured_shelf.py) when a shelf is rebuilt.
+        """
         db = self.client[DB_NAME]
         
         # Build query
-        query = {"featured": True}
+        query = {"featured": True, "available": True}
         
         # Add store filter if provided
         if store_id:
@@ -226,14 +815,24 @@ class CatalogDB:
                 )
             query["store_id"] = ObjectId(store_id)
         
-        # Get featured items
-        cursor = db[COLLECTION_NAME].find(query).limit(limit)
-        items = await cursor.to_list(length=limit)
+        pipeline = [
+            {"$match": query},
+            {"$addFields": {"_unranked": {"$eq": [{"$ifNull": ["$featured_rank", None]}, None]}}},
+            {"$sort": {"_unranked": 1, "featured_rank": 1, "popularity": -1, "created_at": -1, "_id": 1}},
+            {"$limit": limit},
+            {"$project": {"_unranked": 0}},
+        ]
+        if projection:
+            pipeline.append({"$project": aggregation_projection(projection)})
         
-        return items
+        return await db[COLLECTION_NAME].aggregate(pipeline).to_list(length=limit)
     
     async def update_stock(self, item_id: str, quantity_change: int) -> Dict[str, Any]:
-        """Update stock quantity for an item (increase or decrease)."""
+        """Update stock quantity for an item (increase or decrease).
+
+        A decrease is applied only if enough stock is left, in the same atomic
+        operation, so stock never dips below zero under concurrent orders.
+        """
         if not ObjectId.is_valid(item_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, 
@@ -242,29 +841,284 @@ class CatalogDB:
         
         db = self.client[DB_NAME]
         
-        # Use the $inc operator to atomically update the stock quantity
-        result = await db[COLLECTION_NAME].update_one(
-            {"_id": ObjectId(item_id)},
+        query = {"_id": ObjectId(item_id)}
+        if quantity_change < 0:
+            query["stock_quantity"] = {"$gte": -quantity_change}
+        
+        # One round trip: guarded $inc that returns the updated document
+        updated_item = await db[COLLECTION_NAME].find_one_and_update(
+            query,
             {
                 "$inc": {"stock_quantity": quantity_change},
                 "$set": {"updated_at": datetime.utcnow()}
-            }
+            },
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.matched_count == 0:
+        if updated_item is None:
+            # Only failed updates pay for finding out why
+            if not await db[COLLECTION_NAME].count_documents({"_id": ObjectId(item_id)}, limit=1):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Item with ID {item_id} not found"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Insufficient stock for item {item_id}"
+            )
+        
+        await catalog_events.publish(CatalogChange(
+            op="stock",
+            store_id=str(updated_item["store_id"]),
+            item_id=item_id,
+            item=updated_item
+        ))
+        return updated_item
+    
+    async def reserve_stock(self, lines: Dict[str, int], reference: Optional[str] = None) -> str:
+        """Decrement stock for every line of an order, all or nothing.
+
+        `lines` maps item IDs to the quantity to take. All guarded decrements go
+        out in one unordered bulk_write, so a successful reservation costs a
+        single round trip. Each decrement also tags the item with a token
+        unique to this attempt, next to the caller's reference (keeping the
+        last STOCK_RESERVATION_HISTORY tags). A partial failure finds and
+        undoes exactly the lines this attempt applied by that token, even when
+        a retry reuses the reference of an earlier reservation, and stamps
+        them again so delta sync picks up the restored stock. Returns the
+        reference.
+        """
+        invalid = [item_id for item_id in lines if not ObjectId.is_valid(item_id)]
+        if invalid:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid item ID format: {', '.join(invalid)}"
+            )
+        
+        db = self.client[DB_NAME]
+        reference = reference or uuid.uuid4().hex
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        
+        operations = [
+            UpdateOne(
+                {"_id": ObjectId(item_id), "stock_quantity": {"$gte": quantity}},
+                {
+                    "$inc": {"stock_quantity": -quantity},
+                    "$set": {"updated_at": now},
+                    "$push": {"stock_reservations": {
+                        "$each": [{"token": token, "reference": reference, "reserved_at": now}],
+                        "$slice": -settings.STOCK_RESERVATION_HISTORY
+                    }}
+                }
+            )
+            for item_id, quantity in lines.items()
+        ]
+        result = await db[COLLECTION_NAME].bulk_write(operations, ordered=False)
+        
+        if result.modified_count < len(lines):
+            # Find which lines went through and put their stock back
+            cursor = db[COLLECTION_NAME].find(
+                {"_id": {"$in": [ObjectId(i) for i in lines]}, "stock_reservations.token": token},
+                {"_id": 1}
+            )
+            applied = [str(doc["_id"]) for doc in await cursor.to_list(length=len(lines))]
+            if applied:
+                await db[COLLECTION_NAME].bulk_write([
+                    UpdateOne(
+                        {"_id": ObjectId(item_id), "stock_reservations.token": token},
+                        {
+                            "$inc": {"stock_quantity": lines[item_id]},
+                            "$set": {"updated_at": datetime.utcnow()},
+                            "$pull": {"stock_reservations": {"token": token}}
+                        }
+                    )
+                    for item_id in applied
+                ], ordered=False)
+                for item_id in applied:
+                    await catalog_events.publish(CatalogChange(op="stock", item_id=item_id))
+            
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "message": "Insufficient stock or unknown items",
+                    "item_ids": [item_id for item_id in lines if item_id not in applied]
+                }
+            )
+        
+        for item_id in lines:
+            await catalog_events.publish(CatalogChange(op="stock", item_id=item_id))
+        return reference
+
+    
+    async def create_category(self, category: Category) -> Dict[str, Any]:
+        """Create a category below its parent, storing its materialized path."""
+        db = self.client[DB_NAME]
+        doc = category.dict(by_alias=True)
+        
+        parent_path, depth = "/", 0
+        if doc["parent_id"] is not None:
+            parent = await db[CATEGORIES_COLLECTION_NAME].find_one(
+                {"_id": doc["parent_id"], "store_id": doc["store_id"]}, {"path": 1, "depth": 1}
+            )
+            if parent is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown parent category {doc['parent_id']} for store {doc['store_id']}"
+                )
+            parent_path, depth = parent["path"], parent["depth"] + 1
+        doc["path"] = f"{parent_path}{doc['_id']}/"
+        doc["depth"] = depth
+        doc["product_count"] = 0
+        
+        result = await db[CATEGORIES_COLLECTION_NAME].insert_one(doc)
+        new_category = await db[CATEGORIES_COLLECTION_NAME].find_one({"_id": result.inserted_id})
+        await category_events.publish(CatalogChange(
+            op="create",
+            store_id=str(new_category["store_id"]),
+            item_id=str(new_category["_id"]),
+            item=new_category
+        ))
+        return new_category
+    
+    async def update_category(self, category_id: str, update_data: CategoryUpdate) -> Dict[str, Any]:
+        """Update a category. Changing `parent_id` moves its whole subtree.
+
+        A move rewrites the materialized paths of the subtree's categories and
+        of the items filed under them, each with one prefix query.
+        """
+        if not ObjectId.is_valid(category_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid category ID format: {category_id}"
+            )
+        
+        db = self.client[DB_NAME]
+        current = await db[CATEGORIES_COLLECTION_NAME].find_one({"_id": ObjectId(category_id)})
+        if current is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Item with ID {item_id} not found"
+                detail=f"Category with ID {category_id} not found"
             )
         
-        # Check if stock went negative and fix it
-        await db[COLLECTION_NAME].update_one(
-            {"_id": ObjectId(item_id), "stock_quantity": {"$lt": 0}},
-            {"$set": {"stock_quantity": 0}}
-        )
+        # parent_id may be set to null (move to the top level); other fields may not
+        update_dict = {
+            k: v for k, v in update_data.dict(exclude_unset=True).items() if v is not None or k == "parent_id"
+        }
+        now = datetime.utcnow()
+        update_dict["updated_at"] = now
+        
+        old_path = current["path"]
+        moved = "parent_id" in update_dict and update_dict["parent_id"] != current.get("parent_id")
+        if moved:
+            parent_path, depth = "/", 0
+            if update_dict["parent_id"] is not None:
+                parent = await db[CATEGORIES_COLLECTION_NAME].find_one(
+                    {"_id": update_dict["parent_id"], "store_id": current["store_id"]}, {"path": 1, "depth": 1}
+                )
+                if parent is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Unknown parent category {update_dict['parent_id']} for store {current['store_id']}"
+                    )
+                if parent["path"].startswith(old_path):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="A category cannot be moved below itself"
+                    )
+                parent_path, depth = parent["path"], parent["depth"] + 1
+            update_dict["path"] = f"{parent_path}{category_id}/"
+            update_dict["depth"] = depth
         
-        # Return the updated item
-        return await self.get_item_by_id(item_id)
+        await db[CATEGORIES_COLLECTION_NAME].update_one({"_id": current["_id"]}, {"$set": update_dict})
+        updated = {**current, **update_dict}
+        
+        if moved:
+            new_path, depth_change = updated["path"], updated["depth"] - current["depth"]
+            subtree = {"store_id": current["store_id"], "path": {"$regex": f"^{re.escape(old_path)}"}}
+            descendants = [
+                UpdateOne({"_id": descendant["_id"]}, {"$set": {
+                    "path": new_path + descendant["path"][len(old_path):],
+                    "depth": descendant["depth"] + depth_change,
+                    "updated_at": now
+                }})
+                async for descendant in db[CATEGORIES_COLLECTION_NAME].find(subtree, {"path": 1, "depth": 1})
+                if descendant["_id"] != current["_id"]
+            ]
+            if descendants:
+                await db[CATEGORIES_COLLECTION_NAME].bulk_write(descendants, ordered=False)
+            
+            # The subtree's products leave the old ancestors for the new ones
+            moved_count = current.get("product_count", 0)
+            await self.apply_category_counts(category_count_deltas([
+                (old_path[:-len(category_id) - 1], -moved_count),
+                (new_path[:-len(category_id) - 1], moved_count),
+            ]))
+            
+            result = await db[COLLECTION_NAME].update_many(
+                {"store_id": current["store_id"], "category_path": {"$regex": f"^{re.escape(old_path)}"}},
+                [{"$set": {
+                    "category_path": {"$concat": [new_path, {"$substrCP": ["$category_path", len(old_path), 4096]}]},
+                    "updated_at": now
+                }}]
+            )
+            if result.modified_count:
+                await catalog_events.publish(CatalogChange(op="bulk", store_id=str(current["store_id"])))
+        
+        await category_events.publish(CatalogChange(
+            op="update",
+            store_id=str(current["store_id"]),
+            item_id=category_id,
+            item=updated,
+            previous=current
+        ))
+        return updated
+    
+    async def delete_category(self, category_id: str) -> bool:
+        """Delete a category that has no subcategories and no items."""
+        if not ObjectId.is_valid(category_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid category ID format: {category_id}"
+            )
+        
+        db = self.client[DB_NAME]
+        oid = ObjectId(category_id)
+        current = await db[CATEGORIES_COLLECTION_NAME].find_one({"_id": oid}, {"store_id": 1, "path": 1})
+        if current is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Category with ID {category_id} not found"
+            )
+        if await db[CATEGORIES_COLLECTION_NAME].find_one({"parent_id": oid}, {"_id": 1}):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Category {category_id} has subcategories"
+            )
+        # An anchored prefix match on the (store_id, category_path) index
+        if await db[COLLECTION_NAME].find_one(
+            {"store_id": current["store_id"], "category_path": {"$regex": f"^{re.escape(current['path'])}"}},
+            {"_id": 1}
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Category {category_id} still has items"
+            )
+        
+        deleted = await db[CATEGORIES_COLLECTION_NAME].find_one_and_delete({"_id": oid})
+        if deleted is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Category with ID {category_id} not found"
+            )
+        
+        await category_events.publish(CatalogChange(
+            op="delete",
+            store_id=str(deleted["store_id"]),
+            item_id=category_id,
+            previous=deleted
+        ))
+        return True
 
 
 # Create a singleton instance
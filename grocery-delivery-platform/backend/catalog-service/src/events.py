@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from cache import redis_cache
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CatalogChange:
+    """A write to the catalog collection.
+
+    `op` is one of "create", "update", "delete", "stock", "bulk" (many items
+    of one store changed at once) or "resync" (notifications may have been
+    missed). `item` and `previous` carry the documents after and before the
+    write when the writer has them, and `item_ids` the items a "bulk" write
+    touched when it knows them; they are never sent to other replicas,
+    where `remote` is set instead. On `category_events` the same fields
+    describe a category.
+    """
+    op: str
+    store_id: Optional[str] = None
+    item_id: Optional[str] = None
+    item: Optional[Dict[str, Any]] = None
+    previous: Optional[Dict[str, Any]] = None
+    item_ids: Optional[List[str]] = None
+    remote: bool = False
+
+
+Listener = Callable[[CatalogChange], Awaitable[None]]
+
+
+class CatalogEvents:
+    """Fan catalog changes out to in-process listeners and to other replicas.
+
+    Listeners run in registration order before `publish` returns, so the
+    writing replica never serves its own stale data. The change is then sent
+    over Redis pub/sub; replicas receiving it dispatch it with `remote=True`.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.instance_id = uuid.uuid4().hex
+        self._listeners: List[Listener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, listener: Listener) -> None:
+        """Register a coroutine called for every change."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    async def publish(self, change: CatalogChange) -> None:
+        """Dispatch a local change and broadcast it to other replicas."""
+        await self._dispatch(change)
+
+        if redis_cache.redis is None:
+            return
+        message = json.dumps({
+            "origin": self.instance_id,
+            "op": change.op,
+            "store_id": change.store_id,
+            "item_id": change.item_id,
+        })
+        try:
+            await redis_cache.redis.publish(self.channel, message)
+        except Exception as e:
+            logger.error(f"Error publishing catalog change: {str(e)}")
+
+    async def start(self) -> None:
+        """Start listening for changes made by other replicas."""
+        if redis_cache.redis is not None and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Stop the pub/sub listener."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _dispatch(self, change: CatalogChange) -> None:
+        for listener in self._listeners:
+            try:
+                await listener(change)
+            except Exception as e:
+                logger.error(f"Catalog change listener {listener!r} failed: {str(e)}")
+
+    async def _listen(self) -> None:
+        retry_delay = 1
+        while True:
+            pubsub = redis_cache.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Anything may have changed while we were not subscribed
+                await self._dispatch(CatalogChange(op="resync", remote=True))
+                retry_delay = 1
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    if payload.get("origin") == self.instance_id:
+                        continue
+                    await self._dispatch(CatalogChange(
+                        op=payload["op"],
+                        store_id=payload.get("store_id"),
+                        item_id=payload.get("item_id"),
+                        remote=True
+                    ))
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except Exception as e:
+                logger.error(f"Catalog change subscription failed: {str(e)}")
+                await pubsub.close()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+
+
+# Create a singleton instance
+catalog_events = CatalogEvents(settings.CATALOG_EVENTS_CHANNEL)
+category_events = CatalogEvents(settings.CATEGORY_EVENTS_CHANNEL)
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+
+from config import settings
+from db import catalog_db
+from importer import LIST_SEPARATOR
+from models import CatalogItem, Nutrition
+from projection import PROFILES
+
+
+# Everything a partner may see; stock reservations are internal bookkeeping
+EXPORT_PROJECTION = PROFILES["detail"]
+
+# CSV columns in the layout the importer reads back: lists joined with "|"
+# and nutrition flattened to `nutrition.<field>` columns
+CSV_COLUMNS = ["_id"] + [
+    column
+    for field in CatalogItem.__fields__.values() if field.alias != "_id"
+    for column in ([f"nutrition.{name}" for name in Nutrition.__fields__] if field.alias == "nutrition" else [field.alias])
+]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def csv_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return LIST_SEPARATOR.join(csv_cell(part) for part in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_row(item: Dict[str, Any]) -> List[str]:
+    nutrition = item.get("nutrition") or {}
+    return [
+        csv_cell(nutrition.get(column.split(".", 1)[1]) if column.startswith("nutrition.") else item.get(column))
+        for column in CSV_COLUMNS
+    ]
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip (and does not give it q=0)."""
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            name, _, value = params.strip().partition("=")
+            try:
+                return name.strip() != "q" or float(value) > 0
+            except ValueError:
+                return False
+    return False
+
+
+async def encode_items(items: AsyncIterator[Dict[str, Any]], file_format: str,
+                       chunk_size: int = settings.EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Encode items as NDJSON lines or CSV rows, yielding chunks of about `chunk_size` bytes."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if file_format == "csv":
+        writer.writerow(CSV_COLUMNS)
+
+    async for item in items:
+        if file_format == "csv":
+            writer.writerow(csv_row(item))
+        else:
+            buffer.write(json.dumps(item, default=json_default, separators=(",", ":")))
+            buffer.write("\n")
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = settings.EXPORT_GZIP_LEVEL) -> AsyncIterator[bytes]:
+    """Compress a byte stream into one gzip member as it is produced.
+
+    Each chunk is flushed, so the client receives data as the export
+    progresses instead of when the compressor's window fills.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_catalog(store_id: str, file_format: str, after: Optional[ObjectId] = None,
+                   batch_size: int = settings.EXPORT_BATCH_SIZE, compress: bool = False) -> AsyncIterator[bytes]:
+    """A store's items as an NDJSON or CSV byte stream in `_id` order, resuming after `after`.
+
+    Memory use is bounded by one database batch plus one encoded chunk,
+    whatever the size of the catalog.
+    """
+    items = catalog_db.iter_store_items(store_id, after, batch_size, EXPORT_PROJECTION)
+    chunks = encode_items(items, file_format)
+    return gzip_chunks(chunks) if compress else chunks
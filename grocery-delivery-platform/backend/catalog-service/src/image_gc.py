@@ -0,0 +1,43 @@
+"""
+Delete stored images nothing references any more.
+
+Images whose last reference was released more than the grace period ago
+are removed with all their derivatives, as are derivative files without an
+image record and abandoned temporary writes of the same age. Images stored
+under a uuid before content addressing are first given a record holding
+one reference, so they are kept until their product releases them. Meant
+to run periodically (e.g. from a cron job).
+
+Usage:
+    python image_gc.py [--grace SECONDS]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from config import settings
+from db import catalog_db
+from services.image_store import image_store
+
+
+async def main(args: argparse.Namespace) -> int:
+    await catalog_db.connect_to_mongodb()
+    try:
+        adopted = await image_store.adopt_legacy_images()
+        removed = {"adopted": adopted, **await image_store.collect_garbage(args.grace)}
+    finally:
+        await catalog_db.close_mongodb_connection()
+
+    print(json.dumps(removed))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Garbage collect unreferenced catalog images")
+    parser.add_argument("--grace", type=int, default=settings.IMAGE_GC_GRACE,
+                        help="Seconds an image must have been unreferenced before it is deleted")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,46 @@
+"""
+Import a CSV or NDJSON catalog feed into a store from the command line.
+
+Usage:
+    python import_catalog.py <store_id> <path> [--format csv|ndjson] [--batch-size N]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from cache import redis_cache
+from config import settings
+from db import catalog_db
+from importer import import_catalog
+
+
+async def main(args: argparse.Namespace) -> int:
+    file_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+
+    await catalog_db.connect_to_mongodb()
+    # Lets running replicas drop cached copies of the imported items
+    await redis_cache.init()
+    try:
+        with open(args.path, "rb") as feed:
+            async def read_chunk() -> bytes:
+                return feed.read(settings.IMPORT_CHUNK_SIZE)
+
+            report = await import_catalog(args.store_id, read_chunk, file_format, args.batch_size)
+    finally:
+        await redis_cache.close()
+        await catalog_db.close_mongodb_connection()
+
+    print(report.json(indent=2))
+    return 0 if report.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Import a catalog feed into a store")
+    parser.add_argument("store_id", help="ID of the store to import into")
+    parser.add_argument("path", help="Path to a .csv or .ndjson feed")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Feed format (guessed from the extension)")
+    parser.add_argument("--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE, help="Items per bulk write")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,175 @@
+import codecs
+import csv
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from config import settings
+from db import catalog_db
+from models import CatalogItem, ImportReport, ImportRowError
+
+
+logger = logging.getLogger(__name__)
+
+# Fields stored as lists; CSV cells hold them as "a|b|c"
+LIST_FIELDS = ("category", "image_urls", "tags")
+LIST_SEPARATOR = "|"
+
+ChunkReader = Callable[[], Awaitable[bytes]]
+
+
+async def iter_lines(read_chunk: ChunkReader) -> AsyncIterator[str]:
+    """Yield decoded lines from a byte stream without buffering the whole stream."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        chunk = await read_chunk()
+        if not chunk:
+            break
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (row number, parsed object) for every non-blank NDJSON line.
+
+    Lines that are not valid JSON are yielded as the exception so the caller
+    can report them against the right row.
+    """
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            yield row, json.loads(line)
+        except ValueError as e:
+            yield row, e
+
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (row number, dict) for every CSV record after the header line.
+
+    Quoted fields may span lines, so physical lines are joined until the quotes
+    balance before a record is parsed.
+    """
+    header: Optional[List[str]] = None
+    record = ""
+    row = 0
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        if not record.strip():
+            record = ""
+            continue
+        values = next(csv.reader([record]))
+        record = ""
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        yield row, csv_row_to_item_data(dict(zip(header, values)))
+
+
+def csv_row_to_item_data(row: Dict[str, str]) -> Dict[str, Any]:
+    """Turn a flat CSV record into the nested shape CatalogItem expects.
+
+    Empty cells are dropped so model defaults apply, list fields are split on
+    "|", and `nutrition.<field>` columns are folded into `nutrition`.
+    """
+    data: Dict[str, Any] = {}
+    for key, value in row.items():
+        value = value.strip()
+        if value == "":
+            continue
+        if key in LIST_FIELDS:
+            data[key] = [part.strip() for part in value.split(LIST_SEPARATOR) if part.strip()]
+        elif key.startswith("nutrition."):
+            data.setdefault("nutrition", {})[key.split(".", 1)[1]] = value
+        else:
+            data[key] = value
+    return data
+
+
+class CatalogImporter:
+    """Validate a stream of rows and upsert them in `bulk_write` batches."""
+
+    def __init__(self, store_id: str, batch_size: int = settings.IMPORT_BATCH_SIZE,
+                 max_reported_errors: int = settings.IMPORT_MAX_REPORTED_ERRORS):
+        self.store_id = store_id
+        self.batch_size = batch_size
+        self.max_reported_errors = max_reported_errors
+        self.report = ImportReport(store_id=store_id)
+        self._batch: List[CatalogItem] = []
+        self._batch_rows: List[int] = []
+
+    def _add_error(self, row: int, error: str) -> None:
+        self.report.failed += 1
+        if len(self.report.errors) < self.max_reported_errors:
+            self.report.errors.append(ImportRowError(row=row, error=error))
+        else:
+            self.report.errors_truncated = True
+
+    async def _flush(self) -> None:
+        if not self._batch:
+            return
+        inserted, updated, errors = await catalog_db.bulk_upsert_items(self.store_id, self._batch)
+        self.report.inserted += inserted
+        self.report.updated += updated
+        for index, message in errors:
+            self._add_error(self._batch_rows[index], message)
+        self._batch, self._batch_rows = [], []
+
+    async def run(self, rows: AsyncIterator[Tuple[int, Any]]) -> ImportReport:
+        """Consume every row and return the import report."""
+        async for row, data in rows:
+            self.report.rows += 1
+            if isinstance(data, Exception):
+                self._add_error(row, str(data))
+                continue
+            if not isinstance(data, dict):
+                self._add_error(row, "Row is not an object")
+                continue
+            try:
+                # The target store always comes from the request, never from the file
+                item = CatalogItem(**{**data, "store_id": self.store_id})
+            except ValidationError as e:
+                self._add_error(row, "; ".join(
+                    f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+                ))
+                continue
+
+            self._batch.append(item)
+            self._batch_rows.append(row)
+            if len(self._batch) >= self.batch_size:
+                await self._flush()
+
+        await self._flush()
+        if self.report.inserted or self.report.updated:
+            # Once per import rather than per batch: a recount reads the whole store
+            await catalog_db.reconcile_category_counts(self.store_id)
+        logger.info(
+            f"Imported catalog for store {self.store_id}: {self.report.inserted} inserted, "
+            f"{self.report.updated} updated, {self.report.failed} failed"
+        )
+        return self.report
+
+
+async def import_catalog(store_id: str, read_chunk: ChunkReader, file_format: str,
+                         batch_size: int = settings.IMPORT_BATCH_SIZE) -> ImportReport:
+    """Stream a CSV or NDJSON catalog feed into a store."""
+    lines = iter_lines(read_chunk)
+    rows = iter_csv_rows(lines) if file_format == "csv" else iter_ndjson_rows(lines)
+    return await CatalogImporter(store_id, batch_size).run(rows)
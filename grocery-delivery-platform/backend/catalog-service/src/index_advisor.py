@@ -0,0 +1,113 @@
+"""
+Explain catalog list queries and report the ones Mongo cannot serve from an index.
+
+A shape is flagged when its winning plan contains a COLLSCAN (no usable
+index) or a SORT stage (results sorted in memory instead of read in index
+order). The service checks the shapes its own list endpoints have run
+(`GET /indexes/advice`); this command checks every shape the list routes can
+produce, so it also works against an idle database or in CI.
+
+Usage:
+    python index_advisor.py [--store-id ID] [--limit N]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from itertools import product
+from typing import Any, Dict, Iterable, List
+
+from bson import ObjectId
+
+from db import catalog_db, DB_NAME, COLLECTION_NAME
+from models import IndexAdvice
+from pagination import sort_spec
+from query_shapes import query_shape
+
+
+# One example value per filter the list routes accept
+ROUTE_FILTERS: List[Dict[str, Any]] = [
+    {},
+    {"category": "Fruit"},
+    {"subcategory": "Apples"},
+    {"is_organic": True},
+    {"price": {"$gte": 1, "$lte": 10}},
+    {"category": "Fruit", "is_vegan": True},
+    {"category": "Fruit", "price": {"$gte": 1, "$lte": 10}},
+]
+ROUTE_SORTS = [("created_at", True), ("price", False), ("price", True), ("name", False)]
+
+
+def plan_stages(plan: Any) -> Iterable[Dict[str, Any]]:
+    """Every stage of an explain plan tree, outermost first.
+
+    Walks nested dicts and lists, so both the classic `inputStage(s)` layout
+    and the slot-based engine's `queryPlan` wrapper are covered.
+    """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+def advice_from_explain(explain: Dict[str, Any], shape: Dict[str, Any]) -> IndexAdvice:
+    stages = list(plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})))
+    names = [stage["stage"] for stage in stages]
+    return IndexAdvice(
+        shape=shape["shape"],
+        sort=shape["sort"],
+        count=shape.get("count", 0),
+        stages=names,
+        indexes=[stage["indexName"] for stage in stages if "indexName" in stage],
+        collection_scan="COLLSCAN" in names,
+        in_memory_sort="SORT" in names
+    )
+
+
+async def explain_shapes(shapes: List[Dict[str, Any]], limit: int = 20) -> List[IndexAdvice]:
+    """Explain each shape's sample query with its sort and page size."""
+    db = catalog_db.client[DB_NAME]
+    advice = []
+    for shape in shapes:
+        cursor = db[COLLECTION_NAME].find(shape["sample"]).sort(shape["sort"]).limit(limit + 1)
+        advice.append(advice_from_explain(await cursor.explain(), shape))
+    return advice
+
+
+def route_shapes(store_id: str) -> List[Dict[str, Any]]:
+    """Every filter and sort combination of the list and store list routes."""
+    shapes = []
+    for scope, filters, (sort_by, sort_desc) in product(
+        ({}, {"store_id": ObjectId(store_id)}), ROUTE_FILTERS, ROUTE_SORTS
+    ):
+        query = {**scope, **filters}
+        shapes.append({"shape": query_shape(query), "sort": sort_spec(sort_by, sort_desc), "sample": query})
+    return shapes
+
+
+async def main(args: argparse.Namespace) -> int:
+    await catalog_db.connect_to_mongodb()
+    try:
+        advice = await explain_shapes(route_shapes(args.store_id), args.limit)
+    finally:
+        await catalog_db.close_mongodb_connection()
+
+    flagged = [a for a in advice if a.collection_scan or a.in_memory_sort]
+    for a in advice:
+        status = "FLAG" if a in flagged else "ok  "
+        print(f"{status} {a.shape} sort={a.sort} stages={'>'.join(a.stages)} indexes={a.indexes}")
+    print(f"{len(flagged)} of {len(advice)} query shapes need a COLLSCAN or an in-memory SORT")
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Check that catalog list queries are served by indexes")
+    parser.add_argument("--store-id", default=str(ObjectId()), help="Store ID used in the sample queries")
+    parser.add_argument("--limit", type=int, default=20, help="Page size used in the sample queries")
+    sys.exit(asyncio.run(main(parser.parse_args())))
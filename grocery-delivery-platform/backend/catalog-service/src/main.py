@@ -3,8 +3,19 @@ from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
+from cache import count_cache, item_cache, redis_cache
+from config import settings
 from db import catalog_db
+from events import catalog_events, category_events
 from routes import router
+from services.category_tree import category_trees
+from services.featured_shelf import featured_shelves
+from services.image_pipeline import image_pipeline, UploadSizeLimit
+from services.menu_snapshot import menu_snapshots
+from services.search_index import search_indexes
+from services.similar_items import similar_items
+from services.spelling import spellers
+from services.suggest_index import suggest_indexes
 from .routes import image_routes
 
 # Configure logging
@@ -23,8 +34,31 @@ async def lifespan(app: FastAPI):
     await catalog_db.connect_to_mongodb()
     logger.info("MongoDB connection established")
     
+    # Caches drop stale entries on catalog changes from this and other replicas
+    await redis_cache.init()
+    catalog_events.subscribe(item_cache.on_change)
+    catalog_events.subscribe(count_cache.on_change)
+    catalog_events.subscribe(search_indexes.on_change)
+    catalog_events.subscribe(suggest_indexes.on_change)
+    catalog_events.subscribe(spellers.on_change)
+    catalog_events.subscribe(featured_shelves.on_change)
+    catalog_events.subscribe(category_trees.on_item_change)
+    catalog_events.subscribe(similar_items.on_change)
+    category_events.subscribe(category_trees.on_change)
+    catalog_events.subscribe(menu_snapshots.on_change)
+    category_events.subscribe(menu_snapshots.on_change)
+    await catalog_events.start()
+    await category_events.start()
+    
     yield
     
+    await catalog_events.stop()
+    await category_events.stop()
+    await similar_items.stop()
+    await menu_snapshots.stop()
+    await redis_cache.close()
+    image_pipeline.shutdown()
+    
     # Shutdown: close database connection
     logger.info("Closing MongoDB connection...")
     await catalog_db.close_mongodb_connection()
@@ -48,6 +82,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Refuse oversized uploads before their body is spooled
+app.add_middleware(
+    UploadSizeLimit,
+    path_prefixes=("/images/upload",),
+    max_bytes=settings.MAX_IMAGE_SIZE + settings.IMAGE_UPLOAD_OVERHEAD,
+)
+
 
 # Add request logging middleware
 @app.middleware("http")
@@ -46,6 +46,7 @@ class Nutrition(BaseModel):
 class CatalogItem(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     store_id: PyObjectId
+    sku: Optional[str] = None  # Store-assigned stock keeping unit, unique per store
     name: str
     description: str
     price: float
@@ -53,6 +54,8 @@ class CatalogItem(BaseModel):
     unit: str  # e.g., "lb", "kg", "each", "dozen"
     category: List[str] = []
     subcategory: Optional[str] = None
+    category_id: Optional[PyObjectId] = None  # Node of the store's category tree
+    category_path: Optional[str] = None  # Materialized path of category_id, maintained by the service
     image_urls: List[str] = []
     nutrition: Optional[Nutrition] = None
     stock_quantity: int = 0
@@ -64,6 +67,8 @@ class CatalogItem(BaseModel):
     tags: List[str] = []
     available: bool = True
     featured: bool = False
+    featured_rank: Optional[int] = None  # Position on the featured shelf, lowest first
+    popularity: float = 0  # Demand signal such as recent units sold; ranks typeahead suggestions
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -88,6 +93,7 @@ class CatalogItem(BaseModel):
         schema_extra = {
             "example": {
                 "store_id": "6058f12b45783f2b3fc14d23",
+                "sku": "APL-HC-ORG",
                 "name": "Organic Honeycrisp Apple",
                 "description": "Fresh, locally-grown organic Honeycrisp apples",
                 "price": 1.99,
@@ -119,6 +125,7 @@ class CatalogItem(BaseModel):
 
 
 class CatalogItemUpdate(BaseModel):
+    sku: Optional[str] = None
     name: Optional[str] = None
     description: Optional[str] = None
     price: Optional[float] = None
@@ -126,6 +133,7 @@ class CatalogItemUpdate(BaseModel):
     unit: Optional[str] = None
     category: Optional[List[str]] = None
     subcategory: Optional[str] = None
+    category_id: Optional[PyObjectId] = None
     image_urls: Optional[List[str]] = None
     nutrition: Optional[Nutrition] = None
     stock_quantity: Optional[int] = None
@@ -137,6 +145,8 @@ class CatalogItemUpdate(BaseModel):
     tags: Optional[List[str]] = None
     available: Optional[bool] = None
     featured: Optional[bool] = None
+    featured_rank: Optional[int] = None
+    popularity: Optional[float] = None
     
     @validator('price', 'sale_price')
     def validate_price(cls, v):
@@ -157,8 +167,190 @@ class CatalogItemUpdate(BaseModel):
         }
 
 
+class Category(BaseModel):
+    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    store_id: PyObjectId
+    name: str
+    slug: Optional[str] = None
+    parent_id: Optional[PyObjectId] = None  # None for top-level categories
+    display_order: int = 0
+    is_active: bool = True
+    # Ancestor IDs then the category's own, as "/root/.../id/"; set by the service
+    path: Optional[str] = None
+    depth: int = 0
+    product_count: int = 0  # Available items here and in subcategories; set by the service
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    class Config:
+        allow_population_by_field_name = True
+        arbitrary_types_allowed = True
+        json_encoders = {
+            ObjectId: str
+        }
+        schema_extra = {
+            "example": {
+                "store_id": "6058f12b45783f2b3fc14d23",
+                "name": "Apples",
+                "slug": "apples",
+                "parent_id": "6058f12b45783f2b3fc14d30",
+                "display_order": 1
+            }
+        }
+
+
+class CategoryUpdate(BaseModel):
+    name: Optional[str] = None
+    slug: Optional[str] = None
+    parent_id: Optional[PyObjectId] = None  # Moves the category with its subtree; null for top level
+    display_order: Optional[int] = None
+    is_active: Optional[bool] = None
+    
+    class Config:
+        arbitrary_types_allowed = True
+        json_encoders = {
+            ObjectId: str
+        }
+
+
+class CategoryNode(BaseModel):
+    id: str
+    name: str
+    slug: Optional[str] = None
+    parent_id: Optional[str] = None
+    path: str
+    depth: int
+    display_order: int = 0
+    is_active: bool = True
+    product_count: int = 0
+    children: List["CategoryNode"] = []
+
+
+CategoryNode.update_forward_refs()
+
+
+class BreadcrumbEntry(BaseModel):
+    id: str
+    name: str
+    slug: Optional[str] = None
+
+
+MAX_BATCH_GET_IDS = 500
+MAX_STOCK_RESERVATION_LINES = 500
+
+
+class BatchGetRequest(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=MAX_BATCH_GET_IDS)
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "ids": ["6058f12b45783f2b3fc14d24", "6058f12b45783f2b3fc14d25"]
+            }
+        }
+
+
+class BatchGetResult(BaseModel):
+    id: str
+    found: bool
+    item: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None  # "invalid_id" or "not_found"
+
+
+class BatchGetResponse(BaseModel):
+    results: List[BatchGetResult]  # Same order as the requested IDs
+
+
+class StockReservationLine(BaseModel):
+    item_id: str
+    quantity: int = Field(..., gt=0)
+
+
+class StockReservationRequest(BaseModel):
+    lines: List[StockReservationLine] = Field(..., min_items=1, max_items=MAX_STOCK_RESERVATION_LINES)
+    reference: Optional[str] = None  # e.g. the order ID; generated when omitted
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "reference": "order-1042",
+                "lines": [
+                    {"item_id": "6058f12b45783f2b3fc14d24", "quantity": 2},
+                    {"item_id": "6058f12b45783f2b3fc14d25", "quantity": 1}
+                ]
+            }
+        }
+
+
 class PaginatedResponse(BaseModel):
+    total: Optional[int] = None  # Only counted when requested
+    total_estimated: bool = False  # True when `total` is approximate or a lower bound
+    page: Optional[int] = None  # Not meaningful for cursor-based pages
+    limit: int
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None  # Pass as `after` to fetch the next page 
+    corrected_query: Optional[str] = None  # Set by search when misspelled query words were replaced
+
+
+class ItemChangesResponse(BaseModel):
+    items: List[Dict[str, Any]]  # Created or updated since the token
+    deleted: List[str]  # IDs of items deleted since the token
+    next_token: str  # Pass as `since` for the next page, or the next sync once `has_more` is false
+    has_more: bool
+
+
+class FacetCount(BaseModel):
+    value: Any
+    count: int
+
+
+class PriceBucket(BaseModel):
+    min: float
+    max: Optional[float] = None  # None for the open-ended top bucket
+    count: int
+
+
+class FacetedResponse(BaseModel):
     total: int
-    page: int
     limit: int
-    items: List[Dict[str, Any]] 
\ No newline at end of file
+    items: List[Dict[str, Any]]  # First page of the filtered results
+    next_cursor: Optional[str] = None  # Continue with `after` on the list endpoint
+    facets: Dict[str, List[FacetCount]]  # Each facet counted with every filter but its own
+    price_histogram: List[PriceBucket]
+
+
+class IndexAdvice(BaseModel):
+    shape: Dict[str, Any]  # Filter fields and operators, values stripped
+    sort: List[Any]
+    count: int = 0  # Times the shape was seen (0 for shapes checked without traffic)
+    stages: List[str]  # Winning plan stages, outermost first
+    indexes: List[str]  # Indexes the winning plan scans
+    collection_scan: bool
+    in_memory_sort: bool
+
+
+class Suggestion(BaseModel):
+    text: str
+    type: str  # "item", "brand" or "category"
+    item_id: Optional[str] = None  # Set for item suggestions
+    score: float
+
+
+class SuggestResponse(BaseModel):
+    query: str
+    suggestions: List[Suggestion]
+
+
+class ImportRowError(BaseModel):
+    row: int  # 1-based record number, not counting a CSV header
+    error: str
+
+
+class ImportReport(BaseModel):
+    store_id: str
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
\ No newline at end of file
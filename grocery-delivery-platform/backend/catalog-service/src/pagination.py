@@ -0,0 +1,105 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import pymongo
+from bson import ObjectId, json_util
+from fastapi import HTTPException, status
+
+
+def encode_cursor(item: Dict[str, Any], sort_by: str, sort_desc: bool) -> str:
+    """Build an opaque keyset cursor from the last item of a page."""
+    payload = {
+        "s": sort_by,
+        "d": sort_desc,
+        "v": item.get(sort_by),
+        "id": item["_id"],
+    }
+    raw = json_util.dumps(payload).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str, sort_desc: bool) -> Tuple[Any, ObjectId]:
+    """Decode a keyset cursor and check it was issued for the same ordering."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        sort_value, last_id = payload["v"], payload["id"]
+        issued_for = (payload["s"], payload["d"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+    if issued_for != (sort_by, sort_desc) or not isinstance(last_id, ObjectId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pagination cursor does not match the requested sort order"
+        )
+
+    return sort_value, last_id
+
+
+def encode_sync_token(changed_at: datetime, last_id: Optional[ObjectId] = None) -> str:
+    """Build an opaque delta-sync token: changes after (changed_at, last_id), or from changed_at on."""
+    raw = json_util.dumps({"t": changed_at, "id": last_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: str) -> Tuple[datetime, Optional[ObjectId]]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        changed_at, last_id = payload["t"], payload["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        changed_at, last_id = None, None
+    if not isinstance(changed_at, datetime) or not (last_id is None or isinstance(last_id, ObjectId)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid sync token"
+        )
+    # json_util decodes dates as aware UTC; stored dates are naive UTC
+    return changed_at.replace(tzinfo=None), last_id
+
+
+def keyset_filter(sort_by: str, sort_desc: bool, sort_value: Any, last_id: ObjectId) -> Dict[str, Any]:
+    """Filter selecting the documents that come after (sort_value, last_id)."""
+    if sort_by == "_id":
+        return {"_id": {"$lt" if sort_desc else "$gt": last_id}}
+
+    op = "$lt" if sort_desc else "$gt"
+    tie_break = {sort_by: sort_value, "_id": {op: last_id}}
+
+    if sort_value is None:
+        # Nulls sort before every other value, so comparison operators cannot
+        # reach past them: descending pages only have null ties left, ascending
+        # pages continue with every non-null value.
+        if sort_desc:
+            return tie_break
+        return {"$or": [{sort_by: {"$ne": None}}, tie_break]}
+
+    branches = [{sort_by: {op: sort_value}}, tie_break]
+    if sort_desc:
+        # Descending order ends with the null/missing values, which `$lt`
+        # never matches because of type bracketing.
+        branches.append({sort_by: None})
+    return {"$or": branches}
+
+
+def sort_spec(sort_by: str, sort_desc: bool) -> list:
+    """Sort specification with `_id` as a tie breaker so keyset pages are stable."""
+    direction = pymongo.DESCENDING if sort_desc else pymongo.ASCENDING
+    if sort_by == "_id":
+        return [("_id", direction)]
+    return [(sort_by, direction), ("_id", direction)]
+
+
+def merge_filters(query: Dict[str, Any], extra: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """AND an extra condition onto a query without mutating either."""
+    if not extra:
+        return dict(query)
+    if not query:
+        return dict(extra)
+    return {"$and": [query, extra]}
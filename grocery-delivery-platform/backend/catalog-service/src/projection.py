@@ -0,0 +1,87 @@
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+
+from models import CatalogItem, Nutrition
+
+
+# Named projections pushed down to Mongo. None returns the whole document.
+PROFILES: Dict[str, Optional[Dict[str, Any]]] = {
+    # Product grid tiles: what a card renders, with the first image only
+    "card": {
+        "store_id": 1, "name": 1, "price": 1, "sale_price": 1, "unit": 1,
+        "image_urls": {"$slice": 1}, "available": 1,
+    },
+    # Product page: every catalog field, without internal bookkeeping
+    "detail": {"stock_reservations": 0},
+    # Back office: the stored document as is
+    "admin": None,
+}
+DEFAULT_PROFILE = "detail"
+
+ITEM_FIELDS = {field.alias for field in CatalogItem.__fields__.values()}
+NUTRITION_FIELDS = {f"nutrition.{name}" for name in Nutrition.__fields__}
+
+
+def resolve_projection(fields: Optional[str] = None, profile: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Mongo projection for a comma-separated `fields` list or a named profile.
+
+    `fields` wins over `profile`; `_id` is always returned. Raises 400 for
+    unknown field or profile names.
+    """
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in ITEM_FIELDS and name not in NUTRITION_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+        return {name: 1 for name in names}
+
+    profile = profile or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown projection profile: {profile}"
+        )
+    return PROFILES[profile]
+
+
+def is_inclusion(projection: Optional[Dict[str, Any]]) -> bool:
+    return bool(projection) and any(value != 0 for field, value in projection.items() if field != "_id")
+
+
+def with_fields(projection: Optional[Dict[str, Any]], *fields: str) -> Optional[Dict[str, Any]]:
+    """Make sure an inclusion projection returns `fields` (e.g. the sort key for cursors)."""
+    if not is_inclusion(projection):
+        return projection
+    return {**projection, **{field: 1 for field in fields if field not in projection}}
+
+
+def aggregation_projection(projection: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate a find projection for a `$project` stage ($slice takes the array there)."""
+    return {
+        field: {"$slice": [f"${field}", value["$slice"]]} if isinstance(value, dict) and "$slice" in value else value
+        for field, value in projection.items()
+    }
+
+
+def project_item(item: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply a projection in process, for documents served from the item cache."""
+    if not projection:
+        return item
+    if not is_inclusion(projection):
+        return {key: value for key, value in item.items() if projection.get(key, 1) != 0}
+
+    projected: Dict[str, Any] = {"_id": item["_id"]} if "_id" in item else {}
+    for field, value in projection.items():
+        if "." in field:
+            parent, child = field.split(".", 1)
+            if isinstance(item.get(parent), dict) and child in item[parent]:
+                projected.setdefault(parent, {})[child] = item[parent][child]
+        elif field in item:
+            projected[field] = item[field]
+            if isinstance(value, dict) and "$slice" in value and isinstance(item[field], list):
+                projected[field] = item[field][:value["$slice"]]
+    return projected
@@ -0,0 +1,59 @@
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from config import settings
+
+
+def query_shape(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip the values from a Mongo filter, keeping fields and operators.
+
+    {"store_id": ObjectId(...), "price": {"$gte": 2}} becomes
+    {"store_id": "eq", "price": ["$gte"]}.
+    """
+    shape: Dict[str, Any] = {}
+    for field, condition in query.items():
+        if field in ("$and", "$or", "$nor"):
+            shape[field] = [query_shape(clause) for clause in condition]
+        elif isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            shape[field] = sorted(condition)
+        else:
+            shape[field] = "eq"
+    return shape
+
+
+class QueryShapeRecorder:
+    """Count the distinct filter/sort shapes the list endpoints run.
+
+    The latest concrete query of each shape is kept as a sample so the index
+    advisor can `explain` it. Only the first `max_shapes` shapes are tracked.
+    """
+
+    def __init__(self, max_shapes: int):
+        self.max_shapes = max_shapes
+        self.dropped = 0
+        self._shapes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def record(self, query: Dict[str, Any], sort: List[Any]) -> None:
+        shape = query_shape(query)
+        key = json.dumps([shape, sort], sort_keys=True)
+        entry = self._shapes.get(key)
+        if entry is None:
+            if len(self._shapes) >= self.max_shapes:
+                self.dropped += 1
+                return
+            entry = self._shapes[key] = {"shape": shape, "sort": sort, "count": 0}
+        entry["count"] += 1
+        entry["sample"] = query
+
+    def shapes(self) -> List[Dict[str, Any]]:
+        """Recorded shapes, most frequent first."""
+        return sorted(self._shapes.values(), key=lambda entry: -entry["count"])
+
+    def clear(self) -> None:
+        self._shapes.clear()
+        self.dropped = 0
+
+
+# Create a singleton instance
+query_shapes = QueryShapeRecorder(settings.INDEX_ADVISOR_MAX_SHAPES)
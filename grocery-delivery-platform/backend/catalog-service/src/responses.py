@@ -0,0 +1,37 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def encode_default(value: Any) -> Any:
+    """orjson fallback for the types it does not serialize itself (datetimes, dicts and lists it does)."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response rendered by orjson, taking documents as read from Mongo.
+
+    Routes serving stored items return this response themselves, so FastAPI
+    neither validates the documents against the response model again nor
+    walks them through `jsonable_encoder`; `response_model` then only
+    documents the route.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=encode_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
@@ -1,14 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Path, UploadFile, File, Header, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from typing import List, Optional, Dict, Any
 from bson import ObjectId
 
-from models import CatalogItem, CatalogItemUpdate, PaginatedResponse
+from models import (
+    CatalogItem, CatalogItemUpdate, PaginatedResponse, BatchGetRequest, BatchGetResponse, ImportReport,
+    StockReservationRequest, SuggestResponse, FacetedResponse, IndexAdvice, Category, CategoryUpdate,
+    CategoryNode, BreadcrumbEntry, ItemChangesResponse
+)
 from db import catalog_db
+from cache import count_cache, item_cache
+from config import settings
+from exporter import MEDIA_TYPES, accepts_gzip, export_catalog
+from importer import import_catalog
+from index_advisor import explain_shapes
+from projection import project_item, resolve_projection
+from query_shapes import query_shapes
+from responses import MongoJSONResponse
+from services.category_tree import category_trees
+from services.featured_shelf import featured_shelves
+from services.image_pipeline import IMAGE_FORMATS, negotiate_format
+from services.image_store import image_store
+from services.menu_snapshot import menu_snapshots
+from services.search_index import search_indexes
+from services.similar_items import similar_items
+from services.spelling import spellers
+from services.suggest_index import suggest_indexes
 
 # Setup OAuth2 with Bearer token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
-router = APIRouter()
+router = APIRouter(default_response_class=MongoJSONResponse)
 
 
 async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
@@ -35,18 +57,105 @@ async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
 # For now, we'll check ownership manually in each endpoint that requires it
 
 
+def item_filters(
+    category: Optional[str] = Query(None, description="Filter by category"),
+    subcategory: Optional[str] = Query(None, description="Filter by subcategory"),
+    is_organic: Optional[bool] = Query(None, description="Filter by organic status"),
+    is_vegan: Optional[bool] = Query(None, description="Filter by vegan status"),
+    is_gluten_free: Optional[bool] = Query(None, description="Filter by gluten-free status"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price")
+) -> Dict[str, Any]:
+    """Build the catalog item filter shared by the listing and search endpoints."""
+    filters = {}
+    
+    if category:
+        filters["category"] = category
+    if subcategory:
+        filters["subcategory"] = subcategory
+    if is_organic is not None:
+        filters["is_organic"] = is_organic
+    if is_vegan is not None:
+        filters["is_vegan"] = is_vegan
+    if is_gluten_free is not None:
+        filters["is_gluten_free"] = is_gluten_free
+        
+    # Price range
+    price_filter = {}
+    if min_price is not None:
+        price_filter["$gte"] = min_price
+    if max_price is not None:
+        price_filter["$lte"] = max_price
+    if price_filter:
+        filters["price"] = price_filter
+    
+    return filters
+
+
+def item_projection(
+    fields: Optional[str] = Query(
+        None, description="Comma-separated fields to return, e.g. name,price (overrides profile)"
+    ),
+    profile: Optional[str] = Query(
+        None, pattern="^(card|detail|admin)$", description="Named field set (defaults to detail)"
+    )
+) -> Optional[Dict[str, Any]]:
+    """Resolve the Mongo projection shared by the item read endpoints."""
+    return resolve_projection(fields, profile)
+
+
 @router.post("/items", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
 async def create_item(item: CatalogItem, _: str = Depends(get_current_user_id)):
     """Create a new catalog item. Requires authentication."""
     # In a real implementation, we would verify that the user owns the store_id in the item
     created_item = await catalog_db.create_item(item)
-    return created_item
+    return MongoJSONResponse(created_item, status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/items:batchGet", response_model=BatchGetResponse)
+async def batch_get_items(
+    request: BatchGetRequest,
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
+):
+    """
+    Get up to 500 catalog items in one call. Public access.
+    Results follow the request order; unknown or malformed IDs get a marker instead of an item.
+    """
+    items = await catalog_db.get_items_by_ids(request.ids)
+    items = {item_id: project_item(item, projection) for item_id, item in items.items()}
+    
+    results = []
+    for item_id in request.ids:
+        if not ObjectId.is_valid(item_id):
+            results.append({"id": item_id, "found": False, "item": None, "error": "invalid_id"})
+        elif item_id in items:
+            results.append({"id": item_id, "found": True, "item": items[item_id], "error": None})
+        else:
+            results.append({"id": item_id, "found": False, "item": None, "error": "not_found"})
+    
+    return MongoJSONResponse({"results": results})
 
 
 @router.get("/items/{item_id}", response_model=Dict[str, Any])
-async def get_item(item_id: str = Path(..., description="The ID of the item to get")):
+async def get_item(
+    item_id: str = Path(..., description="The ID of the item to get"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
+):
     """Get a catalog item by ID. Public access."""
-    return await catalog_db.get_item_by_id(item_id)
+    return MongoJSONResponse(project_item(await catalog_db.get_item_by_id(item_id), projection))
+
+
+@router.get("/items/{item_id}/similar", response_model=List[Dict[str, Any]])
+async def get_similar_items(
+    item_id: str = Path(..., description="The ID of the item to find similar items for"),
+    limit: int = Query(10, ge=1, le=settings.SIMILAR_ITEMS_K, description="Limit the number of results"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
+):
+    """
+    Available items of the same store most like an item, best first, each with its `score`. Public access.
+    Served from precomputed lists, updated shortly after catalog changes.
+    """
+    return MongoJSONResponse(await similar_items.similar_items(item_id, limit, projection))
 
 
 @router.put("/items/{item_id}", response_model=Dict[str, Any])
@@ -57,7 +166,7 @@ async def update_item(
 ):
     """Update a catalog item. Requires authentication."""
     # In a real implementation, we would verify that the user owns the store that owns this item
-    return await catalog_db.update_item(item_id, update_data)
+    return MongoJSONResponse(await catalog_db.update_item(item_id, update_data))
 
 
 @router.delete("/items/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -74,42 +183,19 @@ async def delete_item(
 async def list_items(
     skip: int = Query(0, ge=0, description="Skip the first n results"),
     limit: int = Query(20, ge=1, le=100, description="Limit the number of results"),
-    category: Optional[str] = Query(None, description="Filter by category"),
-    subcategory: Optional[str] = Query(None, description="Filter by subcategory"),
-    is_organic: Optional[bool] = Query(None, description="Filter by organic status"),
-    is_vegan: Optional[bool] = Query(None, description="Filter by vegan status"),
-    is_gluten_free: Optional[bool] = Query(None, description="Filter by gluten-free status"),
-    min_price: Optional[float] = Query(None, ge=0, description="Minimum price"),
-    max_price: Optional[float] = Query(None, ge=0, description="Maximum price"),
+    filters: Dict[str, Any] = Depends(item_filters),
     sort_by: str = Query("created_at", description="Sort by field"),
-    sort_desc: bool = Query(True, description="Sort in descending order")
+    sort_desc: bool = Query(True, description="Sort in descending order"),
+    after: Optional[str] = Query(None, description="Cursor from `next_cursor` of the previous page"),
+    include_total: bool = Query(False, description="Also count the total (an extra count query)"),
+    count_mode: str = Query("cached", pattern="^(exact|cached|estimated)$", description="How to compute the total"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
 ):
     """List catalog items with pagination, filtering, and sorting. Public access."""
-    # Build filters based on query parameters
-    filters = {}
-    
-    if category:
-        filters["category"] = category
-    if subcategory:
-        filters["subcategory"] = subcategory
-    if is_organic is not None:
-        filters["is_organic"] = is_organic
-    if is_vegan is not None:
-        filters["is_vegan"] = is_vegan
-    if is_gluten_free is not None:
-        filters["is_gluten_free"] = is_gluten_free
-        
-    # Price range
-    price_filter = {}
-    if min_price is not None:
-        price_filter["$gte"] = min_price
-    if max_price is not None:
-        price_filter["$lte"] = max_price
-    if price_filter:
-        filters["price"] = price_filter
-    
     # Get items with filters, pagination, and sorting
-    return await catalog_db.list_items(skip, limit, filters, sort_by, sort_desc)
+    return MongoJSONResponse(await catalog_db.list_items(
+        skip, limit, filters, sort_by, sort_desc, after, include_total, count_mode, projection
+    ))
 
 
 @router.get("/stores/{store_id}/items", response_model=PaginatedResponse)
@@ -117,42 +203,182 @@ async def get_store_items(
     store_id: str = Path(..., description="The ID of the store"),
     skip: int = Query(0, ge=0, description="Skip the first n results"),
     limit: int = Query(20, ge=1, le=100, description="Limit the number of results"),
-    category: Optional[str] = Query(None, description="Filter by category"),
-    subcategory: Optional[str] = Query(None, description="Filter by subcategory"),
-    is_organic: Optional[bool] = Query(None, description="Filter by organic status"),
-    is_vegan: Optional[bool] = Query(None, description="Filter by vegan status"),
-    is_gluten_free: Optional[bool] = Query(None, description="Filter by gluten-free status"),
-    min_price: Optional[float] = Query(None, ge=0, description="Minimum price"),
-    max_price: Optional[float] = Query(None, ge=0, description="Maximum price"),
+    filters: Dict[str, Any] = Depends(item_filters),
     sort_by: str = Query("created_at", description="Sort by field"),
-    sort_desc: bool = Query(True, description="Sort in descending order")
+    sort_desc: bool = Query(True, description="Sort in descending order"),
+    after: Optional[str] = Query(None, description="Cursor from `next_cursor` of the previous page"),
+    include_total: bool = Query(False, description="Also count the total (an extra count query)"),
+    count_mode: str = Query("cached", pattern="^(exact|cached|estimated)$", description="How to compute the total"),
+    category_id: Optional[str] = Query(None, description="Only items in this category or its subcategories"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
 ):
     """Get all items for a specific store with pagination, filtering, and sorting. Public access."""
-    # Build filters based on query parameters
-    filters = {}
+    if category_id:
+        filters = {**filters, **await category_trees.subtree_filter(store_id, category_id)}
+    # Get items with filters, pagination, and sorting
+    return MongoJSONResponse(await catalog_db.get_store_items(
+        store_id, skip, limit, filters, sort_by, sort_desc, after, include_total, count_mode, projection
+    ))
+
+
+@router.get("/stores/{store_id}/items/changes", response_model=ItemChangesResponse)
+async def get_store_item_changes(
+    store_id: str = Path(..., description="The ID of the store"),
+    since: Optional[str] = Query(None, description="`next_token` of the previous sync; omit to fetch everything"),
+    limit: int = Query(500, ge=1, le=1000, description="Maximum number of changes per page"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
+):
+    """
+    Items created or updated and IDs of items deleted since the previous sync. Public access.
+    Keep fetching with `next_token` while `has_more` is true, then store it for the next sync.
+    An expired token is answered with 410; the client then downloads the whole catalog again.
+    """
+    return MongoJSONResponse(await catalog_db.get_item_changes(store_id, since, limit, projection))
+
+
+@router.get("/items:facets", response_model=FacetedResponse)
+async def facet_items(
+    store_id: Optional[str] = Query(None, description="Filter by store ID"),
+    limit: int = Query(20, ge=1, le=100, description="Limit the number of results"),
+    filters: Dict[str, Any] = Depends(item_filters),
+    sort_by: str = Query("created_at", description="Sort by field"),
+    sort_desc: bool = Query(True, description="Sort in descending order"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
+):
+    """
+    First page of filtered items with facet counts and a price histogram. Public access.
+    Further pages come from the list endpoints with the returned cursor.
+    """
+    return MongoJSONResponse(await catalog_db.facet_items(filters, limit, sort_by, sort_desc, store_id, projection))
+
+
+@router.get("/stores/{store_id}/items:facets", response_model=FacetedResponse)
+async def facet_store_items(
+    store_id: str = Path(..., description="The ID of the store"),
+    limit: int = Query(20, ge=1, le=100, description="Limit the number of results"),
+    filters: Dict[str, Any] = Depends(item_filters),
+    sort_by: str = Query("created_at", description="Sort by field"),
+    sort_desc: bool = Query(True, description="Sort in descending order"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
+):
+    """First page of a store's filtered items with facet counts and a price histogram. Public access."""
+    return MongoJSONResponse(await catalog_db.facet_items(filters, limit, sort_by, sort_desc, store_id, projection))
+
+
+@router.post("/stores/{store_id}/items:import", response_model=ImportReport)
+async def import_store_items(
+    store_id: str = Path(..., description="The ID of the store to import into"),
+    file: UploadFile = File(..., description="CSV or NDJSON catalog feed"),
+    format: Optional[str] = Query(
+        None, pattern="^(csv|ndjson)$", description="Feed format (guessed from the file name if omitted)"
+    ),
+    batch_size: int = Query(settings.IMPORT_BATCH_SIZE, ge=1, le=5000, description="Items per bulk write"),
+    _: str = Depends(get_current_user_id)
+):
+    """
+    Bulk create or update a store's items from a CSV or NDJSON feed. Requires authentication.
+    Items are matched on `sku`, or on `name` when a row has no SKU. Invalid rows are reported, not fatal.
+    """
+    # In a real implementation, we would verify that the user owns the store
+    if not ObjectId.is_valid(store_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid store ID format: {store_id}"
+        )
     
-    if category:
-        filters["category"] = category
-    if subcategory:
-        filters["subcategory"] = subcategory
-    if is_organic is not None:
-        filters["is_organic"] = is_organic
-    if is_vegan is not None:
-        filters["is_vegan"] = is_vegan
-    if is_gluten_free is not None:
-        filters["is_gluten_free"] = is_gluten_free
-        
-    # Price range
-    price_filter = {}
-    if min_price is not None:
-        price_filter["$gte"] = min_price
-    if max_price is not None:
-        price_filter["$lte"] = max_price
-    if price_filter:
-        filters["price"] = price_filter
+    file_format = format
+    if file_format is None:
+        filename = (file.filename or "").lower()
+        file_format = "csv" if filename.endswith(".csv") or file.content_type == "text/csv" else "ndjson"
     
-    # Get items with filters, pagination, and sorting
-    return await catalog_db.get_store_items(store_id, skip, limit, filters, sort_by, sort_desc)
+    return await import_catalog(
+        store_id,
+        lambda: file.read(settings.IMPORT_CHUNK_SIZE),
+        file_format,
+        batch_size
+    )
+
+
+@router.get("/stores/{store_id}/items:export")
+async def export_store_items(
+    store_id: str = Path(..., description="The ID of the store to export"),
+    format: str = Query("ndjson", pattern="^(csv|ndjson)$", description="Export format"),
+    after: Optional[str] = Query(None, description="Resume token: the `_id` of the last item received"),
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, ge=1, le=5000, description="Items per database round trip"),
+    accept_encoding: Optional[str] = Header(None)
+):
+    """
+    Stream a store's whole catalog as NDJSON or CSV, in `_id` order. Public access.
+    The body is gzip-compressed when the client accepts it. An interrupted download
+    continues from where it stopped by passing the last received `_id` as `after`.
+    """
+    if not ObjectId.is_valid(store_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid store ID format: {store_id}"
+        )
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid resume token: {after}"
+        )
+    
+    compress = accepts_gzip(accept_encoding)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{store_id}.{format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export_catalog(store_id, format, ObjectId(after) if after else None, batch_size, compress),
+        media_type=MEDIA_TYPES[format],
+        headers=headers
+    )
+
+
+@router.post("/categories", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
+async def create_category(category: Category, _: str = Depends(get_current_user_id)):
+    """Create a category, optionally below `parent_id`. Requires authentication."""
+    return MongoJSONResponse(await catalog_db.create_category(category), status_code=status.HTTP_201_CREATED)
+
+
+@router.get("/stores/{store_id}/categories", response_model=List[CategoryNode])
+async def get_category_tree(
+    store_id: str = Path(..., description="The ID of the store"),
+    root_id: Optional[str] = Query(None, description="Only the subtree under this category"),
+    include_inactive: bool = Query(False, description="Include inactive categories"),
+):
+    """Get a store's category tree, siblings in display order. Public access."""
+    return MongoJSONResponse(await category_trees.tree(store_id, root_id, include_inactive))
+
+
+@router.get("/stores/{store_id}/categories/{category_id}/breadcrumb", response_model=List[BreadcrumbEntry])
+async def get_category_breadcrumb(
+    store_id: str = Path(..., description="The ID of the store"),
+    category_id: str = Path(..., description="The ID of the category")
+):
+    """Get the path from the top level down to a category. Public access."""
+    return MongoJSONResponse(await category_trees.breadcrumb(store_id, category_id))
+
+
+@router.put("/categories/{category_id}", response_model=Dict[str, Any])
+async def update_category(
+    update_data: CategoryUpdate,
+    category_id: str = Path(..., description="The ID of the category to update"),
+    _: str = Depends(get_current_user_id)
+):
+    """Update a category; a new `parent_id` moves it with its subtree. Requires authentication."""
+    return MongoJSONResponse(await catalog_db.update_category(category_id, update_data))
+
+
+@router.delete("/categories/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_category(
+    category_id: str = Path(..., description="The ID of the category to delete"),
+    _: str = Depends(get_current_user_id)
+):
+    """Delete a category without subcategories or items. Requires authentication."""
+    await catalog_db.delete_category(category_id)
 
 
 @router.get("/search", response_model=PaginatedResponse)
@@ -160,19 +386,56 @@ async def search_items(
     q: str = Query(..., description="Search query"),
     store_id: Optional[str] = Query(None, description="Filter by store ID"),
     skip: int = Query(0, ge=0, description="Skip the first n results"),
-    limit: int = Query(20, ge=1, le=100, description="Limit the number of results")
+    limit: int = Query(20, ge=1, le=100, description="Limit the number of results"),
+    filters: Dict[str, Any] = Depends(item_filters),
+    engine: Optional[str] = Query(
+        None, pattern="^(mongo|bm25)$", description="Search engine (bm25 needs store_id; defaults to SEARCH_ENGINE)"
+    ),
+    count_mode: str = Query("cached", pattern="^(exact|cached|estimated)$", description="How to compute the total"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
 ):
-    """Search catalog items by text. Public access."""
-    return await catalog_db.search_items(q, store_id, skip, limit)
+    """
+    Search catalog items by text. Public access.
+    The bm25 engine ranks with an in-memory index of the store and matches the last word as a prefix.
+    Words the store does not know are corrected to its closest ones (reported as `corrected_query`)
+    and every word also matches its grocery synonyms.
+    """
+    bm25 = (engine or settings.SEARCH_ENGINE) == "bm25" and store_id
+    rewrite = await spellers.rewrite(q, store_id, complete_last=bool(bm25))
+    if bm25:
+        result = await search_indexes.search_items(q, store_id, filters, skip, limit, projection, rewrite.terms)
+    else:
+        result = await catalog_db.search_items(
+            rewrite.text_query(q), store_id, skip, limit, count_mode, filters, projection
+        )
+    result.corrected_query = rewrite.corrected
+    return MongoJSONResponse(result)
+
+
+@router.get("/search/suggest", response_model=SuggestResponse)
+async def suggest_items(
+    q: str = Query(..., min_length=1, description="What the user has typed so far"),
+    store_id: str = Query(..., description="Store to suggest from"),
+    limit: int = Query(8, ge=1, le=settings.SUGGEST_MAX_RESULTS, description="Limit the number of suggestions")
+):
+    """
+    Typeahead suggestions of item names, brands and categories. Public access.
+    Matches the start of any word and ranks by popularity.
+    """
+    return MongoJSONResponse(await suggest_indexes.suggest(q, store_id, limit))
 
 
 @router.get("/featured", response_model=List[Dict[str, Any]])
 async def get_featured_items(
     store_id: Optional[str] = Query(None, description="Filter by store ID"),
-    limit: int = Query(10, ge=1, le=50, description="Limit the number of results")
+    limit: int = Query(10, ge=1, le=50, description="Limit the number of results"),
+    projection: Optional[Dict[str, Any]] = Depends(item_projection)
 ):
-    """Get featured items, optionally filtered by store. Public access."""
-    return await catalog_db.get_featured_items(store_id, limit)
+    """
+    Get featured items in shelf order, optionally filtered by store. Public access.
+    Served from the precomputed featured shelves rather than the catalog collection.
+    """
+    return MongoJSONResponse(await featured_shelves.get_featured_items(store_id, limit, projection))
 
 
 @router.put("/items/{item_id}/stock", response_model=Dict[str, Any])
@@ -183,7 +446,132 @@ async def update_item_stock(
 ):
     """Update the stock quantity of an item. Requires authentication."""
     # In a real implementation, we would verify that the user owns the store that owns this item
-    return await catalog_db.update_stock(item_id, quantity_change)
+    return MongoJSONResponse(await catalog_db.update_stock(item_id, quantity_change))
+
+
+@router.post("/stock:reserve", response_model=Dict[str, Any])
+async def reserve_stock(
+    request: StockReservationRequest,
+    _: str = Depends(get_current_user_id)
+):
+    """
+    Take stock for every line of an order in one step. Requires authentication.
+    Either all lines are applied or none are (409 lists the items that could not be reserved).
+    """
+    lines: Dict[str, int] = {}
+    for line in request.lines:
+        lines[line.item_id] = lines.get(line.item_id, 0) + line.quantity
+    
+    reference = await catalog_db.reserve_stock(lines, request.reference)
+    return MongoJSONResponse({
+        "reference": reference,
+        "lines": [{"item_id": i, "quantity": q} for i, q in lines.items()]
+    })
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+@router.get("/images/{image_id}")
+async def get_image(
+    image_id: str,
+    w: Optional[int] = Query(None, ge=1, le=settings.IMAGE_MAX_DIMENSION, description="Maximum width"),
+    h: Optional[int] = Query(None, ge=1, le=settings.IMAGE_MAX_DIMENSION, description="Maximum height"),
+    fmt: Optional[str] = Query(
+        None, pattern="^(jpeg|png|webp|avif)$", description="Image format (negotiated from Accept if omitted)"
+    ),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get an image scaled to fit within `w` x `h` (never enlarged), in `fmt`.
+    Without `fmt`, AVIF or WebP is sent to clients whose Accept header lists
+    it, JPEG to the rest. Derivatives are rendered on first request and
+    cached on disk. Content is immutable per URL and format, so the ETag is
+    derived from them alone and a revalidation is answered without touching
+    the disk.
+    """
+    image_store.validate_id(image_id)
+    headers = {"Cache-Control": f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}, immutable"}
+    if fmt is None:
+        fmt = negotiate_format(accept)
+        headers["Vary"] = "Accept"
+    elif fmt not in IMAGE_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Image format not supported by this server: {fmt}"
+        )
+    etag = f'"{image_id}-{w or 0}x{h or 0}-{fmt}"'
+    headers["ETag"] = etag
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path = await image_store.variant(image_id, w, h, fmt)
+    return FileResponse(path, media_type=IMAGE_FORMATS[fmt][1], headers=headers)
+
+
+@router.get("/stores/{store_id}/menu")
+async def get_store_menu(
+    store_id: str = Path(..., description="The ID of the store"),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get a store's menu in one document: the category tree, the featured item IDs, the first page
+    of item IDs of every category and the cards of all of them keyed by ID. Public access.
+    Precompiled and kept current in the background; revalidate with the ETag.
+    """
+    snapshot = await menu_snapshots.get(store_id)
+    headers = {
+        "ETag": f"W/{snapshot.etag}",
+        "Cache-Control": f"public, max-age={settings.MENU_CACHE_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(if_none_match, snapshot.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if accepts_gzip(accept_encoding):
+        headers["Content-Encoding"] = "gzip"
+        return Response(snapshot.gzipped, media_type="application/json", headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
+
+
+@router.get("/cache/stats", response_model=Dict[str, Any])
+async def get_cache_stats():
+    """Hit, miss and eviction counters of the catalog caches."""
+    return {
+        "items": item_cache.stats(),
+        "counts": {"entries": len(count_cache)},
+        "featured": {"shelves": len(featured_shelves.local), "builds": featured_shelves.builds},
+        "menus": {"snapshots": len(menu_snapshots.local), "builds": menu_snapshots.builds},
+        "images": {
+            "variants": len(image_store.variants),
+            "bytes": image_store.variants.bytes,
+            "hits": image_store.variant_hits,
+            "misses": image_store.variant_misses,
+            "evictions": image_store.variants.evictions,
+            "formats": image_store.delivery_stats(),
+        },
+    }
+
+
+@router.get("/indexes/advice", response_model=List[IndexAdvice])
+async def get_index_advice(
+    flagged_only: bool = Query(False, description="Only shapes needing a COLLSCAN or an in-memory SORT"),
+    _: str = Depends(get_current_user_id)
+):
+    """
+    Explain the list query shapes this replica has served. Requires authentication.
+    Shapes whose plan scans the collection or sorts in memory need a better index.
+    """
+    advice = await explain_shapes(query_shapes.shapes())
+    if flagged_only:
+        advice = [a for a in advice if a.collection_scan or a.in_memory_sort]
+    return advice
 
 
 @router.get("/health", status_code=200)
@@ -1,50 +1,24 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from fastapi.responses import FileResponse
 from pathlib import Path
 from typing import List
 import aiofiles
 import os
-import uuid
-from PIL import Image
-import io
 import shutil
 
 from ..config import settings
 from ..auth import get_current_user
 from ..models import StoreOwner
 from ..db import db
+from ..services.image_pipeline import staged_upload
+from ..services.image_store import image_store
 
 router = APIRouter(prefix="/images", tags=["images"])
 
-async def save_image(image_data: bytes, image_id: str, size_name: str, size: tuple) -> str:
-    """Save image with specified dimensions and return the file path."""
-    try:
-        # Create size directory if it doesn't exist
-        size_dir = os.path.join(settings.UPLOAD_DIR, size_name)
-        os.makedirs(size_dir, exist_ok=True)
-        
-        # Resize image
-        img = Image.open(io.BytesIO(image_data))
-        img = img.convert('RGB')  # Convert to RGB to ensure JPEG compatibility
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        
-        # Save resized image
-        file_path = os.path.join(size_dir, f"{image_id}.jpg")
-        img.save(file_path, "JPEG", quality=85)
-        return file_path
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-
-async def process_image(image_data: bytes, image_id: str):
-    """Process and save image in all required sizes."""
-    for size_name, dimensions in settings.IMAGE_SIZES.items():
-        await save_image(image_data, image_id, size_name, dimensions)
-
 @router.post("/upload/{product_id}")
 async def upload_image(
     product_id: str,
     file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = None,
     current_user: StoreOwner = Depends(get_current_user)
 ) -> dict:
     """Upload a product image and create variants in different sizes."""
@@ -53,50 +27,42 @@ async def upload_image(
     if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    # Read file content
-    content = await file.read()
-    if len(content) > settings.MAX_IMAGE_SIZE:
-        raise HTTPException(status_code=400, detail="File too large")
-    
     # Verify product ownership
     product = await db.get_product(product_id)
     if not product or str(product.store_id) != str(current_user.store_id):
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Generate unique image ID
-    image_id = str(uuid.uuid4())
-    
-    # Process image in background
-    background_tasks.add_task(process_image, content, image_id)
+    # Copy the upload to disk (the request body was capped as it arrived) and
+    # store it under its content hash before answering, so a full pipeline
+    # surfaces as 429. A known image is not resized again; new ones are
+    # resized in worker processes, off the event loop
+    async with staged_upload(file, Path(settings.UPLOAD_DIR) / "temp") as upload:
+        image_id = await image_store.save(upload)
     
-    # Update product with image ID
+    # Update product with image ID, releasing the reference held for the
+    # image it replaces (or for the same image, uploaded again)
     await db.update_product(product_id, {"image_id": image_id})
+    if product.image_id:
+        await image_store.release(product.image_id)
     
     # Return image URLs for all sizes
-    return {
-        size: f"/images/{size}/{image_id}" 
-        for size in settings.IMAGE_SIZES.keys()
-    }
+    return image_store.urls(image_id)
 
 @router.delete("/{image_id}")
 async def delete_image(
     image_id: str,
     current_user: StoreOwner = Depends(get_current_user)
 ) -> dict:
-    """Delete an image and all its size variants."""
+    """Remove a product's image."""
     
     # Verify image ownership through product
     product = await db.get_product_by_image(image_id)
     if not product or str(product.store_id) != str(current_user.store_id):
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Delete all size variants
-    for size_name in settings.IMAGE_SIZES.keys():
-        file_path = os.path.join(settings.UPLOAD_DIR, size_name, f"{image_id}.jpg")
-        try:
-            os.remove(file_path)
-        except FileNotFoundError:
-            pass  # Ignore if file doesn't exist
+    # Other products may share the image; its files are garbage collected
+    # once nothing references it
+    await image_store.release(image_id)
     
     # Update product to remove image reference
     await db.update_product(str(product.id), {"image_id": None})
@@ -109,8 +75,8 @@ async def get_image(size: str, image_id: str):
     if size not in settings.IMAGE_SIZES:
         raise HTTPException(status_code=400, detail="Invalid size")
     
-    file_path = os.path.join(settings.UPLOAD_DIR, size, f"{image_id}.jpg")
-    if not os.path.exists(file_path):
+    file_path = image_store.path(size, image_id)
+    if not file_path.exists():
         raise HTTPException(status_code=404, detail="Image not found")
     
     return FileResponse(file_path, media_type="image/jpeg") 
\ No newline at end of file
@@ -0,0 +1,233 @@
+import bisect
+import logging
+import re
+from array import array
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+
+from config import settings
+from db import catalog_db, CATEGORIES_COLLECTION_NAME, DB_NAME, item_count_deltas
+from models import BreadcrumbEntry, CategoryNode
+from services.store_index import StoreIndexManager
+
+
+logger = logging.getLogger(__name__)
+
+TREE_PROJECTION = {
+    "store_id": 1, "name": 1, "slug": 1, "parent_id": 1, "path": 1, "depth": 1,
+    "display_order": 1, "is_active": 1, "product_count": 1,
+}
+
+
+class StoreCategoryTree:
+    """One store's categories as parallel arrays indexed by slot.
+
+    Slots are also kept sorted by materialized path, so a subtree is the
+    contiguous run of paths starting with its root's path (two bisections)
+    and a breadcrumb is the path split into ancestor IDs. Nothing here reads
+    the database; the manager keeps the tree current from category changes.
+    """
+
+    def __init__(self, store_id: str):
+        self.store_id = store_id
+        self.slots: Dict[str, int] = {}
+        self.ids: List[Optional[str]] = []
+        self.names: List[str] = []
+        self.slugs: List[Optional[str]] = []
+        self.paths: List[str] = []
+        self.depths = array("i")
+        self.orders = array("i")
+        self.active = array("b")
+        self.counts = array("q")
+        self.free: List[int] = []
+        self._order: Optional[List[int]] = None
+        self._sorted_paths: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def finish_build(self) -> None:
+        self._order = None
+
+    def add(self, category: Dict[str, Any]) -> None:
+        """Insert or replace a category; a changed path moves its descendants along."""
+        category_id = str(category["_id"])
+        path = category["path"]
+        slot = self.slots.get(category_id)
+        if slot is None:
+            slot = self.free.pop() if self.free else len(self.ids)
+            if slot == len(self.ids):
+                self.ids.append(None)
+                self.names.append("")
+                self.slugs.append(None)
+                self.paths.append("")
+                self.depths.append(0)
+                self.orders.append(0)
+                self.active.append(0)
+                self.counts.append(0)
+            self.slots[category_id] = slot
+        elif self.paths[slot] != path:
+            old_path, depth_change = self.paths[slot], category.get("depth", 0) - self.depths[slot]
+            for descendant in self._subtree_slots(old_path):
+                if descendant != slot:
+                    self.paths[descendant] = path + self.paths[descendant][len(old_path):]
+                    self.depths[descendant] += depth_change
+
+        self.ids[slot] = category_id
+        self.names[slot] = category.get("name", "")
+        self.slugs[slot] = category.get("slug")
+        self.paths[slot] = path
+        self.depths[slot] = category.get("depth", 0)
+        self.orders[slot] = category.get("display_order", 0)
+        self.active[slot] = 1 if category.get("is_active", True) else 0
+        self.counts[slot] = category.get("product_count", 0)
+        self._order = None
+
+    def set_counts(self, counts: Dict[str, int]) -> None:
+        """Replace the product counts of the given categories."""
+        for category_id, count in counts.items():
+            slot = self.slots.get(category_id)
+            if slot is not None:
+                self.counts[slot] = count
+
+    def remove(self, category_id: str) -> None:
+        slot = self.slots.pop(category_id, None)
+        if slot is None:
+            return
+        self.ids[slot] = None
+        self.paths[slot] = ""
+        self.free.append(slot)
+        self._order = None
+
+    def _sorted(self) -> List[int]:
+        if self._order is None:
+            self._order = sorted(self.slots.values(), key=self.paths.__getitem__)
+            self._sorted_paths = [self.paths[slot] for slot in self._order]
+        return self._order
+
+    def _subtree_slots(self, path: str) -> List[int]:
+        order = self._sorted()
+        start = bisect.bisect_left(self._sorted_paths, path)
+        end = bisect.bisect_left(self._sorted_paths, path + "\uffff", start)
+        return order[start:end]
+
+    def _slot(self, category_id: str) -> int:
+        slot = self.slots.get(category_id)
+        if slot is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Category with ID {category_id} not found in store {self.store_id}"
+            )
+        return slot
+
+    def path(self, category_id: str) -> str:
+        return self.paths[self._slot(category_id)]
+
+    def subtree_ids(self, category_id: str) -> List[str]:
+        """The category and all its descendants."""
+        return [self.ids[slot] for slot in self._subtree_slots(self.path(category_id))]
+
+    def breadcrumb(self, category_id: str) -> List[BreadcrumbEntry]:
+        """Ancestors from the top level down to the category itself."""
+        self._slot(category_id)
+        crumbs = []
+        for ancestor_id in self.path(category_id).strip("/").split("/"):
+            slot = self.slots.get(ancestor_id)
+            if slot is not None:
+                crumbs.append(BreadcrumbEntry(id=ancestor_id, name=self.names[slot], slug=self.slugs[slot]))
+        return crumbs
+
+    def nodes(self, root_id: Optional[str] = None, include_inactive: bool = False) -> List[CategoryNode]:
+        """The tree (or the subtree under `root_id`) as nested nodes, siblings by display order."""
+        slots = self._subtree_slots(self.path(root_id)) if root_id else self._sorted()
+        nodes: Dict[str, CategoryNode] = {}
+        roots: List[CategoryNode] = []
+        # Paths sort parents before their children
+        for slot in slots:
+            if not self.active[slot] and not include_inactive:
+                continue
+            parent_id = self.paths[slot].rstrip("/").rsplit("/", 2)[-2] or None
+            node = CategoryNode(
+                id=self.ids[slot],
+                name=self.names[slot],
+                slug=self.slugs[slot],
+                parent_id=parent_id,
+                path=self.paths[slot],
+                depth=self.depths[slot],
+                display_order=self.orders[slot],
+                is_active=bool(self.active[slot]),
+                product_count=self.counts[slot]
+            )
+            nodes[node.id] = node
+            parent = nodes.get(parent_id) if node.id != root_id else None
+            if parent is not None:
+                parent.children.append(node)
+            elif node.id == root_id or root_id is None and parent_id is None:
+                roots.append(node)
+
+        def sort(siblings: List[CategoryNode]) -> None:
+            siblings.sort(key=lambda node: (node.display_order, node.name))
+            for node in siblings:
+                sort(node.children)
+
+        sort(roots)
+        return roots
+
+
+class CategoryTreeManager(StoreIndexManager[StoreCategoryTree]):
+    index_class = StoreCategoryTree
+    projection = TREE_PROJECTION
+    collection_name = CATEGORIES_COLLECTION_NAME
+    name = "category"
+
+    async def tree(self, store_id: str, root_id: Optional[str] = None,
+                   include_inactive: bool = False) -> List[CategoryNode]:
+        self.validate_store_id(store_id)
+        return (await self.get_index(store_id)).nodes(root_id, include_inactive)
+
+    async def breadcrumb(self, store_id: str, category_id: str) -> List[BreadcrumbEntry]:
+        self.validate_store_id(store_id)
+        return (await self.get_index(store_id)).breadcrumb(category_id)
+
+    async def subtree_filter(self, store_id: str, category_id: str) -> Dict[str, Any]:
+        """Item filter matching a category and its descendants: one anchored prefix match."""
+        self.validate_store_id(store_id)
+        path = (await self.get_index(store_id)).path(category_id)
+        return {"category_path": {"$regex": f"^{re.escape(path)}"}}
+
+    async def on_item_change(self, change) -> None:
+        """Catalog change listener keeping product counts current.
+
+        The writer has already updated the stored counters; the loaded tree
+        re-reads those of the categories the item left or joined, or every
+        counter of the store after an import or another replica's change.
+        """
+        if self.hold(change, self.on_item_change):
+            return
+        if change.op == "resync":
+            self._indexes.clear()
+            return
+        if change.op == "stock":
+            return
+
+        index = self.loaded_index(change.store_id)
+        if index is None:
+            return
+
+        if change.op == "bulk" or change.remote:
+            # Which counters moved is unknown here; the tree itself is kept
+            query = {"store_id": ObjectId(change.store_id)}
+        else:
+            category_ids = list(item_count_deltas(change.item, change.previous))
+            if not category_ids:
+                return
+            query = {"_id": {"$in": [ObjectId(category_id) for category_id in category_ids]}}
+        db = catalog_db.client[DB_NAME]
+        cursor = db[self.collection_name].find(query, {"product_count": 1})
+        index.set_counts({str(category["_id"]): category.get("product_count", 0) async for category in cursor})
+
+
+# Create global instance
+category_trees = CategoryTreeManager(settings.CATEGORY_TREE_MAX_STORES)
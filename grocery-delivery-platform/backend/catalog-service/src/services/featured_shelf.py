@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+
+from cache import AsyncRedisCache, LRUCache, redis_cache
+from config import settings
+from db import catalog_db
+from projection import project_item
+
+
+logger = logging.getLogger(__name__)
+
+
+class FeaturedShelves:
+    """Precomputed featured-item shelves, one per store plus a global one.
+
+    A shelf is the first FEATURED_SHELF_SIZE featured items in rank order. It
+    is read from memory, then Redis, and only built from the catalog on a miss
+    in both. The replica making a change rebuilds the affected shelves it
+    serves (and drops the Redis copy of the others) before the change reaches
+    other replicas, which then only drop their in-memory copy.
+    """
+
+    KEY_PREFIX = "catalog:featured:"
+    GLOBAL = "all"
+
+    def __init__(self, redis_cache: AsyncRedisCache, size: int, max_shelves: int, ttl: int):
+        self.redis_cache = redis_cache
+        self.size = size
+        self.ttl = ttl
+        self.local = LRUCache(max_shelves, ttl)
+        self.builds = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.KEY_PREFIX}{key}"
+
+    async def rebuild(self, key: str) -> List[Dict[str, Any]]:
+        """Recompute a shelf from the catalog and store it in both tiers."""
+        self.builds += 1
+        shelf = await catalog_db.get_featured_items(None if key == self.GLOBAL else key, self.size)
+        self.local.set(key, shelf)
+        await self.redis_cache.set(self._redis_key(key), shelf, self.ttl)
+        return shelf
+
+    async def get_shelf(self, store_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A store's shelf, or the global one when no store is given."""
+        if store_id and not ObjectId.is_valid(store_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid store ID format: {store_id}"
+            )
+        key = store_id or self.GLOBAL
+
+        shelf = self.local.get(key)
+        if shelf is not None:
+            return shelf
+
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            shelf = self.local.get(key)
+            if shelf is None:
+                shelf = await self.redis_cache.get(self._redis_key(key))
+                if shelf is not None:
+                    self.local.set(key, shelf)
+                else:
+                    shelf = await self.rebuild(key)
+        return shelf
+
+    async def get_featured_items(self, store_id: Optional[str] = None, limit: int = 10,
+                                 projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """The top `limit` items of a shelf, trimmed to `projection`."""
+        shelf = await self.get_shelf(store_id)
+        return [project_item(dict(item), projection) for item in shelf[:limit]]
+
+    async def on_change(self, change) -> None:
+        """Catalog change listener keeping shelves current."""
+        if change.op == "resync":
+            self.local.clear()
+            return
+        if change.op == "stock":
+            # Stock levels on shelf cards catch up within the TTL
+            return
+
+        keys = [self.GLOBAL] + ([change.store_id] if change.store_id else [])
+        if change.remote:
+            # The writing replica has already refreshed Redis
+            for key in keys:
+                self.local.delete(key)
+            return
+
+        documents = [doc for doc in (change.item, change.previous) if doc is not None]
+        if documents and not any(doc.get("featured") for doc in documents):
+            return
+        for key in keys:
+            if self.local.get(key) is None:
+                # Not served here; whoever reads it next rebuilds it
+                await self.redis_cache.delete(self._redis_key(key))
+                continue
+            try:
+                await self.rebuild(key)
+            except Exception as e:
+                logger.error(f"Error rebuilding featured shelf {key}: {str(e)}")
+                self.local.delete(key)
+                await self.redis_cache.delete(self._redis_key(key))
+
+
+# Create global instance
+featured_shelves = FeaturedShelves(
+    redis_cache,
+    settings.FEATURED_SHELF_SIZE,
+    settings.FEATURED_MAX_SHELVES,
+    settings.FEATURED_SHELF_TTL
+)
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, NamedTuple, Optional, Tuple
+
+import aiofiles
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Formats derivatives can be served in: PIL format name and content type
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+Image.init()
+if "AVIF" in Image.SAVE:
+    # Only when Pillow is built with libavif
+    IMAGE_FORMATS["avif"] = ("AVIF", "image/avif")
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """The first IMAGE_PREFERRED_FORMATS entry the Accept header lists, else JPEG.
+
+    Formats must be listed by name: `image/*` is sent by clients that cannot
+    decode AVIF or WebP, so it only ever gets JPEG.
+    """
+    accepted = set()
+    for part in (accept or "").split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.lower())
+    for fmt in settings.IMAGE_PREFERRED_FORMATS:
+        if fmt in IMAGE_FORMATS and IMAGE_FORMATS[fmt][1] in accepted:
+            return fmt
+    return "jpeg"
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large, the limit is {settings.MAX_IMAGE_SIZE} bytes"
+    )
+
+
+class StagedUpload(NamedTuple):
+    path: Path
+    digest: str  # SHA-256 of the uploaded bytes
+    size: int
+
+
+class UploadSizeLimit:
+    """ASGI middleware capping request bodies on the image upload routes.
+
+    Starlette spools a multipart body to a temporary file before the route
+    runs, so the limit has to be applied to the request stream: a declared
+    Content-Length over `max_bytes` is refused up front and a body sent
+    without one is counted as it arrives, both with 413.
+    """
+
+    def __init__(self, app, path_prefixes: Tuple[str, ...], max_bytes: int):
+        self.app = app
+        self.path_prefixes = path_prefixes
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            error = _too_large()
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised from the form parser, so it is answered like the route's own errors
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+@asynccontextmanager
+async def staged_upload(file: UploadFile, directory: Path) -> AsyncIterator[StagedUpload]:
+    """Copy a spooled upload to a temporary file in `directory`, hashing it on the way.
+
+    The request body has already been capped by UploadSizeLimit; the file
+    part itself is held to MAX_IMAGE_SIZE here (413). It is copied in
+    IMAGE_CHUNK_SIZE pieces, so it is never held in memory whole. The file
+    is removed on exit.
+    """
+    if file.size is not None and file.size > settings.MAX_IMAGE_SIZE:
+        raise _too_large()
+
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{uuid.uuid4()}.upload"
+    try:
+        digest = hashlib.sha256()
+        received = 0
+        async with aiofiles.open(path, "wb") as out_file:
+            while chunk := await file.read(settings.IMAGE_CHUNK_SIZE):
+                received += len(chunk)
+                if received > settings.MAX_IMAGE_SIZE:
+                    raise _too_large()
+                digest.update(chunk)
+                await out_file.write(chunk)
+        yield StagedUpload(path, digest.hexdigest(), received)
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def render_sizes(source: str, sizes: Dict[str, Tuple[int, int]], quality: int = 85) -> Dict[str, bytes]:
+    """Decode the image file at `source` once and encode a JPEG for every size.
+
+    Runs in a worker process. Sizes are rendered largest first, each scaled
+    down from the previous one rather than from the full decode. JPEGs are
+    decoded straight at a reduced scale when the largest size allows it.
+    """
+    with Image.open(source) as img:
+        largest = max(sizes.values(), key=lambda size: size[0] * size[1])
+        img.draft("RGB", largest)
+        current = img.convert("RGB")
+
+    rendered = {}
+    for size_name, dimensions in sorted(sizes.items(), key=lambda entry: -entry[1][0] * entry[1][1]):
+        current.thumbnail(dimensions, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        current.save(buffer, "JPEG", quality=quality, optimize=True)
+        rendered[size_name] = buffer.getvalue()
+    return rendered
+
+
+def render_variant(source: str, box: Tuple[int, int], fmt: str, quality: int = 85,
+                   baseline: bool = False) -> Tuple[bytes, Optional[int]]:
+    """Decode the image file at `source` and encode it fitted within `box`.
+
+    Runs in a worker process. Images are only ever scaled down; transparency
+    is kept for formats that support it. Also returns the size the variant
+    has as JPEG, the baseline for measuring what other formats save: always
+    for JPEG, and for other formats only when `baseline` asks for the extra
+    encode (None otherwise).
+    """
+    pil_format = IMAGE_FORMATS[fmt][0]
+    with Image.open(source) as img:
+        img.draft("RGB", box)
+        keep_alpha = pil_format != "JPEG" and ("A" in img.getbands() or "transparency" in img.info)
+        current = img.convert("RGBA" if keep_alpha else "RGB")
+
+    current.thumbnail(box, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    current.save(buffer, pil_format, quality=quality, optimize=True)
+    if pil_format == "JPEG":
+        return buffer.getvalue(), buffer.tell()
+    if not baseline:
+        return buffer.getvalue(), None
+
+    jpeg = io.BytesIO()
+    current.convert("RGB").save(jpeg, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), jpeg.tell()
+
+
+class ImagePipeline:
+    """Bounded process pool for image decoding and resizing.
+
+    At most `workers` images are processed at once and `queue_depth` more may
+    wait for a worker; past that, uploads are turned away with 429 so a burst
+    cannot pile up unbounded work (and upload bodies) in memory.
+    """
+
+    def __init__(self, workers: int, queue_depth: int, quality: int = 85):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.quality = quality
+        self.in_flight = 0
+        self.rejected = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # The service process runs Mongo and Redis client threads, so
+            # workers are spawned rather than forked from it
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.in_flight >= self.workers + self.queue_depth:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Image processing queue is full, retry later",
+                headers={"Retry-After": str(settings.IMAGE_RETRY_AFTER)}
+            )
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor(), fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed while decoding a huge image); start
+            # a fresh pool for the next upload
+            logger.error("Image worker pool broke, restarting it")
+            self.shutdown()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error processing image"
+            )
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"Rejected image: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Image file could not be decoded"
+            )
+        finally:
+            self.in_flight -= 1
+
+    async def render(self, source: Path, sizes: Dict[str, Tuple[int, int]]) -> Dict[str, bytes]:
+        """Encoded JPEG bytes per size name for an image file. Raises 429 when the pipeline is full.
+
+        Only the path crosses to the worker, which reads the file itself.
+        """
+        return await self._run(render_sizes, str(source), sizes, self.quality)
+
+    async def render_variant(self, source: Path, box: Tuple[int, int], fmt: str,
+                             baseline: bool = False) -> Tuple[bytes, Optional[int]]:
+        """An image file fitted within `box` and encoded as `fmt`, and its size as JPEG if measured.
+
+        Raises 429 when the pipeline is full.
+        """
+        return await self._run(render_variant, str(source), box, fmt, self.quality, baseline)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Create global instance
+image_pipeline = ImagePipeline(
+    settings.IMAGE_WORKERS,
+    settings.IMAGE_QUEUE_DEPTH,
+    settings.IMAGE_QUALITY
+)
@@ -3,20 +3,18 @@ import shutil
 from pathlib import Path
 from typing import List, Optional
 from fastapi import UploadFile
-from PIL import Image
-import aiofiles
-import uuid
 from datetime import datetime
 
+from services.image_pipeline import staged_upload
+from services.image_store import image_store
+
 class ImageService:
     def __init__(self):
-        self.base_path = Path("data/images")
-        self.base_url = "/images"  # Local URL path
-        self.sizes = {
-            "thumbnail": (150, 150),
-            "medium": (300, 300),
-            "large": (800, 800)
-        }
+        # Derivatives are content-addressed and shared with the image routes
+        self.store = image_store
+        self.base_path = image_store.base_path
+        self.base_url = image_store.base_url  # Local URL path
+        self.sizes = image_store.sizes
         self._ensure_directories()
 
     def _ensure_directories(self):
@@ -28,63 +26,28 @@ class ImageService:
         """
         Save an image in multiple sizes and return URLs
         """
-        # Generate unique filename
-        ext = Path(file.filename).suffix
-        filename = f"{product_id}_{uuid.uuid4()}{ext}"
-        
-        # Save original file temporarily
-        temp_path = self.base_path / "temp" / filename
-        temp_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        try:
-            # Save uploaded file
-            async with aiofiles.open(temp_path, 'wb') as out_file:
-                content = await file.read()
-                await out_file.write(content)
-
-            # Process images in different sizes
-            urls = {}
-            with Image.open(temp_path) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Create different sizes
-                for size_name, dimensions in self.sizes.items():
-                    resized = self._resize_image(img, dimensions)
-                    size_path = self.base_path / size_name / filename
-                    resized.save(size_path, quality=85, optimize=True)
-                    urls[size_name] = f"{self.base_url}/{size_name}/{filename}"
-
-            return {
-                "id": filename,
-                "urls": urls,
-                "original_filename": file.filename,
-                "created_at": datetime.utcnow().isoformat()
-            }
-
-        finally:
-            # Clean up temporary file
-            if temp_path.exists():
-                temp_path.unlink()
-
-    def _resize_image(self, img: Image.Image, size: tuple[int, int]) -> Image.Image:
-        """Resize image maintaining aspect ratio"""
-        return img.copy().thumbnail(size, Image.Resampling.LANCZOS)
+        # Stream the upload to disk, hashing it; an image already stored
+        # under the same hash is not processed again
+        async with staged_upload(file, self.base_path / "temp") as upload:
+            image_id = await self.store.save(upload)
+
+        return {
+            "id": image_id,
+            "urls": self.store.urls(image_id),
+            "original_filename": file.filename,
+            "created_at": datetime.utcnow().isoformat()
+        }
 
     async def delete_image(self, image_id: str):
-        """Delete all sizes of an image"""
-        for size in self.sizes.keys():
-            path = self.base_path / size / image_id
-            if path.exists():
-                path.unlink()
+        """Drop this upload's reference to an image; shared files stay until unreferenced"""
+        await self.store.release(image_id)
 
     def get_image_url(self, image_id: str, size: str = "medium") -> Optional[str]:
         """Get URL for an image of specified size"""
         if size not in self.sizes:
             raise ValueError(f"Invalid size: {size}")
         
-        path = self.base_path / size / image_id
+        path = self.store.path(size, image_id)
         if not path.exists():
             return None
             
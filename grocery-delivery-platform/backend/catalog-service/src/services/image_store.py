@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiofiles
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument, UpdateOne
+
+from cache import DiskLRU, LRUCache
+from config import settings
+from db import catalog_db, DB_NAME, IMAGES_COLLECTION_NAME
+from services.image_pipeline import StagedUpload, image_pipeline
+
+
+logger = logging.getLogger(__name__)
+
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+# Images uploaded before content addressing are stored under a uuid4
+LEGACY_ID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+ORIGINALS_DIR = "originals"
+VARIANTS_DIR = "variants"
+
+
+def variant_name(digest: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+    """Cache file name of a derivative; 0 stands for an unconstrained side."""
+    return f"{digest}/{width or 0}x{height or 0}.{fmt}"
+
+
+class ImageStore:
+    """Content-addressed image derivatives.
+
+    An image is identified by the SHA-256 of its uploaded bytes. The upload
+    is kept under `originals/` and the fixed IMAGE_SIZES derivatives live at
+    `{base_path}/{size}/{digest}.jpg`; other dimensions and formats are
+    rendered from the original on first request and kept in a size-bounded
+    disk LRU under `variants/`. Each digest has a record in the images
+    collection counting the uploads referencing it, so the same photo
+    uploaded for many products is resized and stored once. Releasing the last
+    reference leaves the files in place; `collect_garbage` removes them once
+    they have been unreferenced for a grace period.
+    """
+
+    def __init__(self, base_path: Path, sizes: Dict[str, Tuple[int, int]],
+                 max_variant_bytes: int, base_url: str = "/images"):
+        self.base_path = base_path
+        self.sizes = sizes
+        self.base_url = base_url
+        self.variants = DiskLRU(base_path / VARIANTS_DIR, max_variant_bytes)
+        self.rendered = 0
+        self.reused = 0
+        self.variant_hits = 0
+        self.variant_misses = 0
+        # JPEG size of rendered variants (all JPEGs, a sample of the rest), and
+        # per served format the bytes sent next to what JPEG would have cost,
+        # to measure format savings
+        self.baselines = LRUCache(settings.IMAGE_BASELINE_MAX_ENTRIES, settings.IMAGE_CACHE_MAX_AGE)
+        self.deliveries: Dict[str, Dict[str, int]] = {}
+        self._variants_loaded = False
+        # Renders in progress on this replica, so concurrent duplicates wait
+        # for one result instead of each resizing the image
+        self._rendering: Dict[str, asyncio.Future] = {}
+
+    @property
+    def collection(self):
+        return catalog_db.client[DB_NAME][IMAGES_COLLECTION_NAME]
+
+    @staticmethod
+    def validate_id(image_id: str) -> None:
+        if not DIGEST_RE.fullmatch(image_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid image ID format: {image_id}"
+            )
+
+    def path(self, size_name: str, digest: str) -> Path:
+        return self.base_path / size_name / f"{digest}.jpg"
+
+    def original_path(self, digest: str) -> Path:
+        return self.base_path / ORIGINALS_DIR / digest
+
+    def urls(self, digest: str) -> Dict[str, str]:
+        return {size_name: f"{self.base_url}/{size_name}/{digest}" for size_name in self.sizes}
+
+    async def _write(self, path: Path, data: bytes) -> None:
+        # Write then rename, so a reader never sees a partial derivative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        async with aiofiles.open(temp_path, "wb") as out_file:
+            await out_file.write(data)
+        os.replace(temp_path, path)
+
+    async def _single_flight(self, key: str, render: Callable[[], Awaitable[None]]) -> bool:
+        """Run `render` unless a render of `key` is already in progress, then wait for that one.
+
+        Returns whether this call did the work.
+        """
+        pending = self._rendering.get(key)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return False
+
+        pending = self._rendering[key] = asyncio.get_running_loop().create_future()
+        try:
+            await render()
+            pending.set_result(None)
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()  # waiters re-raise it; don't log it as unretrieved
+            raise
+        finally:
+            del self._rendering[key]
+        return True
+
+    async def _render(self, upload: StagedUpload) -> None:
+        rendered = await image_pipeline.render(upload.path, self.sizes)
+        for size_name, data in rendered.items():
+            await self._write(self.path(size_name, upload.digest), data)
+        await self.collection.update_one(
+            {"_id": upload.digest},
+            {"$addToSet": {"sizes": {"$each": list(rendered)}}}
+        )
+
+    def _keep_original(self, upload: StagedUpload) -> None:
+        original = self.original_path(upload.digest)
+        if not original.exists():
+            # The staging area is under the same root, so this is a rename
+            original.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(upload.path, original)
+
+    async def save(self, upload: StagedUpload) -> str:
+        """Add a reference to a staged upload's image, rendering it only if it is new.
+
+        Returns the image's digest.
+        """
+        now = datetime.utcnow()
+        before = await self.collection.find_one_and_update(
+            {"_id": upload.digest},
+            {
+                "$inc": {"refs": 1},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"sizes": [], "bytes": upload.size, "created_at": now}
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is not None and set(self.sizes) <= set(before.get("sizes", [])):
+            self.reused += 1
+        else:
+            try:
+                if await self._single_flight(upload.digest, lambda: self._render(upload)):
+                    self.rendered += 1
+                else:
+                    self.reused += 1
+            except Exception:
+                await self.release(upload.digest)
+                raise
+
+        self._keep_original(upload)
+        return upload.digest
+
+    async def release(self, digest: str) -> None:
+        """Drop a reference to an image; unreferenced images are left for `collect_garbage`."""
+        await self.collection.update_one(
+            {"_id": digest},
+            {"$inc": {"refs": -1}, "$set": {"released_at": datetime.utcnow()}}
+        )
+
+    def _variant_source(self, digest: str) -> Path:
+        """The original upload, or the largest fixed size for images stored before originals were kept."""
+        candidates = [self.original_path(digest)] + [
+            self.path(size_name, digest)
+            for size_name, _ in sorted(self.sizes.items(), key=lambda entry: -entry[1][0] * entry[1][1])
+        ]
+        for path in candidates:
+            if path.exists():
+                return path
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Image {digest} not found")
+
+    async def variant(self, digest: str, width: Optional[int], height: Optional[int], fmt: str) -> Path:
+        """Path of an image fitted within `width` x `height` in `fmt`, rendered on first request."""
+        name = variant_name(digest, width, height, fmt)
+        path = self.variants.get(name)
+        if path is not None:
+            self.variant_hits += 1
+            self._record_delivery(name, fmt)
+            return path
+
+        if not self._variants_loaded:
+            # Account for variants cached before a restart
+            self._variants_loaded = True
+            await asyncio.to_thread(self.variants.load)
+
+        async def render() -> None:
+            source = self._variant_source(digest)
+            box = (width or settings.IMAGE_MAX_DIMENSION, height or settings.IMAGE_MAX_DIMENSION)
+            # The JPEG baseline comes from the cached JPEG variant when there
+            # is one; otherwise only a sample of renders pay a second encode
+            jpeg_size = self.variants.size(variant_name(digest, width, height, "jpeg")) or None
+            measure = jpeg_size is None and random.random() < settings.IMAGE_BASELINE_SAMPLE_RATE
+            data, measured = await image_pipeline.render_variant(source, box, fmt, measure)
+            jpeg_size = jpeg_size or measured
+            if jpeg_size is not None:
+                self.baselines.set(name, jpeg_size)
+            await asyncio.to_thread(self.variants.put, name, data)
+
+        self.variant_misses += 1
+        await self._single_flight(name, render)
+        self._record_delivery(name, fmt)
+        return self.variants.directory / name
+
+    def _record_delivery(self, name: str, fmt: str) -> None:
+        stats = self.deliveries.setdefault(fmt, {"requests": 0, "bytes": 0, "measured_bytes": 0, "jpeg_bytes": 0})
+        size = self.variants.size(name)
+        stats["requests"] += 1
+        stats["bytes"] += size
+        baseline = self.baselines.get(name)
+        if baseline is not None:
+            # Unsampled renders, and variants cached before a restart, have no baseline
+            stats["measured_bytes"] += size
+            stats["jpeg_bytes"] += baseline
+
+    def delivery_stats(self) -> Dict[str, Dict[str, float]]:
+        """Requests and bytes served per format, with the share saved against JPEG."""
+        return {
+            fmt: {
+                **stats,
+                "saved": round(1 - stats["measured_bytes"] / stats["jpeg_bytes"], 4) if stats["jpeg_bytes"] else 0.0
+            }
+            for fmt, stats in self.deliveries.items()
+        }
+
+    def _stale_files(self, stale: float) -> List[Path]:
+        """Stored files last modified before the `stale` timestamp."""
+        found = []
+        for directory in [self.base_path / size_name for size_name in self.sizes] + [self.base_path / ORIGINALS_DIR]:
+            if not directory.is_dir():
+                continue
+            for path in directory.iterdir():
+                try:
+                    if path.stat().st_mtime < stale:
+                        found.append(path)
+                except FileNotFoundError:
+                    pass
+        return found
+
+    def _legacy_images(self) -> Dict[str, List[str]]:
+        """Sizes stored for each image named by a legacy uuid."""
+        found: Dict[str, List[str]] = {}
+        for size_name in self.sizes:
+            directory = self.base_path / size_name
+            if not directory.is_dir():
+                continue
+            for path in directory.glob("*.jpg"):
+                if LEGACY_ID_RE.fullmatch(path.stem):
+                    found.setdefault(path.stem, []).append(size_name)
+        return found
+
+    async def adopt_legacy_images(self) -> int:
+        """Give images stored under a uuid before content addressing a record; returns how many were new.
+
+        Each was uploaded for one product, which still holds the uuid as its
+        image ID, so the record starts with one reference. Releasing it then
+        lets `collect_garbage` remove the files like any other image's.
+        Existing records are left alone, so this is safe to run repeatedly.
+        """
+        legacy = await asyncio.to_thread(self._legacy_images)
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"_id": image_id}, {"$setOnInsert": {
+                "refs": 1, "sizes": sizes, "legacy": True, "created_at": now, "updated_at": now
+            }}, upsert=True)
+            for image_id, sizes in legacy.items()
+        ]
+        adopted = 0
+        for start in range(0, len(operations), settings.IMAGE_GC_BATCH_SIZE):
+            result = await self.collection.bulk_write(
+                operations[start:start + settings.IMAGE_GC_BATCH_SIZE], ordered=False
+            )
+            adopted += result.upserted_count
+        if adopted:
+            logger.info(f"Adopted {adopted} legacy images")
+        return adopted
+
+    def _delete_files(self, digest: str) -> None:
+        for size_name in self.sizes:
+            self.path(size_name, digest).unlink(missing_ok=True)
+        self.original_path(digest).unlink(missing_ok=True)
+        shutil.rmtree(self.variants.directory / digest, ignore_errors=True)
+
+    async def collect_garbage(self, grace: int) -> Dict[str, int]:
+        """Delete images unreferenced for `grace` seconds, and stray files as old.
+
+        Stray files are derivatives and originals named by a digest without
+        an image record (e.g. left by a crash mid-render) and unfinished
+        temporary writes. Files with any other name, such as legacy uuid
+        images, are never treated as strays.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=grace)
+        images = 0
+        async for image in self.collection.find(
+            {"refs": {"$lte": 0}, "released_at": {"$lt": cutoff}}, {"_id": 1}
+        ):
+            # The record goes first: an upload of the same image from here on
+            # starts a fresh one and renders again
+            result = await self.collection.delete_one({"_id": image["_id"], "refs": {"$lte": 0}})
+            if result.deleted_count:
+                await asyncio.to_thread(self._delete_files, image["_id"])
+                images += 1
+
+        files = 0
+        candidates = [
+            path for path in await asyncio.to_thread(self._stale_files, time.time() - grace)
+            if path.name.startswith(".") or DIGEST_RE.fullmatch(path.stem)
+        ]
+        digests = sorted({path.stem for path in candidates if not path.name.startswith(".")})
+        known = set()
+        # In batches, so a large backlog of files stays well under the BSON document limit
+        for start in range(0, len(digests), settings.IMAGE_GC_BATCH_SIZE):
+            batch = digests[start:start + settings.IMAGE_GC_BATCH_SIZE]
+            known |= {
+                image["_id"]
+                async for image in self.collection.find({"_id": {"$in": batch}}, {"_id": 1})
+            }
+        for path in candidates:
+            if path.name.startswith(".") or path.stem not in known:
+                path.unlink(missing_ok=True)
+                files += 1
+
+        logger.info(f"Image garbage collection removed {images} images and {files} stray files")
+        return {"images": images, "files": files}
+
+
+# Create global instance
+image_store = ImageStore(Path(settings.UPLOAD_DIR), settings.IMAGE_SIZES, settings.IMAGE_VARIANT_CACHE_BYTES)
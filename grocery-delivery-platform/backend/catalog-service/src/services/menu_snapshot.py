@@ -0,0 +1,158 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import re
+from typing import Any, Dict, List, NamedTuple, Set
+
+import orjson
+from bson import ObjectId
+
+from cache import LRUCache
+from config import settings
+from db import catalog_db, COLLECTION_NAME, DB_NAME
+from pagination import sort_spec
+from projection import PROFILES
+from responses import encode_default
+from services.category_tree import category_trees
+from services.featured_shelf import featured_shelves
+from services.store_index import StoreIndexManager
+
+
+logger = logging.getLogger(__name__)
+
+# Item cards as the product grid renders them; the store is the snapshot's
+CARD_PROJECTION = {field: value for field, value in PROFILES["card"].items() if field != "store_id"}
+
+
+class MenuSnapshot(NamedTuple):
+    """A store's menu, serialized and compressed once for every request."""
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+
+class MenuSnapshots:
+    """Precompiled per-store menus: the storefront's first paint in one document.
+
+    A snapshot holds the active category tree, the featured shelf and the
+    first page of every category (the newest MENU_CATEGORY_ITEMS items of its
+    subtree, as the store listing returns them). Items are stored once as
+    cards keyed by ID and referenced from the shelf and category pages.
+
+    Each replica builds the snapshots it serves on first request and, after
+    an item or category change (its own or another replica's), rebuilds them
+    in a background task per store that waits MENU_SNAPSHOT_DELAY for the
+    rest of a burst of edits. Requests keep getting the previous snapshot
+    until the new one is ready. The ETag is a hash of the content, so it is
+    the same on every replica.
+    """
+
+    def __init__(self, max_stores: int, ttl: int):
+        self.local = LRUCache(max_stores, ttl)
+        self.builds = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._dirty: Set[str] = set()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Category page queries in flight on this replica, across all builds
+        self._queries = asyncio.Semaphore(settings.MENU_QUERY_CONCURRENCY)
+
+    async def category_items(self, store_id: str, paths: Dict[str, str]) -> Dict[str, List[Dict[str, Any]]]:
+        """The first page of cards of each category in `paths` (ID to materialized path).
+
+        One bounded query per category, an anchored prefix match on the
+        (store_id, category_path) index, so small or empty categories cost
+        no more than full ones. At most MENU_QUERY_CONCURRENCY run at once,
+        leaving the connection pool to the requests being served.
+        """
+        db = catalog_db.client[DB_NAME]
+        store_oid = ObjectId(store_id)
+
+        async def page(path: str) -> List[Dict[str, Any]]:
+            async with self._queries:
+                cursor = db[COLLECTION_NAME].find(
+                    {"store_id": store_oid, "category_path": {"$regex": f"^{re.escape(path)}"}},
+                    CARD_PROJECTION
+                ).sort(sort_spec("created_at", True)).limit(settings.MENU_CATEGORY_ITEMS)
+                return await cursor.to_list(length=settings.MENU_CATEGORY_ITEMS)
+
+        pages = await asyncio.gather(*(page(path) for path in paths.values()))
+        return dict(zip(paths, pages))
+
+    async def build(self, store_id: str) -> MenuSnapshot:
+        """Compile a store's menu from the category tree, featured shelf and catalog."""
+        self.builds += 1
+        tree = await category_trees.get_index(store_id)
+        nodes = tree.nodes()
+        featured = await featured_shelves.get_featured_items(store_id, settings.MENU_FEATURED_ITEMS, CARD_PROJECTION)
+        active = {tree.ids[slot]: tree.paths[slot] for slot in tree.slots.values() if tree.active[slot]}
+        pages = await self.category_items(store_id, active)
+
+        cards: Dict[str, Dict[str, Any]] = {}
+        for item in featured + [item for page in pages.values() for item in page]:
+            cards.setdefault(str(item["_id"]), item)
+        body = orjson.dumps({
+            "store_id": store_id,
+            "categories": nodes,
+            "featured": [str(item["_id"]) for item in featured],
+            "category_items": {
+                category_id: [str(item["_id"]) for item in page] for category_id, page in sorted(pages.items())
+            },
+            "items": cards,
+        }, default=encode_default)
+        return MenuSnapshot(
+            body=body,
+            gzipped=gzip.compress(body, settings.MENU_GZIP_LEVEL, mtime=0),
+            etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        )
+
+    async def get(self, store_id: str) -> MenuSnapshot:
+        """A store's snapshot, built on first use."""
+        StoreIndexManager.validate_store_id(store_id)
+        snapshot = self.local.get(store_id)
+        if snapshot is not None:
+            return snapshot
+
+        async with self._locks.setdefault(store_id, asyncio.Lock()):
+            snapshot = self.local.get(store_id)
+            if snapshot is None:
+                snapshot = await self.build(store_id)
+                self.local.set(store_id, snapshot)
+        return snapshot
+
+    async def on_change(self, change) -> None:
+        """Catalog and category change listener scheduling rebuilds of loaded snapshots."""
+        if change.op == "resync":
+            self.local.clear()
+            return
+        if change.op == "stock" or self.local.get(change.store_id or "") is None:
+            # Stock levels on cards catch up within the TTL; unloaded stores build on next use
+            return
+        self._dirty.add(change.store_id)
+        if change.store_id not in self._tasks:
+            self._tasks[change.store_id] = asyncio.create_task(self._run(change.store_id))
+
+    async def _run(self, store_id: str) -> None:
+        try:
+            # Let a burst of edits, and the indexes the snapshot reads, settle first
+            await asyncio.sleep(settings.MENU_SNAPSHOT_DELAY)
+            while store_id in self._dirty:
+                self._dirty.discard(store_id)
+                self.local.set(store_id, await self.build(store_id))
+        except Exception as e:
+            logger.error(f"Error rebuilding menu snapshot for store {store_id}: {str(e)}")
+            self._dirty.discard(store_id)
+            self.local.delete(store_id)
+        finally:
+            self._tasks.pop(store_id, None)
+
+    async def stop(self) -> None:
+        """Cancel pending rebuilds."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+
+# Create global instance
+menu_snapshots = MenuSnapshots(settings.MENU_SNAPSHOT_MAX_STORES, settings.MENU_SNAPSHOT_TTL)
@@ -0,0 +1,364 @@
+import re
+import math
+import operator
+import heapq
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from config import settings
+from db import catalog_db
+from models import PaginatedResponse
+from projection import project_item
+from services.store_index import StoreIndexManager
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Term frequency multiplier per indexed field
+FIELD_WEIGHTS = {"name": 3.0, "brand": 2.0, "tags": 2.0, "description": 1.0}
+
+# Filterable fields, stored column-wise per item
+FLAG_FIELDS = ("is_organic", "is_vegan", "is_gluten_free", "available", "featured")
+VALUE_FIELDS = ("category", "subcategory", "brand")
+
+PRICE_OPERATORS = {
+    "$gte": operator.ge,
+    "$lte": operator.le,
+    "$gt": operator.gt,
+    "$lt": operator.lt,
+}
+
+INDEX_PROJECTION = {field: 1 for field in (*FIELD_WEIGHTS, *FLAG_FIELDS, *VALUE_FIELDS, "price")}
+
+
+def stem(token: str) -> str:
+    """Fold common English plurals so "tomatoes" finds "tomato"."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("oes"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us")):
+        return token[:-1]
+    return token
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def words(text: str) -> List[str]:
+    """Folded alphanumeric words of a text, unstemmed."""
+    return TOKEN_RE.findall(fold(text))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents, split on non-alphanumerics and stem."""
+    return [stem(token) for token in words(text)]
+
+
+def as_values(value: Any) -> List[str]:
+    """Normalise a scalar-or-list field to a list of non-empty values."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [v for v in value if v is not None]
+    return [value]
+
+
+def field_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+class StoreSearchIndex:
+    """Inverted index with BM25 scoring over one store's items.
+
+    Items live in integer slots so scoring and filtering run as NumPy array
+    operations: postings are kept as dicts for cheap incremental updates and
+    frozen into (slots, tf) arrays the first time a term is queried after it
+    changed. Filter fields are stored column-wise so the list filters become a
+    boolean mask computed once per query.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, store_id: str, capacity: int = 1024):
+        self.store_id = store_id
+        self.slots: Dict[str, int] = {}
+        self.item_ids: List[Optional[str]] = []
+        self._free_slots: List[int] = []
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.doc_terms: Dict[int, Dict[str, float]] = {}
+        self.total_len = 0.0
+
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.doc_len = np.zeros(capacity, dtype=np.float32)
+        self.price = np.full(capacity, np.nan)
+        self.flags = {field: np.zeros(capacity, dtype=bool) for field in FLAG_FIELDS}
+        self.values: Dict[str, Dict[str, Set[int]]] = {field: {} for field in VALUE_FIELDS}
+
+        self._term_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._norm: Optional[np.ndarray] = None
+        self._sorted_terms: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @property
+    def terms(self) -> List[str]:
+        """Vocabulary in sorted order (for prefix lookups)."""
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        return self._sorted_terms
+
+    def document_frequency(self, term: str) -> int:
+        return len(self.postings.get(term, ()))
+
+    def finish_build(self) -> None:
+        """Prepare the vocabulary and length norms after the initial load."""
+        self.terms
+        self._length_norm()
+
+    def _grow(self) -> None:
+        capacity = len(self.alive) * 2
+        self.alive = np.resize(self.alive, capacity)
+        self.alive[len(self.item_ids):] = False
+        self.doc_len = np.resize(self.doc_len, capacity)
+        price = np.full(capacity, np.nan)
+        price[:len(self.price)] = self.price
+        self.price = price
+        for field, column in self.flags.items():
+            grown = np.zeros(capacity, dtype=bool)
+            grown[:len(column)] = column
+            self.flags[field] = grown
+
+    def _allocate_slot(self, item_id: str) -> int:
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.item_ids[slot] = item_id
+        else:
+            slot = len(self.item_ids)
+            if slot >= len(self.alive):
+                self._grow()
+            self.item_ids.append(item_id)
+        self.slots[item_id] = slot
+        return slot
+
+    def add(self, item: Dict[str, Any]) -> None:
+        """Index or re-index an item document."""
+        item_id = str(item["_id"])
+        self.remove(item_id)
+        slot = self._allocate_slot(item_id)
+
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(field_text(item.get(field))):
+                weights[token] = weights.get(token, 0.0) + weight
+
+        for term, tf in weights.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self._sorted_terms = None
+            postings[slot] = tf
+            self._term_arrays.pop(term, None)
+
+        length = sum(weights.values())
+        self.doc_terms[slot] = weights
+        self.doc_len[slot] = length
+        self.total_len += length
+        self.alive[slot] = True
+        price = item.get("price")
+        self.price[slot] = price if price is not None else np.nan
+        for field, column in self.flags.items():
+            column[slot] = bool(item.get(field))
+        for field, index in self.values.items():
+            for value in as_values(item.get(field)):
+                index.setdefault(value, set()).add(slot)
+        self._norm = None
+
+    def remove(self, item_id: str) -> None:
+        """Drop an item from the index if present."""
+        slot = self.slots.pop(item_id, None)
+        if slot is None:
+            return
+        for term in self.doc_terms.pop(slot):
+            postings = self.postings[term]
+            del postings[slot]
+            self._term_arrays.pop(term, None)
+            if not postings:
+                del self.postings[term]
+                self._sorted_terms = None
+        for field, index in self.values.items():
+            for value, members in list(index.items()):
+                if slot in members:
+                    members.discard(slot)
+                    if not members:
+                        del index[value]
+        self.total_len -= float(self.doc_len[slot])
+        self.alive[slot] = False
+        self.doc_len[slot] = 0
+        self.item_ids[slot] = None
+        self._free_slots.append(slot)
+        self._norm = None
+
+    def _term_array(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arrays = self._term_arrays.get(term)
+        if arrays is None:
+            postings = self.postings.get(term)
+            if not postings:
+                return None
+            arrays = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float32, count=len(postings)),
+            )
+            self._term_arrays[term] = arrays
+        return arrays
+
+    def _length_norm(self) -> np.ndarray:
+        """Per-slot BM25 length normalisation, recomputed after any change."""
+        if self._norm is None:
+            avg_len = self.total_len / max(len(self.slots), 1)
+            self._norm = (self.k1 * (1 - self.b + self.b * self.doc_len / max(avg_len, 1e-9))).astype(np.float32)
+        return self._norm
+
+    def filter_mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Boolean slot mask for the list filters (category, flags, price range...)."""
+        if not filters:
+            return None
+        mask = self.alive.copy()
+        for key, condition in filters.items():
+            if key in self.flags:
+                column = self.flags[key]
+                mask &= column if condition else ~column
+            elif key in self.values:
+                wanted = condition.get("$in", []) if isinstance(condition, dict) else [condition]
+                selected = np.zeros(len(mask), dtype=bool)
+                for value in wanted:
+                    members = self.values[key].get(value)
+                    if members:
+                        selected[np.fromiter(members, dtype=np.int64, count=len(members))] = True
+                mask &= selected
+            elif key == "price":
+                with np.errstate(invalid="ignore"):
+                    for op, operand in condition.items():
+                        mask &= PRICE_OPERATORS[op](self.price, operand)
+            else:
+                raise ValueError(f"Unsupported search filter: {key}")
+        return mask
+
+    def expand_prefix(self, prefix: str) -> List[str]:
+        """Most common indexed terms starting with `prefix`."""
+        terms = self.terms
+        start = bisect_left(terms, prefix)
+        end = bisect_left(terms, prefix + "\uffff", lo=start)
+        matches = terms[start:end]
+        if len(matches) > settings.SEARCH_PREFIX_EXPANSIONS:
+            matches = heapq.nlargest(
+                settings.SEARCH_PREFIX_EXPANSIONS, matches, key=self.document_frequency
+            )
+        return matches
+
+    def query_groups(self, query: str, alternatives: Optional[List[List[str]]] = None) -> List[List[str]]:
+        """Split a query into term groups; the last word also matches as a prefix.
+
+        `alternatives` gives, for each query word, the words to search in its
+        place (a spelling correction and synonyms).
+        """
+        raw = words(query)
+        groups = []
+        for position, token in enumerate(raw):
+            group = {stem(word) for word in alternatives[position]} if alternatives else {stem(token)}
+            is_last = position == len(raw) - 1 and not query[-1:].isspace()
+            if is_last and len(token) >= settings.SEARCH_MIN_PREFIX_LENGTH:
+                group.update(self.expand_prefix(token))
+            groups.append(sorted(group))
+        return groups
+
+    def search(self, query: str, filters: Optional[Dict[str, Any]] = None,
+               limit: int = 20, skip: int = 0,
+               groups: Optional[List[List[str]]] = None) -> Tuple[int, List[Tuple[str, float]]]:
+        """Rank items for a query. Returns the match count and the requested page."""
+        if not self.slots:
+            return 0, []
+        n_docs = len(self.slots)
+        norm = self._length_norm()
+        scores = np.zeros(len(self.alive), dtype=np.float32)
+
+        for group in groups if groups is not None else self.query_groups(query):
+            # Alternatives within a group (a word and its prefix completions)
+            # count once per item, using the best-scoring one.
+            best = np.zeros_like(scores) if len(group) > 1 else scores
+            for term in group:
+                arrays = self._term_array(term)
+                if arrays is None:
+                    continue
+                slots, tf = arrays
+                df = len(slots)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                contribution = idf * tf * (self.k1 + 1) / (tf + norm[slots])
+                if best is scores:
+                    scores[slots] += contribution
+                else:
+                    np.maximum.at(best, slots, contribution)
+            if best is not scores:
+                scores += best
+
+        mask = self.filter_mask(filters)
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores)
+        total = len(candidates)
+
+        wanted = min(skip + limit, total)
+        if not wanted:
+            return total, []
+        candidate_scores = scores[candidates]
+        if wanted < total:
+            top = np.argpartition(-candidate_scores, wanted - 1)[:wanted]
+        else:
+            top = np.arange(total)
+        top = top[np.argsort(-candidate_scores[top], kind="stable")][skip:]
+        return total, [(self.item_ids[candidates[i]], float(candidate_scores[i])) for i in top]
+
+
+class SearchIndexManager(StoreIndexManager[StoreSearchIndex]):
+    """Per-store BM25 indexes."""
+
+    index_class = StoreSearchIndex
+    projection = INDEX_PROJECTION
+    name = "search"
+
+    async def search_items(self, query_text: str, store_id: str,
+                           filters: Optional[Dict[str, Any]] = None,
+                           skip: int = 0, limit: int = 20,
+                           projection: Optional[Dict[str, Any]] = None,
+                           alternatives: Optional[List[List[str]]] = None) -> PaginatedResponse:
+        """Search one store's items; same response shape as the Mongo engine."""
+        self.validate_store_id(store_id)
+        index = await self.get_index(store_id)
+        total, ranked = index.search(query_text, filters, limit, skip, index.query_groups(query_text, alternatives))
+
+        found = await catalog_db.get_items_by_ids([item_id for item_id, _ in ranked])
+        items = []
+        for item_id, score in ranked:
+            item = found.get(item_id)
+            if item is not None:
+                item = project_item(item, projection)
+                item["score"] = round(score, 4)
+                items.append(item)
+
+        return PaginatedResponse(total=total, page=skip // limit + 1, limit=limit, items=items)
+
+
+# Create global instance
+search_indexes = SearchIndexManager(settings.SEARCH_INDEX_MAX_STORES)
@@ -0,0 +1,388 @@
+import asyncio
+import logging
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import DeleteOne, ReplaceOne
+
+from config import settings
+from db import catalog_db, COLLECTION_NAME, DB_NAME, SIMILAR_ITEMS_COLLECTION_NAME
+from projection import project_item
+from services.search_index import as_values, fold
+from services.store_index import StoreIndexManager
+
+
+logger = logging.getLogger(__name__)
+
+# Weight of each kind of feature in an item's vector
+FEATURE_WEIGHTS = {
+    "tag": 1.0,
+    "category": 1.5,
+    "subcategory": 1.5,
+    "node": 1.0,  # each category tree node on the item's path
+    "brand": 1.0,
+    "flag": 0.5,
+    "price": 1.0,  # neighbouring price bands count half
+}
+DIETARY_FLAGS = ("is_organic", "is_vegan", "is_gluten_free")
+
+FEATURE_PROJECTION = {
+    field: 1 for field in (
+        "tags", "category", "subcategory", "category_path", "brand", *DIETARY_FLAGS, "price", "sale_price", "available"
+    )
+}
+
+# Neighbour lists are written, and changed items read, in batches of this many
+SAVE_BATCH_SIZE = 1000
+
+
+def item_features(item: Dict[str, Any]) -> Dict[str, float]:
+    """Named features of an item and their weights."""
+    features: Dict[str, float] = {}
+    for tag in as_values(item.get("tags")):
+        features[f"tag:{fold(str(tag))}"] = FEATURE_WEIGHTS["tag"]
+    for category in as_values(item.get("category")):
+        features[f"category:{fold(str(category))}"] = FEATURE_WEIGHTS["category"]
+    if item.get("subcategory"):
+        features[f"subcategory:{fold(item['subcategory'])}"] = FEATURE_WEIGHTS["subcategory"]
+    for node in filter(None, (item.get("category_path") or "").split("/")):
+        features[f"node:{node}"] = FEATURE_WEIGHTS["node"]
+    if item.get("brand"):
+        features[f"brand:{fold(item['brand'])}"] = FEATURE_WEIGHTS["brand"]
+    for flag in DIETARY_FLAGS:
+        if item.get(flag):
+            features[f"flag:{flag}"] = FEATURE_WEIGHTS["flag"]
+
+    price = item.get("sale_price") or item.get("price")
+    if price is not None:
+        band = bisect_right(settings.FACET_PRICE_BOUNDARIES, price)
+        features[f"price:{band - 1}"] = features[f"price:{band + 1}"] = FEATURE_WEIGHTS["price"] / 2
+        features[f"price:{band}"] = FEATURE_WEIGHTS["price"]
+    return features
+
+
+def item_vector(item: Dict[str, Any], dim: int) -> np.ndarray:
+    """Unit-length feature vector of an item, features hashed into `dim` signed buckets.
+
+    Hashing keeps the width fixed however many tags and brands a store has;
+    the sign bit makes colliding features cancel out rather than add up.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for name, weight in item_features(item).items():
+        bucket = zlib.crc32(name.encode("utf-8"))
+        vector[bucket % dim] += -weight if bucket & 0x80000000 else weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class StoreSimilarityIndex:
+    """Feature vectors and top-K neighbour lists of one store's items.
+
+    Vectors are the rows of one matrix indexed by slot, so cosine
+    similarities of a batch of items against the whole store are a single
+    matrix product. Besides each slot's neighbours the index keeps who lists
+    whom and the lowest score on each full list; when an item changes, only
+    the items that listed it or that it now beats need a new list.
+    """
+
+    def __init__(self, store_id: str, capacity: int = 1024):
+        self.store_id = store_id
+        self.dim = settings.SIMILAR_FEATURE_DIM
+        self.k = settings.SIMILAR_ITEMS_K
+        self.slots: Dict[str, int] = {}
+        self.item_ids: List[Optional[str]] = []
+        self._free_slots: List[int] = []
+        self.vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.candidate = np.zeros(capacity, dtype=bool)  # may be recommended: available items
+        self.threshold = np.zeros(capacity, dtype=np.float32)  # score needed to enter the slot's list
+        self.neighbours: Dict[int, List[Tuple[int, float]]] = {}
+        self.listed_by: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def finish_build(self) -> None:
+        pass
+
+    def _grow(self) -> None:
+        capacity = len(self.alive) * 2
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:len(self.vectors)] = self.vectors
+        self.vectors = vectors
+        for name in ("alive", "candidate", "threshold"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def add(self, item: Dict[str, Any]) -> int:
+        """Insert or update an item's vector; returns its slot."""
+        item_id = str(item["_id"])
+        slot = self.slots.get(item_id)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+                self.item_ids[slot] = item_id
+            else:
+                slot = len(self.item_ids)
+                if slot >= len(self.alive):
+                    self._grow()
+                self.item_ids.append(item_id)
+            self.slots[item_id] = slot
+        self.vectors[slot] = item_vector(item, self.dim)
+        self.alive[slot] = True
+        self.candidate[slot] = bool(item.get("available", True))
+        return slot
+
+    def remove(self, item_id: str) -> Set[int]:
+        """Drop an item; returns the slots whose lists contained it."""
+        slot = self.slots.pop(item_id, None)
+        if slot is None:
+            return set()
+        self.set_neighbours(slot, [])
+        del self.neighbours[slot]
+        self.vectors[slot] = 0
+        self.alive[slot] = False
+        self.candidate[slot] = False
+        self.item_ids[slot] = None
+        self._free_slots.append(slot)
+        return self.listed_by.pop(slot, set())
+
+    def set_neighbours(self, slot: int, neighbours: List[Tuple[int, float]]) -> None:
+        for other, _ in self.neighbours.get(slot, ()):
+            listers = self.listed_by.get(other)
+            if listers is not None:
+                listers.discard(slot)
+        self.neighbours[slot] = neighbours
+        for other, _ in neighbours:
+            self.listed_by.setdefault(other, set()).add(slot)
+        # A list that is not full takes any positive score
+        self.threshold[slot] = neighbours[-1][1] if len(neighbours) >= self.k else 0.0
+
+    def top_k(self, rows: np.ndarray) -> List[List[Tuple[int, float]]]:
+        """Most similar recommendable items for each slot in `rows`, best first."""
+        n = len(self.item_ids)
+        scores = self.vectors[rows] @ self.vectors[:n].T
+        scores[:, ~self.candidate[:n]] = 0
+        scores[np.arange(len(rows)), rows] = 0
+        k = min(self.k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        lists = []
+        for row, columns in enumerate(top):
+            row_scores = scores[row, columns]
+            order = np.argsort(-row_scores, kind="stable")
+            lists.append([
+                (int(columns[i]), round(float(row_scores[i]), 4)) for i in order
+                if row_scores[i] >= settings.SIMILAR_MIN_SCORE
+            ])
+        return lists
+
+    def compute(self, slots: Iterable[int]) -> List[int]:
+        """Recompute the lists of `slots` in batches; returns the slots whose list changed."""
+        rows = np.fromiter(sorted({slot for slot in slots if self.alive[slot]}), dtype=np.int64)
+        changed = []
+        for start in range(0, len(rows), settings.SIMILAR_BATCH_SIZE):
+            batch = rows[start:start + settings.SIMILAR_BATCH_SIZE]
+            for slot, neighbours in zip(batch.tolist(), self.top_k(batch)):
+                if neighbours != self.neighbours.get(slot):
+                    self.set_neighbours(slot, neighbours)
+                    changed.append(slot)
+        return changed
+
+    def reached_by(self, slot: int) -> Set[int]:
+        """Slots whose lists the item in `slot` now scores high enough to enter."""
+        if not self.candidate[slot]:
+            return set()
+        n = len(self.item_ids)
+        scores = self.vectors[:n] @ self.vectors[slot]
+        reached = set(np.flatnonzero((scores > self.threshold[:n]) & self.alive[:n]).tolist())
+        reached.discard(slot)
+        return reached
+
+
+class SimilarItemsManager(StoreIndexManager[StoreSimilarityIndex]):
+    """Similar-item lists, stored per item and kept current as the catalog changes.
+
+    Lists live in the similar_items collection, so serving one is a single
+    lookup by item ID. The replica making a change updates the affected
+    lists in a background task per store, which coalesces bursts of changes
+    (an import's batches included); `rebuild_store` recomputes a whole store
+    and is left to the similar_items job.
+    """
+
+    index_class = StoreSimilarityIndex
+    projection = FEATURE_PROJECTION
+    name = "similarity"
+
+    def __init__(self, max_stores: int):
+        super().__init__(max_stores)
+        self._pending: Dict[str, Set[str]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def collection(self):
+        return catalog_db.client[DB_NAME][SIMILAR_ITEMS_COLLECTION_NAME]
+
+    async def similar_items(self, item_id: str, limit: int = 10,
+                            projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """The stored most similar available items to an item, each with its score."""
+        if not ObjectId.is_valid(item_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid item ID format: {item_id}"
+            )
+        record = await self.collection.find_one({"_id": ObjectId(item_id)})
+        if record is None:
+            # Raises 404 for unknown items; new ones have no list yet
+            await catalog_db.get_item_by_id(item_id)
+            return []
+
+        entries = record["similar"][:limit]
+        found = await catalog_db.get_items_by_ids([str(entry["item_id"]) for entry in entries])
+        items = []
+        for entry in entries:
+            item = found.get(str(entry["item_id"]))
+            if item is not None and item.get("available", True):
+                item = project_item(dict(item), projection)
+                item["score"] = entry["score"]
+                items.append(item)
+        return items
+
+    async def build_index(self, store_id: str) -> StoreSimilarityIndex:
+        """Load a store's vectors and stored lists, computing the lists that are missing."""
+        index = await super().build_index(store_id)
+        async for record in self.collection.find({"store_id": ObjectId(store_id)}):
+            slot = index.slots.get(str(record["_id"]))
+            if slot is not None:
+                index.set_neighbours(slot, [
+                    (index.slots[str(entry["item_id"])], entry["score"])
+                    for entry in record["similar"] if str(entry["item_id"]) in index.slots
+                ])
+        missing = [slot for slot in index.slots.values() if slot not in index.neighbours]
+        if missing:
+            await self._save(index, await asyncio.to_thread(index.compute, missing))
+        return index
+
+    async def _save(self, index: StoreSimilarityIndex, slots: List[int],
+                    removed: Iterable[str] = (), now: Optional[datetime] = None) -> None:
+        now = now or datetime.utcnow()
+        store_oid = ObjectId(index.store_id)
+        operations = [
+            ReplaceOne({"_id": ObjectId(index.item_ids[slot])}, {
+                "store_id": store_oid,
+                "similar": [
+                    {"item_id": ObjectId(index.item_ids[other]), "score": score}
+                    for other, score in index.neighbours[slot]
+                ],
+                "updated_at": now
+            }, upsert=True)
+            for slot in slots
+        ] + [DeleteOne({"_id": ObjectId(item_id)}) for item_id in removed]
+        for start in range(0, len(operations), SAVE_BATCH_SIZE):
+            await self.collection.bulk_write(operations[start:start + SAVE_BATCH_SIZE], ordered=False)
+
+    async def update_items(self, store_id: str, item_ids: Set[str]) -> int:
+        """Bring the lists affected by changes to `item_ids` up to date; returns how many changed."""
+        index = await self.get_index(store_id)
+        db = catalog_db.client[DB_NAME]
+        ordered = sorted(item_ids)
+        current = {}
+        for start in range(0, len(ordered), SAVE_BATCH_SIZE):
+            cursor = db[COLLECTION_NAME].find({
+                "_id": {"$in": [ObjectId(item_id) for item_id in ordered[start:start + SAVE_BATCH_SIZE]]},
+                "store_id": ObjectId(store_id)
+            }, self.projection)
+            current.update({str(item["_id"]): item async for item in cursor})
+
+        recompute: Set[int] = set()
+        removed = []
+        for item_id in item_ids:
+            slot = index.slots.get(item_id)
+            if slot is not None:
+                recompute |= index.listed_by.get(slot, set())
+            if item_id in current:
+                slot = index.add(current[item_id])
+                recompute.add(slot)
+                recompute |= index.reached_by(slot)
+            elif slot is not None:
+                recompute |= index.remove(item_id)
+                removed.append(item_id)
+
+        changed = await asyncio.to_thread(index.compute, recompute)
+        await self._save(index, changed, removed)
+        return len(changed)
+
+    async def rebuild_store(self, store_id: str) -> int:
+        """Recompute and store every list of a store from scratch; returns the number of items."""
+        self.validate_store_id(store_id)
+        started = datetime.utcnow()
+        index = await super().build_index(store_id)
+        await asyncio.to_thread(index.compute, list(index.slots.values()))
+        await self._save(index, list(index.slots.values()), now=started)
+        # Lists of items that are gone were not rewritten
+        await self.collection.delete_many({"store_id": ObjectId(store_id), "updated_at": {"$lt": started}})
+        self._indexes.pop(store_id, None)
+        logger.info(f"Rebuilt similar items for store {store_id}: {len(index)} items")
+        return len(index)
+
+    async def on_change(self, change) -> None:
+        """Catalog change listener queueing the lists to update.
+
+        Other replicas' changes are left to the replica that made them; the
+        store's vectors are reloaded from the stored lists on next use. Bulk
+        writes queue the items they list; one that lists none (a category
+        move) is left to the similar_items job.
+        """
+        if change.op == "resync":
+            self.hold(change, self.on_change)
+            self._indexes.clear()
+            return
+        if change.op == "stock" or not change.store_id:
+            return
+        if change.remote:
+            if not self.hold(change, self.on_change):
+                self._indexes.pop(change.store_id, None)
+            return
+        if change.op == "bulk":
+            if not change.item_ids:
+                return
+            self._pending.setdefault(change.store_id, set()).update(change.item_ids)
+        elif change.item is not None and change.previous is not None and (
+            item_features(change.item) == item_features(change.previous)
+            and change.item.get("available", True) == change.previous.get("available", True)
+        ):
+            return
+        else:
+            self._pending.setdefault(change.store_id, set()).add(change.item_id)
+        if change.store_id not in self._tasks:
+            self._tasks[change.store_id] = asyncio.create_task(self._run(change.store_id))
+
+    async def _run(self, store_id: str) -> None:
+        try:
+            # Let a burst of edits to the store arrive before recomputing
+            await asyncio.sleep(settings.SIMILAR_UPDATE_DELAY)
+            while self._pending.get(store_id):
+                await self.update_items(store_id, self._pending.pop(store_id))
+        except Exception as e:
+            # The similar_items job repairs whatever was missed
+            logger.error(f"Error updating similar items for store {store_id}: {str(e)}")
+            self._pending.pop(store_id, None)
+        finally:
+            self._tasks.pop(store_id, None)
+
+    async def stop(self) -> None:
+        """Cancel pending updates."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+
+# Create global instance
+similar_items = SimilarItemsManager(settings.SIMILAR_MAX_STORES)
@@ -0,0 +1,264 @@
+import re
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from config import settings
+from services.search_index import field_text, stem, words
+from services.store_index import StoreIndexManager
+
+
+# Words a misspelling may be corrected to; description words are only
+# recognised as correct, so a store's prose does not crowd out its products
+TARGET_FIELDS = ("name", "brand", "tags", "category", "subcategory")
+KNOWN_FIELDS = TARGET_FIELDS + ("description",)
+
+SPELLING_PROJECTION = {field: 1 for field in KNOWN_FIELDS}
+
+# Groups of interchangeable grocery words; a query word finds items that
+# use any word of its group. Extended with settings.SEARCH_SYNONYMS.
+SYNONYMS = [
+    ["cilantro", "coriander"],
+    ["soda", "pop"],
+    ["eggplant", "aubergine"],
+    ["zucchini", "courgette"],
+    ["arugula", "rocket"],
+    ["chickpea", "garbanzo"],
+    ["cookie", "biscuit"],
+    ["shrimp", "prawn"],
+    ["yogurt", "yoghurt"],
+    ["ketchup", "catsup"],
+    ["cornstarch", "cornflour"],
+    ["rutabaga", "swede"],
+    ["beet", "beetroot"],
+    ["romaine", "cos"],
+]
+
+
+def synonym_table(groups: List[List[str]]) -> Dict[str, List[str]]:
+    """Map the stem of each word to the words of its groups."""
+    table: Dict[str, List[str]] = {}
+    for group in groups:
+        group = [word for text in group for word in words(text)]
+        for word in group:
+            alternatives = table.setdefault(stem(word), [])
+            alternatives.extend(other for other in group if other not in alternatives)
+    return table
+
+
+SYNONYM_TABLE = synonym_table(SYNONYMS + settings.SEARCH_SYNONYMS)
+
+# Tokens of a $text search string: quoted phrases, then space-separated words
+TEXT_TOKEN_RE = re.compile(r'"[^"]*"?|[^\s"]+')
+
+
+def deletes(word: str, distance: int) -> Set[str]:
+    """The word and every string made by deleting up to `distance` of its characters."""
+    result = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        result |= frontier
+    return result
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent swaps count once), or limit + 1 when over `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_row = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous_row, row = previous_row, row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+    return row[-1]
+
+
+def max_distance(word: str) -> int:
+    """Edits allowed when correcting a word; short words get one."""
+    return 1 if len(word) <= 4 else settings.SPELL_MAX_EDIT_DISTANCE
+
+
+class QueryRewrite(NamedTuple):
+    """A search query after spelling correction and synonym expansion."""
+    terms: List[List[str]]  # per query word: the word as searched, then its synonyms
+    corrected: Optional[str]  # the query with misspellings replaced, when there were any
+
+    @property
+    def changed(self) -> bool:
+        return self.corrected is not None or any(len(alternatives) > 1 for alternatives in self.terms)
+
+    def text_query(self, query: str) -> str:
+        """`query` with the corrections and synonyms of its plain words appended, for $text.
+
+        $text matches any of the plain words, so the additions widen the
+        search. Quoted phrases and negated (`-word`) words keep their meaning
+        and are not expanded: a synonym of an excluded word must not be
+        looked for.
+        """
+        extra = []
+        position = 0
+        for token in TEXT_TOKEN_RE.findall(query):
+            token_words = words(token)
+            if not token.startswith(('"', "-")):
+                for word, alternatives in zip(token_words, self.terms[position:]):
+                    extra.extend(term for term in alternatives if term != word)
+            position += len(token_words)
+        extra = [term for term in dict.fromkeys(extra) if term not in words(query)]
+        return " ".join([query] + extra) if extra else query
+
+
+class StoreSpeller:
+    """Symmetric delete spelling corrector over one store's vocabulary.
+
+    Every target word is stored under each string reachable from its prefix
+    by up to SPELL_MAX_EDIT_DISTANCE deletions. A misspelling shares one of
+    those strings with the words it is close to, so correcting it takes a
+    few dozen dictionary lookups and edit distances against the handful of
+    candidates they return, with no scan of the vocabulary.
+    """
+
+    prefix_length = 7
+
+    def __init__(self, store_id: str):
+        self.store_id = store_id
+        self.known: Counter = Counter()  # word -> items using it in any field
+        self.known_stems: Counter = Counter()
+        self.targets: Counter = Counter()  # word -> items using it in a target field
+        self.deletes: Dict[str, List[str]] = {}
+        self.item_words: Dict[str, Set[str]] = {}
+        self.item_targets: Dict[str, Set[str]] = {}
+        self._sorted_stems: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.item_words)
+
+    def finish_build(self) -> None:
+        pass
+
+    def _prefix_deletes(self, word: str) -> Set[str]:
+        return deletes(word[:self.prefix_length], settings.SPELL_MAX_EDIT_DISTANCE)
+
+    def add(self, item: Dict[str, Any]) -> None:
+        item_id = str(item["_id"])
+        self.remove(item_id)
+        item_words = {
+            word for field in KNOWN_FIELDS for word in words(field_text(item.get(field)))
+            if not word.isdigit()
+        }
+        item_targets = {
+            word for field in TARGET_FIELDS for word in words(field_text(item.get(field)))
+            if len(word) >= settings.SPELL_MIN_WORD_LENGTH and word.isalpha()
+        }
+        self.item_words[item_id] = item_words
+        self.item_targets[item_id] = item_targets
+        for word in item_words:
+            self.known[word] += 1
+            word_stem = stem(word)
+            if not self.known_stems[word_stem]:
+                self._sorted_stems = None
+            self.known_stems[word_stem] += 1
+        for word in item_targets:
+            if not self.targets[word]:
+                for variant in self._prefix_deletes(word):
+                    self.deletes.setdefault(variant, []).append(word)
+            self.targets[word] += 1
+
+    def remove(self, item_id: str) -> None:
+        for word in self.item_words.pop(item_id, ()):
+            self.known[word] -= 1
+            if not self.known[word]:
+                del self.known[word]
+            word_stem = stem(word)
+            self.known_stems[word_stem] -= 1
+            if not self.known_stems[word_stem]:
+                del self.known_stems[word_stem]
+                self._sorted_stems = None
+        for word in self.item_targets.pop(item_id, ()):
+            self.targets[word] -= 1
+            if not self.targets[word]:
+                del self.targets[word]
+                for variant in self._prefix_deletes(word):
+                    candidates = self.deletes[variant]
+                    candidates.remove(word)
+                    if not candidates:
+                        del self.deletes[variant]
+
+    def is_known(self, word: str) -> bool:
+        return word in self.known or stem(word) in self.known_stems
+
+    def is_prefix(self, word: str) -> bool:
+        """Whether some known word's stem starts with `word`, as the bm25 engine completes the last word."""
+        if self._sorted_stems is None:
+            self._sorted_stems = sorted(self.known_stems)
+        position = bisect_left(self._sorted_stems, word)
+        return position < len(self._sorted_stems) and self._sorted_stems[position].startswith(word)
+
+    def correct(self, word: str) -> Optional[str]:
+        """The closest target word to an unknown word, preferring the most used; None if nothing is close."""
+        limit = max_distance(word)
+        best = None
+        best_key = None
+        seen = set()
+        for variant in deletes(word[:self.prefix_length], limit):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, limit)
+                if distance <= limit:
+                    key = (distance, -self.targets[candidate], candidate)
+                    if best_key is None or key < best_key:
+                        best, best_key = candidate, key
+        return best
+
+
+def expand_synonyms(word: str) -> List[str]:
+    """A word followed by its synonyms."""
+    return [word] + [other for other in SYNONYM_TABLE.get(stem(word), ()) if other != word]
+
+
+class SpellingManager(StoreIndexManager[StoreSpeller]):
+    """Per-store spelling correctors, applied with synonyms to search queries."""
+
+    index_class = StoreSpeller
+    projection = SPELLING_PROJECTION
+    name = "spelling"
+
+    async def rewrite(self, query: str, store_id: Optional[str] = None,
+                      complete_last: bool = False) -> QueryRewrite:
+        """Correct the query words a store does not know and add their synonyms.
+
+        Without a store only synonyms are added. With `complete_last` the last
+        word is left alone while it is the start of a known word, as the bm25
+        engine matches it as a prefix.
+        """
+        speller = None
+        if store_id:
+            self.validate_store_id(store_id)
+            speller = await self.get_index(store_id)
+
+        raw = words(query)
+        terms = []
+        corrected = False
+        for position, word in enumerate(raw):
+            if speller is not None and len(word) >= settings.SPELL_MIN_WORD_LENGTH and word.isalpha() \
+                    and not speller.is_known(word):
+                typing = complete_last and position == len(raw) - 1 and not query[-1:].isspace()
+                if not (typing and speller.is_prefix(word)):
+                    correction = speller.correct(word)
+                    if correction is not None:
+                        word = correction
+                        corrected = True
+            terms.append(expand_synonyms(word))
+        return QueryRewrite(terms, " ".join(alternatives[0] for alternatives in terms) if corrected else None)
+
+
+# Create global instance
+spellers = SpellingManager(settings.SPELL_MAX_STORES)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, Type, TypeVar
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+
+from db import catalog_db, DB_NAME, COLLECTION_NAME
+
+
+logger = logging.getLogger(__name__)
+
+Index = TypeVar("Index")
+
+
+class StoreIndexManager(Generic[Index]):
+    """Per-store in-memory indexes, built lazily and kept current from catalog changes.
+
+    Subclasses set `index_class` (constructed with the store ID, exposing
+    `add(item)`, `remove(item_id)`, `finish_build()` and `__len__`) and
+    `projection`, the item fields the index needs. Indexes over another
+    per-store collection also set `collection_name`. The least recently used
+    stores are dropped once more than `max_stores` are loaded.
+
+    Changes that reach a store while its index is being built are held and
+    replayed on the new index once it is stored, as the build may have read
+    the documents before they were written.
+    """
+
+    index_class: Type[Index]
+    projection: Dict[str, Any]
+    collection_name = COLLECTION_NAME
+    name = "store"
+
+    def __init__(self, max_stores: int):
+        self.max_stores = max_stores
+        self._indexes: "OrderedDict[str, Index]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._held: Dict[str, List[Tuple[Callable[[Any], Awaitable[None]], Any]]] = {}
+
+    @staticmethod
+    def validate_store_id(store_id: str) -> None:
+        if not ObjectId.is_valid(store_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid store ID format: {store_id}"
+            )
+
+    async def build_index(self, store_id: str) -> Index:
+        """Load every item of a store into a fresh index."""
+        db = catalog_db.client[DB_NAME]
+        index = self.index_class(store_id)
+        cursor = db[self.collection_name].find({"store_id": ObjectId(store_id)}, self.projection)
+        async for item in cursor.batch_size(1000):
+            index.add(item)
+        index.finish_build()
+        logger.info(f"Built {self.name} index for store {store_id} with {len(index)} items")
+        return index
+
+    async def get_index(self, store_id: str) -> Index:
+        """Return the store's index, building it on first use."""
+        index = self._indexes.get(store_id)
+        if index is not None:
+            self._indexes.move_to_end(store_id)
+            return index
+
+        lock = self._locks.setdefault(store_id, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(store_id)
+            if index is None:
+                self._held[store_id] = []
+                try:
+                    index = await self.build_index(store_id)
+                finally:
+                    held = self._held.pop(store_id)
+                self._indexes[store_id] = index
+                while len(self._indexes) > self.max_stores:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._locks.pop(evicted, None)
+                for listener, change in held:
+                    await listener(change)
+        return index
+
+    def hold(self, change, listener: Callable[[Any], Awaitable[None]]) -> bool:
+        """Hold a change for a store whose index is being built, to pass to `listener` once it is stored.
+
+        Returns whether the change was held. A resync is also held for every
+        store being built, but still returns False so loaded indexes handle it.
+        """
+        if change.op == "resync":
+            for held in self._held.values():
+                held.append((listener, change))
+            return False
+        held = self._held.get(change.store_id) if change.store_id else None
+        if held is None:
+            return False
+        held.append((listener, change))
+        return True
+
+    def loaded_index(self, store_id: Optional[str]) -> Optional[Index]:
+        """The store's index if it is in memory, without building it."""
+        return self._indexes.get(store_id) if store_id else None
+
+    async def on_change(self, change) -> None:
+        """Catalog change listener keeping loaded indexes current."""
+        if self.hold(change, self.on_change):
+            return
+        if change.op == "resync":
+            self._indexes.clear()
+            return
+        if change.op == "stock":
+            return
+
+        index = self.loaded_index(change.store_id)
+        if index is None:
+            return
+
+        if change.op == "bulk":
+            # Rebuilt on next use rather than replaying every row
+            self._indexes.pop(change.store_id, None)
+        elif change.op == "delete":
+            index.remove(change.item_id)
+        elif change.item is not None:
+            index.add(change.item)
+        else:
+            # Change from another replica: fetch the current document
+            db = catalog_db.client[DB_NAME]
+            item = await db[self.collection_name].find_one({"_id": ObjectId(change.item_id)}, self.projection)
+            if item is None:
+                index.remove(change.item_id)
+            else:
+                index.add(item)
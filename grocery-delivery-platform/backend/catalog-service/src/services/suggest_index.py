@@ -0,0 +1,205 @@
+import heapq
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from cache import LRUCache
+from config import settings
+from models import Suggestion, SuggestResponse
+from services.search_index import as_values, words
+from services.store_index import StoreIndexManager
+
+
+INDEX_PROJECTION = {"name": 1, "brand": 1, "category": 1, "subcategory": 1, "popularity": 1}
+
+# Prefixes ranked up front when an index is built; they have the most candidates
+WARM_PREFIX_LENGTH = 2
+
+
+class _Entry:
+    """One suggestion: an item name, brand or category, shared by the items carrying it."""
+
+    __slots__ = ("text", "kind", "terms", "members", "popularity", "score")
+
+    def __init__(self, text: str, kind: str):
+        self.text = text
+        self.kind = kind
+        self.terms = entry_terms(text)
+        self.members: Dict[str, float] = {}  # item ID -> popularity
+        self.popularity = 0.0
+        self.score = 0.0
+
+
+def entry_terms(text: str) -> List[str]:
+    """Keys a suggestion is found under: its normalised text from every word on.
+
+    "Organic Whole Milk" is stored as "organic whole milk", "whole milk" and
+    "milk", so typing the start of any word finds it.
+    """
+    tokens = words(text)
+    return [" ".join(tokens[i:]) for i in range(len(tokens))]
+
+
+def item_labels(item: Dict[str, Any]) -> Dict[str, str]:
+    """Suggestion keys an item contributes to, with their display text."""
+    labels: Dict[str, str] = {}
+    candidates = [("item", item.get("name")), ("brand", item.get("brand"))]
+    candidates += [("category", value) for value in as_values(item.get("category"))]
+    candidates += [("category", item.get("subcategory"))]
+    for kind, text in candidates:
+        if isinstance(text, str) and words(text):
+            labels.setdefault(f"{kind}:{' '.join(words(text))}", text)
+    return labels
+
+
+def prefixes(terms: Iterable[str]) -> Set[str]:
+    return {term[:end] for term in terms for end in range(1, len(term) + 1)}
+
+
+class StoreSuggestIndex:
+    """Sorted-array prefix index of one store's item names, brands and categories.
+
+    `keys` holds (term, entry key) pairs in sorted order, so the candidates
+    for a prefix are one contiguous slice found by binary search. The top
+    SUGGEST_MAX_RESULTS keys per prefix are cached and patched in place when
+    an entry's score changes; a cached list is only recomputed when an entry
+    in a full list loses score, since its replacement could be anything.
+
+    Items are appended unsorted while the index is built; `finish_build`
+    sorts the keys once.
+    """
+
+    def __init__(self, store_id: str):
+        self.store_id = store_id
+        self.entries: Dict[str, _Entry] = {}
+        self.keys: List[Tuple[str, str]] = []
+        self._memberships: Dict[str, Set[str]] = {}  # item ID -> entry keys
+        self._results = LRUCache(settings.SUGGEST_CACHE_MAX_ENTRIES, settings.SUGGEST_CACHE_TTL)
+        self._building = True
+
+    def __len__(self) -> int:
+        return len(self._memberships)
+
+    def _rank(self, key: str) -> Tuple[float, int, str]:
+        entry = self.entries[key]
+        return -entry.score, len(entry.text), entry.text
+
+    def finish_build(self) -> None:
+        """Sort the keys collected during the build and rank the short prefixes."""
+        self.keys.sort()
+        self._building = False
+        for prefix in sorted({term[:WARM_PREFIX_LENGTH] for term, _ in self.keys} |
+                             {term[:1] for term, _ in self.keys}):
+            self._ranked(prefix)
+
+    def add(self, item: Dict[str, Any]) -> None:
+        """Index or re-index an item document."""
+        item_id = str(item["_id"])
+        popularity = float(item.get("popularity") or 0)
+        labels = item_labels(item)
+        previous = self._memberships.get(item_id, set())
+
+        for key in previous - labels.keys():
+            self._leave(key, item_id)
+        for key, text in labels.items():
+            self._join(key, text, item_id, popularity)
+        self._memberships[item_id] = set(labels)
+
+    def remove(self, item_id: str) -> None:
+        """Drop an item from every suggestion it contributes to."""
+        for key in self._memberships.pop(item_id, ()):
+            self._leave(key, item_id)
+
+    def _join(self, key: str, text: str, item_id: str, popularity: float) -> None:
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Entry(text, key.split(":", 1)[0])
+            for term in entry.terms:
+                if self._building:
+                    self.keys.append((term, key))
+                else:
+                    insort(self.keys, (term, key))
+        elif entry.members.get(item_id) == popularity:
+            return
+
+        entry.popularity += popularity - entry.members.get(item_id, 0.0)
+        entry.members[item_id] = popularity
+        old_score, entry.score = entry.score, len(entry.members) + entry.popularity
+        self._rescored(key, old_score)
+
+    def _leave(self, key: str, item_id: str) -> None:
+        entry = self.entries[key]
+        entry.popularity -= entry.members.pop(item_id)
+        old_score, entry.score = entry.score, len(entry.members) + entry.popularity
+        self._rescored(key, old_score)
+        if not entry.members:
+            for term in entry.terms:
+                del self.keys[bisect_left(self.keys, (term, key))]
+            del self.entries[key]
+
+    def _rescored(self, key: str, old_score: float) -> None:
+        """Patch the cached rankings of every prefix the entry is found under."""
+        if self._building:
+            return
+        entry = self.entries[key]
+        dropped = not entry.members
+        for prefix in prefixes(entry.terms):
+            ranked = self._results.get(prefix)
+            if ranked is None:
+                continue
+            full = len(ranked) >= settings.SUGGEST_MAX_RESULTS
+            if key in ranked:
+                if full and (dropped or entry.score < old_score):
+                    self._results.delete(prefix)
+                elif dropped:
+                    ranked.remove(key)
+                else:
+                    ranked.sort(key=self._rank)
+            elif not dropped and (not full or self._rank(key) < self._rank(ranked[-1])):
+                if full:
+                    ranked.pop()
+                ranked.append(key)
+                ranked.sort(key=self._rank)
+
+    def _ranked(self, prefix: str) -> List[str]:
+        ranked = self._results.get(prefix)
+        if ranked is None:
+            start = bisect_left(self.keys, (prefix,))
+            end = bisect_left(self.keys, (prefix + "\uffff",), lo=start)
+            candidates = {key for _, key in self.keys[start:end]}
+            ranked = heapq.nsmallest(settings.SUGGEST_MAX_RESULTS, candidates, key=self._rank)
+            self._results.set(prefix, ranked)
+        return ranked
+
+    def suggest(self, query: str, limit: int) -> List[Suggestion]:
+        """Best suggestions starting with `query` (at any word of the suggestion)."""
+        prefix = " ".join(words(query))
+        if not prefix:
+            return []
+
+        suggestions = []
+        for key in self._ranked(prefix)[:limit]:
+            entry = self.entries[key]
+            item_id = None
+            if entry.kind == "item":
+                # Several items may share a name; point at the most popular one
+                item_id = max(entry.members, key=entry.members.get)
+            suggestions.append(Suggestion(text=entry.text, type=entry.kind, item_id=item_id, score=entry.score))
+        return suggestions
+
+
+class SuggestIndexManager(StoreIndexManager[StoreSuggestIndex]):
+    """Per-store typeahead indexes."""
+
+    index_class = StoreSuggestIndex
+    projection = INDEX_PROJECTION
+    name = "suggest"
+
+    async def suggest(self, query: str, store_id: str, limit: int) -> SuggestResponse:
+        """Typeahead suggestions for a store, ranked by popularity."""
+        self.validate_store_id(store_id)
+        index = await self.get_index(store_id)
+        return SuggestResponse(query=query, suggestions=index.suggest(query, limit))
+
+
+# Create global instance
+suggest_indexes = SuggestIndexManager(settings.SEARCH_INDEX_MAX_STORES)
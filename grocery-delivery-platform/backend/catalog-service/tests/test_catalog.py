@@ -1,8 +1,12 @@
+import base64
+import io
 import pytest
 import requests
 import json
 from faker import Faker
+from PIL import Image
 import os
+import time
 
 # Setup test configuration
 BASE_URL = os.getenv("TEST_BASE_URL", "http://localhost:8000")
@@ -28,6 +32,14 @@ def store_id():
     return "6058f12b45783f2b3fc14d23"
 
 
+@pytest.fixture
+def image_file():
+    """A small PNG to upload as a product photo."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), (200, 120, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
 @pytest.fixture
 def catalog_item_data(store_id):
     """Generate fake catalog item data for testing."""
@@ -56,6 +68,7 @@ class TestCatalogService:
     """Test cases for catalog API endpoints."""
     
     item_id = None  # Will store created item ID for use in other tests
+    image_id = None  # Digest of the uploaded photo
     
     def test_health_endpoint(self):
         """Test the health endpoint."""
@@ -91,6 +104,39 @@ class TestCatalogService:
         data = response.json()
         assert data["_id"] == TestCatalogService.item_id
     
+    def test_get_item_is_cached(self):
+        """Test repeated item reads are served by the item cache."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        for _ in range(2):
+            response = requests.get(
+                f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}"
+            )
+            assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/cache/stats")
+        assert response.status_code == 200
+        stats = response.json()["items"]
+        assert stats["hits"] + stats["redis_hits"] >= 1
+    
+    def test_batch_get_items(self):
+        """Test fetching several items in one call."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        ids = [TestCatalogService.item_id, "not-an-id", "6058f12b45783f2b3fc14d99"]
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/items:batchGet",
+            json={"ids": ids}
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["id"] for r in results] == ids
+        assert results[0]["found"] and results[0]["item"]["_id"] == TestCatalogService.item_id
+        assert results[1]["error"] == "invalid_id"
+        assert results[2]["error"] == "not_found"
+    
     def test_update_item(self, headers):
         """Test updating an item."""
         if not TestCatalogService.item_id:
@@ -124,6 +170,34 @@ class TestCatalogService:
         assert "total" in data
         assert "items" in data
         assert isinstance(data["items"], list)
+        # Counted only on request
+        assert data["total"] is None
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items", params={"include_total": True})
+        assert response.status_code == 200
+        assert isinstance(response.json()["total"], int)
+    
+    def test_list_items_projection(self):
+        """Test trimming list responses with a profile or a field list."""
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/items",
+            params={"profile": "card", "limit": 5}
+        )
+        assert response.status_code == 200
+        for item in response.json()["items"]:
+            assert "description" not in item and "nutrition" not in item
+            assert len(item.get("image_urls", [])) <= 1
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/items",
+            params={"fields": "name,price", "limit": 5}
+        )
+        assert response.status_code == 200
+        for item in response.json()["items"]:
+            assert set(item) <= {"_id", "name", "price", "created_at"}
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items", params={"fields": "not_a_field"})
+        assert response.status_code == 400
     
     def test_search_items(self):
         """Test searching items."""
@@ -149,7 +223,58 @@ class TestCatalogService:
         assert "items" in data
         assert isinstance(data["items"], list)
         assert len(data["items"]) > 0
-    
+
+    def test_search_items_bm25(self, store_id):
+        """Test ranked search with the in-process BM25 engine."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}"
+        )
+        item_data = response.json()
+        # A partial last word matches as a prefix
+        search_term = item_data["name"].split()[0][:3]
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/search",
+            params={"q": search_term, "store_id": store_id, "engine": "bm25"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert TestCatalogService.item_id in [item["_id"] for item in data["items"]]
+        scores = [item["score"] for item in data["items"]]
+        assert scores == sorted(scores, reverse=True)
+
+    def test_suggest_items(self, store_id):
+        """Test typeahead suggestions for a partly typed word."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}"
+        )
+        item_data = response.json()
+        # Typing the start of the last word of the name finds it
+        last_word = item_data["name"].split()[-1]
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/search/suggest",
+            params={"q": last_word[:2], "store_id": store_id, "limit": 20}
+        )
+        assert response.status_code == 200
+        suggestions = response.json()["suggestions"]
+        assert len(suggestions) <= 20
+        scores = [s["score"] for s in suggestions]
+        assert scores == sorted(scores, reverse=True)
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/search/suggest",
+            params={"q": item_data["name"], "store_id": store_id}
+        )
+        assert response.status_code == 200
+        assert item_data["name"] in [s["text"] for s in response.json()["suggestions"]]
+
     def test_get_store_items(self, store_id):
         """Test getting items for a specific store."""
         response = requests.get(
@@ -164,7 +289,216 @@ class TestCatalogService:
         # Check all items belong to the specified store
         for item in data["items"]:
             assert item["store_id"] == store_id
+
+    def test_facet_store_items(self, store_id):
+        """Test facet counts and price histogram come back with the first page."""
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:facets",
+            params={"limit": 5}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["items"]) <= 5
+        assert set(data["facets"]) == {"category", "subcategory", "is_organic", "is_vegan", "is_gluten_free"}
+        assert sum(bucket["count"] for bucket in data["price_histogram"]) == data["total"]
+        assert sum(facet["count"] for facet in data["facets"]["is_organic"]) == data["total"]
+
+        # A facet's own filter does not narrow its counts
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:facets",
+            params={"limit": 5, "is_organic": True}
+        )
+        assert response.status_code == 200
+        filtered = response.json()
+        assert filtered["facets"]["is_organic"] == data["facets"]["is_organic"]
+        assert all(item["is_organic"] for item in filtered["items"])
+
+    def test_featured_items_shelf_order(self, store_id):
+        """Test that featured items come ranked, available and within the limit."""
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/featured",
+            params={"store_id": store_id, "limit": 5}
+        )
+        assert response.status_code == 200
+        items = response.json()
+        assert len(items) <= 5
+        for item in items:
+            assert item["featured"] and item["available"]
+
+        # Items with an explicit rank lead the shelf
+        ranks = [item.get("featured_rank") for item in items]
+        ranked = [rank for rank in ranks if rank is not None]
+        assert ranks[:len(ranked)] == sorted(ranked)
+
+    def test_get_store_items_cursor_pagination(self, store_id):
+        """Test walking store items with keyset cursors."""
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items?limit=1"
+        )
+        assert response.status_code == 200
+        first_page = response.json()
+        if not first_page["next_cursor"]:
+            pytest.skip("Not enough items in the store to page through")
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items",
+            params={"limit": 1, "after": first_page["next_cursor"]}
+        )
+        assert response.status_code == 200
+        second_page = response.json()
+        assert second_page["total"] is None
+        assert second_page["items"][0]["_id"] != first_page["items"][0]["_id"]
+
+        # A cursor issued for another sort order is rejected
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items",
+            params={"limit": 1, "after": first_page["next_cursor"], "sort_by": "price"}
+        )
+        assert response.status_code == 400
+
+    def test_import_store_items(self, store_id):
+        """Test bulk importing items from an NDJSON feed."""
+        sku = f"TEST-{fake.uuid4()}"
+        rows = [
+            {"sku": sku, "name": fake.word(), "description": fake.sentence(), "price": 2.5, "unit": "each"},
+            {"sku": f"{sku}-bad", "name": fake.word(), "description": fake.sentence(), "price": -1, "unit": "each"},
+        ]
+        feed = "\n".join(json.dumps(row) for row in rows)
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:import",
+            headers={"Authorization": f"Bearer {TEST_TOKEN}"},
+            files={"file": ("feed.ndjson", feed, "application/x-ndjson")}
+        )
+        assert response.status_code == 200
+        report = response.json()
+        assert report["rows"] == 2
+        assert report["inserted"] == 1
+        assert report["failed"] == 1
+        assert report["errors"][0]["row"] == 2
+
+        # Importing the same SKU again updates instead of duplicating
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:import",
+            headers={"Authorization": f"Bearer {TEST_TOKEN}"},
+            files={"file": ("feed.ndjson", json.dumps(rows[0]), "application/x-ndjson")}
+        )
+        assert response.status_code == 200
+        assert response.json()["updated"] == 1
+
+    def test_import_partial_row_keeps_other_fields(self, headers, store_id):
+        """Test re-importing a row only overwrites the fields it supplies."""
+        sku = f"TEST-{fake.uuid4()}"
+        row = {
+            "sku": sku, "name": fake.word(), "description": fake.sentence(), "price": 2.5, "unit": "each",
+            "stock_quantity": 40, "featured": True, "tags": ["keep"], "image_urls": ["https://example.com/a.jpg"]
+        }
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:import",
+            headers=headers,
+            files={"file": ("feed.ndjson", json.dumps(row), "application/x-ndjson")}
+        )
+        assert response.status_code == 200
+        assert response.json()["inserted"] == 1
+
+        # A price update feed carries only the identifying and required columns
+        feed = f"sku,name,description,price,unit\n{sku},{row['name']},{row['description']},3.75,each\n"
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:import",
+            headers=headers,
+            files={"file": ("prices.csv", feed, "text/csv")}
+        )
+        assert response.status_code == 200
+        assert response.json()["updated"] == 1
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:export")
+        assert response.status_code == 200
+        item = next(item for item in map(json.loads, response.text.splitlines()) if item.get("sku") == sku)
+        assert item["price"] == 3.75
+        assert item["stock_quantity"] == 40
+        assert item["featured"] is True
+        assert item["tags"] == ["keep"]
+        assert item["image_urls"] == ["https://example.com/a.jpg"]
+        requests.delete(f"{BASE_URL}{API_PREFIX}/items/{item['_id']}", headers=headers)
+    
+    def test_index_advice(self, headers, store_id):
+        """Test the list query shapes served so far are explained."""
+        requests.get(f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items")
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/indexes/advice", headers=headers)
+        assert response.status_code == 200
+        advice = response.json()
+        store_shapes = [a for a in advice if a["shape"] == {"store_id": "eq"}]
+        assert store_shapes
+        # The default store listing is read in index order
+        assert not store_shapes[0]["collection_scan"]
+        assert not store_shapes[0]["in_memory_sort"]
     
+    def test_get_image_variant(self):
+        """Test on-demand image derivatives reject bad IDs and sizes."""
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/images/not-a-digest")
+        assert response.status_code == 400
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/images/{'0' * 64}", params={"w": 200})
+        assert response.status_code == 404
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/images/{'0' * 64}", params={"w": 0})
+        assert response.status_code == 422
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/images/{'0' * 64}", params={"fmt": "gif"})
+        assert response.status_code == 422
+
+    def test_get_image_variant_caching(self, image_file):
+        """Test an uploaded image is served scaled, with an ETag that revalidates."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.post(
+            f"{BASE_URL}/images/upload/{TestCatalogService.item_id}",
+            headers={"Authorization": f"Bearer {TEST_TOKEN}"},
+            files={"file": ("photo.png", image_file, "image/png")}
+        )
+        assert response.status_code == 200
+        image_id = response.json()["small"].rsplit("/", 1)[-1]
+        TestCatalogService.image_id = image_id
+
+        url = f"{BASE_URL}{API_PREFIX}/images/{image_id}"
+        response = requests.get(url, params={"w": 160, "fmt": "jpeg"})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/jpeg"
+        assert Image.open(io.BytesIO(response.content)).size == (160, 120)
+        etag = response.headers["ETag"]
+        cache_control = response.headers["Cache-Control"]
+        assert "public" in cache_control and "immutable" in cache_control and "max-age=" in cache_control
+
+        response = requests.get(url, params={"w": 160, "fmt": "jpeg"}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert not response.content
+
+        # Another size is another representation
+        response = requests.get(url, params={"w": 80, "fmt": "jpeg"}, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_get_image_variant_format_negotiation(self):
+        """Test the format follows the Accept header, with JPEG for clients that list no format."""
+        if not TestCatalogService.image_id:
+            pytest.skip("Image ID not available - image upload test might have failed")
+
+        url = f"{BASE_URL}{API_PREFIX}/images/{TestCatalogService.image_id}"
+        response = requests.get(url, params={"w": 160}, headers={"Accept": "image/webp,*/*;q=0.8"})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/webp"
+        assert response.headers["Vary"] == "Accept"
+        webp_etag = response.headers["ETag"]
+
+        response = requests.get(url, params={"w": 160}, headers={"Accept": "image/*"})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/jpeg"
+        assert response.headers["Vary"] == "Accept"
+        assert response.headers["ETag"] != webp_etag
+
     def test_update_stock(self, headers):
         """Test updating item stock."""
         if not TestCatalogService.item_id:
@@ -190,6 +524,385 @@ class TestCatalogService:
         # Verify stock was increased
         assert current_data["stock_quantity"] == data["stock_quantity"]
     
+    def test_update_stock_rejects_oversell(self, headers):
+        """Test a decrement larger than the stock on hand is refused."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}")
+        stock = response.json()["stock_quantity"]
+
+        response = requests.put(
+            f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}/stock?quantity_change={-(stock + 1)}",
+            headers=headers
+        )
+        assert response.status_code == 409
+
+    def test_reserve_stock(self, headers):
+        """Test reserving stock for a whole order at once."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.put(
+            f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}/stock",
+            headers=headers,
+            params={"quantity_change": 2}
+        )
+        stock = response.json()["stock_quantity"]
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stock:reserve",
+            headers=headers,
+            json={"lines": [{"item_id": TestCatalogService.item_id, "quantity": 1}]}
+        )
+        assert response.status_code == 200
+        assert response.json()["reference"]
+
+        # A line that cannot be filled rolls back the whole reservation
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stock:reserve",
+            headers=headers,
+            json={"lines": [
+                {"item_id": TestCatalogService.item_id, "quantity": 1},
+                {"item_id": "6058f12b45783f2b3fc14d99", "quantity": 1}
+            ]}
+        )
+        assert response.status_code == 409
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}")
+        assert response.json()["stock_quantity"] == stock - 1
+
+        # A failed retry under the same reference leaves the earlier reservation alone
+        reference = f"order-{fake.uuid4()}"
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stock:reserve",
+            headers=headers,
+            json={"reference": reference, "lines": [{"item_id": TestCatalogService.item_id, "quantity": 1}]}
+        )
+        assert response.status_code == 200
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stock:reserve",
+            headers=headers,
+            json={"reference": reference, "lines": [
+                {"item_id": TestCatalogService.item_id, "quantity": 1},
+                {"item_id": "6058f12b45783f2b3fc14d99", "quantity": 1}
+            ]}
+        )
+        assert response.status_code == 409
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}")
+        assert response.json()["stock_quantity"] == stock - 2
+
+    def test_failed_reservation_in_item_changes(self, headers, store_id):
+        """Test stock put back by a failed reservation reaches delta sync."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes")
+        while response.json()["has_more"]:
+            response = requests.get(
+                f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+                params={"since": response.json()["next_token"]}
+            )
+        token = response.json()["next_token"]
+        stock = requests.get(f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}").json()["stock_quantity"]
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/stock:reserve",
+            headers=headers,
+            json={"lines": [
+                {"item_id": TestCatalogService.item_id, "quantity": 1},
+                {"item_id": "6058f12b45783f2b3fc14d99", "quantity": 1}
+            ]}
+        )
+        assert response.status_code == 409
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+            params={"since": token}
+        )
+        assert response.status_code == 200
+        changed = {item["_id"]: item for item in response.json()["items"]}
+        assert TestCatalogService.item_id in changed
+        assert changed[TestCatalogService.item_id]["stock_quantity"] == stock
+    
+    def test_category_tree(self, headers, store_id):
+        """Test nesting categories and listing a category's items with its subcategories."""
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/categories",
+            headers=headers,
+            json={"store_id": store_id, "name": "Produce"}
+        )
+        assert response.status_code == 201
+        parent_id = response.json()["_id"]
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/categories",
+            headers=headers,
+            json={"store_id": store_id, "name": "Fruit", "parent_id": parent_id}
+        )
+        assert response.status_code == 201
+        child_id = response.json()["_id"]
+        assert response.json()["depth"] == 1
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/stores/{store_id}/categories/{child_id}/breadcrumb")
+        assert response.status_code == 200
+        assert [entry["name"] for entry in response.json()] == ["Produce", "Fruit"]
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/items",
+            headers=headers,
+            json={
+                "store_id": store_id,
+                "name": "Banana",
+                "description": "Ripe bananas",
+                "price": 0.5,
+                "unit": "each",
+                "category_id": child_id
+            }
+        )
+        assert response.status_code == 201
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items",
+            params={"category_id": parent_id}
+        )
+        assert response.status_code == 200
+        assert "Banana" in [item["name"] for item in response.json()["items"]]
+
+        # A category with subcategories cannot be deleted
+        response = requests.delete(f"{BASE_URL}{API_PREFIX}/categories/{parent_id}", headers=headers)
+        assert response.status_code == 409
+
+    def test_category_product_counts(self, headers, store_id):
+        """Test product counts rolling up to parent categories as items change."""
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/categories",
+            headers=headers,
+            json={"store_id": store_id, "name": "Bakery"}
+        )
+        parent_id = response.json()["_id"]
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/categories",
+            headers=headers,
+            json={"store_id": store_id, "name": "Bread", "parent_id": parent_id}
+        )
+        child_id = response.json()["_id"]
+
+        def counts():
+            response = requests.get(
+                f"{BASE_URL}{API_PREFIX}/stores/{store_id}/categories",
+                params={"root_id": parent_id}
+            )
+            assert response.status_code == 200
+            [root] = response.json()
+            return root["product_count"], root["children"][0]["product_count"]
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/items",
+            headers=headers,
+            json={
+                "store_id": store_id,
+                "name": "Sourdough Loaf",
+                "description": "Naturally leavened",
+                "price": 5.5,
+                "unit": "each",
+                "category_id": child_id
+            }
+        )
+        assert response.status_code == 201
+        assert counts() == (1, 1)
+
+        # Unavailable items are not counted
+        requests.put(
+            f"{BASE_URL}{API_PREFIX}/items/{response.json()['_id']}",
+            headers=headers,
+            json={"available": False}
+        )
+        assert counts() == (0, 0)
+
+    def test_export_store_items(self, store_id):
+        """Test streaming a store's catalog and resuming the export."""
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:export")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("application/x-ndjson")
+        items = [json.loads(line) for line in response.text.splitlines()]
+        assert items
+        assert [item["_id"] for item in items] == sorted(item["_id"] for item in items)
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:export",
+            params={"after": items[0]["_id"]}
+        )
+        assert [json.loads(line)["_id"] for line in response.text.splitlines()] == [item["_id"] for item in items[1:]]
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items:export",
+            params={"format": "csv"},
+            headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.text.splitlines()[0].startswith("_id,")
+
+    def test_item_changes_since(self, headers, store_id):
+        """Test delta sync returning updated and deleted items after a token."""
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes")
+        assert response.status_code == 200
+        while response.json()["has_more"]:
+            response = requests.get(
+                f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+                params={"since": response.json()["next_token"]}
+            )
+        token = response.json()["next_token"]
+
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/items",
+            headers=headers,
+            json={"store_id": store_id, "name": "Sync Probe", "description": "Deleted again", "price": 1.0, "unit": "each"}
+        )
+        probe_id = response.json()["_id"]
+        requests.delete(f"{BASE_URL}{API_PREFIX}/items/{probe_id}", headers=headers)
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+            params={"since": token}
+        )
+        assert response.status_code == 200
+        assert probe_id in response.json()["deleted"]
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+            params={"since": "not-a-token"}
+        )
+        assert response.status_code == 400
+
+    def test_item_changes_pages_past_retention(self, store_id):
+        """Test a sync pages through items last changed before the retention window."""
+        def sync_token(last_id=None):
+            # Far older than CHANGES_RETENTION; the service's tokens are base64 extended JSON
+            payload = {"t": {"$date": "2000-01-01T00:00:00Z"}, "id": {"$oid": last_id} if last_id else None}
+            return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii").rstrip("=")
+
+        # Where a first download is after it has sent an item from back then
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+            params={"since": sync_token("0" * 24), "limit": 2}
+        )
+        assert response.status_code == 200
+        seen = [item["_id"] for item in response.json()["items"]]
+        while response.json()["has_more"]:
+            response = requests.get(
+                f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+                params={"since": response.json()["next_token"], "limit": 2}
+            )
+            assert response.status_code == 200
+            seen += [item["_id"] for item in response.json()["items"]]
+        if TestCatalogService.item_id:
+            assert TestCatalogService.item_id in seen
+
+        # The token a finished sync ended on does expire
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/items/changes",
+            params={"since": sync_token()}
+        )
+        assert response.status_code == 410
+
+    def test_item_json_types(self, store_id):
+        """Test ObjectIds and dates are serialized as strings."""
+        if not TestCatalogService.item_id:
+            pytest.skip("Item ID not available - create item test might have failed")
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items/{TestCatalogService.item_id}")
+        assert response.status_code == 200
+        item = response.json()
+        assert item["_id"] == TestCatalogService.item_id
+        assert item["store_id"] == store_id
+        assert isinstance(item["created_at"], str)
+
+    def test_search_spelling_correction(self, headers, store_id):
+        """Test search correcting misspelled words and matching synonyms."""
+        response = requests.post(
+            f"{BASE_URL}{API_PREFIX}/items",
+            headers=headers,
+            json={
+                "store_id": store_id, "name": "Heirloom Coriander", "description": "Fresh herb bunch",
+                "price": 1.2, "unit": "bunch"
+            }
+        )
+        assert response.status_code == 201
+        probe_id = response.json()["_id"]
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/search",
+            params={"q": "heirlom", "store_id": store_id}
+        )
+        assert response.status_code == 200
+        assert response.json()["corrected_query"] == "heirloom"
+        assert probe_id in [item["_id"] for item in response.json()["items"]]
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/search",
+            params={"q": "cilantro", "store_id": store_id}
+        )
+        assert response.status_code == 200
+        assert probe_id in [item["_id"] for item in response.json()["items"]]
+
+        requests.delete(f"{BASE_URL}{API_PREFIX}/items/{probe_id}", headers=headers)
+
+    def test_similar_items(self, headers, store_id):
+        """Test similar items listing items that share tags and category."""
+        ids = []
+        for name in ("Similar Gala Apple", "Similar Fuji Apple"):
+            response = requests.post(
+                f"{BASE_URL}{API_PREFIX}/items",
+                headers=headers,
+                json={
+                    "store_id": store_id, "name": name, "description": "Crisp apple", "price": 1.5,
+                    "unit": "each", "category": ["Fruit"], "tags": ["apple", "similar-probe"]
+                }
+            )
+            assert response.status_code == 201
+            ids.append(response.json()["_id"])
+
+        # Lists are updated in the background shortly after a change
+        for _ in range(20):
+            response = requests.get(f"{BASE_URL}{API_PREFIX}/items/{ids[0]}/similar", params={"limit": 5})
+            assert response.status_code == 200
+            if any(item["_id"] == ids[1] for item in response.json()):
+                break
+            time.sleep(0.5)
+        similar = response.json()
+        assert similar[0]["_id"] == ids[1]
+        assert 0 < similar[0]["score"] <= 1
+
+        response = requests.get(f"{BASE_URL}{API_PREFIX}/items/invalid-id/similar")
+        assert response.status_code == 400
+
+        for item_id in ids:
+            requests.delete(f"{BASE_URL}{API_PREFIX}/items/{item_id}", headers=headers)
+
+    def test_store_menu_snapshot(self, store_id):
+        """Test the store menu document and its ETag revalidation."""
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/menu",
+            headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        menu = response.json()
+        assert menu["store_id"] == store_id
+        for key in ("categories", "featured", "category_items", "items"):
+            assert key in menu
+        for item_ids in menu["category_items"].values():
+            assert all(item_id in menu["items"] for item_id in item_ids)
+
+        response = requests.get(
+            f"{BASE_URL}{API_PREFIX}/stores/{store_id}/menu",
+            headers={"If-None-Match": response.headers["ETag"]}
+        )
+        assert response.status_code == 304
+
     def test_delete_item(self, headers):
         """Test deleting an item."""
         if not TestCatalogService.item_id:
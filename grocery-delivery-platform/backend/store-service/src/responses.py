@@ -0,0 +1,32 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def encode_default(value: Any) -> Any:
+    """Serialize what orjson has no native support for: ObjectIds, Decimals and models."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class MongoJSONResponse(JSONResponse):
+    """orjson-rendered response for profile documents straight from the database.
+
+    Returned directly by the routes, which skips FastAPI's response model
+    validation and `jsonable_encoder` pass over data that was validated when
+    it was stored.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
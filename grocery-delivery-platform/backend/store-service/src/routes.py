@@ -5,10 +5,11 @@ from bson import ObjectId
 
 from models import StoreOwnerProfile, StoreOwnerProfileUpdate
 from db import store_profile_db
+from responses import MongoJSONResponse
 
 # Setup OAuth2 with Bearer token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
-router = APIRouter()
+router = APIRouter(default_response_class=MongoJSONResponse)
 
 
 async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
@@ -42,7 +43,7 @@ async def create_profile(
     
     # Create the profile
     created_profile = await store_profile_db.create_profile(profile)
-    return created_profile
+    return MongoJSONResponse(created_profile, status_code=status.HTTP_201_CREATED)
 
 
 @router.get("/profiles/me", response_model=Dict[str, Any])
@@ -56,7 +57,7 @@ async def get_my_profile(user_id: str = Depends(get_current_user_id)):
             detail="Profile not found for the current user"
         )
     
-    return profile
+    return MongoJSONResponse(profile)
 
 
 @router.get("/profiles/{profile_id}", response_model=Dict[str, Any])
@@ -72,7 +73,7 @@ async def get_profile(
             detail=f"Profile with ID {profile_id} not found"
         )
     
-    return profile
+    return MongoJSONResponse(profile)
 
 
 @router.put("/profiles/{profile_id}", response_model=Dict[str, Any])
@@ -100,7 +101,7 @@ async def update_profile(
     
     # Update the profile
     updated_profile = await store_profile_db.update_profile(profile_id, update_data)
-    return updated_profile
+    return MongoJSONResponse(updated_profile)
 
 
 @router.delete("/profiles/{profile_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -139,7 +140,7 @@ async def list_profiles(
     """List store owner profiles with pagination and filtering."""
     if search:
         # If search term is provided, use text search
-        return await store_profile_db.search_profiles(search, skip, limit)
+        return MongoJSONResponse(await store_profile_db.search_profiles(search, skip, limit))
     
     # Build filter based on query parameters
     filters = {}
@@ -147,7 +148,7 @@ async def list_profiles(
         filters["category"] = category
     
     # Use regular listing with optional filters
-    return await store_profile_db.list_profiles(skip, limit, filters)
+    return MongoJSONResponse(await store_profile_db.list_profiles(skip, limit, filters))
 
 
 @router.get("/health", status_code=200)